@@ -0,0 +1,199 @@
+"""
+Local stand-in of the OLS API, serving the term searches and term lookups of the tier 1 conversion
+from a fixture file, so that the OLS code paths are benchmarked and tested without network.
+Each response can be delayed by --latency seconds plus up to --jitter seconds, and answered with
+503 at --failure_rate, to mimic a slow or unreliable OLS. Lookups missing from the fixtures find nothing,
+like OLS for unknown terms, or with --missing synthetic, find a made up but deterministic term.
+With --record, missing lookups are fetched from the real OLS and added to the fixture file instead.
+
+    python3 benchmarks/ols_standin.py --fixtures ols_fixtures.json --latency 0.08 --jitter 0.04
+    OLS_BASE_URL=http://127.0.0.1:8802/ols4 python3 dcp_to_tier1.py -s spreadsheet.xlsx
+
+    GET /ols4/api/search?q=<term>&ontology=<ontology>
+    GET /ols4/api/ontologies/<ontology>/terms/<double encoded IRI>
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+from urllib.request import urlopen
+
+ROOT = '/ols4'
+OLS_BASE_URL = 'https://www.ebi.ac.uk/ols4'
+MISSING = ['not_found', 'synthetic']
+
+
+def define_parser():
+    parser = argparse.ArgumentParser(description='Local stand-in of the OLS API')
+    parser.add_argument('--host', action='store', dest='host', type=str, required=False, default='127.0.0.1',
+                        help='address to listen on')
+    parser.add_argument('--port', '-p', action='store', dest='port', type=int, required=False, default=8802,
+                        help='port to listen on')
+    parser.add_argument('--fixtures', action='store', dest='fixtures', type=str, required=False,
+                        help='JSON fixture file of recorded responses')
+    parser.add_argument('--latency', action='store', dest='latency', type=float, required=False, default=0.0,
+                        help='seconds added to every response')
+    parser.add_argument('--jitter', action='store', dest='jitter', type=float, required=False, default=0.0,
+                        help='up to this many random seconds added to the latency')
+    parser.add_argument('--failure_rate', action='store', dest='failure_rate', type=float, required=False, default=0.0,
+                        help='fraction of requests answered with 503')
+    parser.add_argument('--missing', action='store', dest='missing', type=str, required=False, default='not_found',
+                        choices=MISSING, help='response to lookups missing from the fixtures, not found or a made up term')
+    parser.add_argument('--record', action='store', dest='record', type=str, required=False, nargs='?', const=OLS_BASE_URL,
+                        help=f'fetch missing lookups from this OLS ({OLS_BASE_URL} by default) into the fixture file')
+    parser.add_argument('--seed', action='store', dest='seed', type=int, required=False,
+                        help='seed of the latency and failure random numbers')
+    return parser
+
+
+def load_fixtures(fixtures_path: str) -> dict:
+    fixtures = {'search': {}, 'terms': {}}
+    if fixtures_path and os.path.exists(fixtures_path):
+        with open(fixtures_path) as fixtures_file:
+            fixtures.update(json.load(fixtures_file))
+    return fixtures
+
+
+def save_fixtures(fixtures: dict, fixtures_path: str):
+    with open(fixtures_path, 'w') as fixtures_file:
+        json.dump(fixtures, fixtures_file, indent=1, sort_keys=True)
+
+
+def fixture_key(path: str):
+    """Kind (search or terms) and fixture key (<ontology>/<term>) of a request path, None if not an OLS path"""
+    url = urlparse(path)
+    if url.path == f'{ROOT}/api/search':
+        query = parse_qs(url.query)
+        return 'search', f"{query.get('ontology', [''])[0]}/{query.get('q', [''])[0]}"
+    parts = url.path[len(ROOT):].split('/')
+    if url.path.startswith(f'{ROOT}/api/ontologies/') and len(parts) == 6 and parts[4] == 'terms':
+        # the IRI is encoded twice, e.g. http%253A%252F%252Fpurl.obolibrary.org%252Fobo%252FHsapDv_0000087
+        return 'terms', f'{parts[3]}/{unquote(unquote(parts[5])).rsplit("/", 1)[-1]}'
+    return None, None
+
+
+def trim(kind: str, response: dict) -> dict:
+    """Only the parts of a response that the conversion reads, to keep fixtures small"""
+    if kind == 'search':
+        docs = [{'obo_id': doc.get('obo_id'), 'label': doc.get('label')} for doc in response['response']['docs'][:1]]
+        return {'response': {'numFound': response['response']['numFound'], 'docs': docs}}
+    return {'label': response.get('label'), 'obo_id': response.get('obo_id')}
+
+
+def synthetic(kind: str, key: str) -> dict:
+    ontology, term = key.split('/', 1)
+    if kind == 'search':
+        obo_id = f'{ontology.upper()}:{zlib.crc32(term.encode()) % 10 ** 7:07d}'
+        return {'response': {'numFound': 1, 'docs': [{'obo_id': obo_id, 'label': term}]}}
+    return {'label': f'label of {term}', 'obo_id': term.replace('_', ':', 1)}
+
+
+class OlsStandIn(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, fixtures: dict = None, latency: float = 0.0, jitter: float = 0.0,
+                 failure_rate: float = 0.0, missing: str = 'not_found', record: str = None, seed: int = None):
+        super().__init__(address, OlsRequestHandler)
+        self.fixtures = fixtures if fixtures is not None else load_fixtures(None)
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.missing = missing
+        self.record = record
+        self.random = random.Random(seed)
+        # requests by outcome: served, missing, recorded, failed
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f'http://{self.server_address[0]}:{self.server_address[1]}{ROOT}'
+
+    def draw(self) -> tuple:
+        """Delay and failure of the next response"""
+        with self.lock:
+            return self.latency + self.random.uniform(0, self.jitter), self.random.random() < self.failure_rate
+
+    def lookup(self, kind: str, key: str, path: str):
+        """Response of a lookup, None if it is not found"""
+        with self.lock:
+            response = self.fixtures[kind].get(key)
+        if response is not None:
+            self.count('served')
+            return response
+        if self.record:
+            try:
+                with urlopen(self.record.rstrip('/') + path[len(ROOT):], timeout=30) as upstream:
+                    response = trim(kind, json.load(upstream))
+            except OSError:
+                response = None
+            if response is not None:
+                with self.lock:
+                    self.fixtures[kind][key] = response
+                self.count('recorded')
+                return response
+        self.count('missing')
+        if self.missing == 'synthetic':
+            return synthetic(kind, key)
+        # OLS finds no term for a search, and has no page for an unknown term
+        return {'response': {'numFound': 0, 'docs': []}} if kind == 'search' else None
+
+    def count(self, outcome: str):
+        with self.lock:
+            self.counts[outcome] += 1
+
+
+class OlsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        delay, failed = self.server.draw()
+        time.sleep(delay)
+        if failed:
+            self.server.count('failed')
+            self.send_json(503, {'error': 'Service Unavailable'})
+            return
+        kind, key = fixture_key(self.path)
+        if kind is None:
+            self.send_json(404, {'error': f'Not Found: {self.path}'})
+            return
+        response = self.server.lookup(kind, key, self.path)
+        if response is None:
+            self.send_json(404, {'error': f'Not Found: {key}'})
+        else:
+            self.send_json(200, response)
+
+    def send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    args = define_parser().parse_args()
+    if args.record and not args.fixtures:
+        define_parser().error('--record needs --fixtures to write the recorded responses to')
+    server = OlsStandIn((args.host, args.port), load_fixtures(args.fixtures), args.latency, args.jitter,
+                       args.failure_rate, args.missing, args.record, args.seed)
+    print(f'OLS stand-in at {server.base_url}, set OLS_BASE_URL to it')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.record:
+            save_fixtures(server.fixtures, args.fixtures)
+            print(f"{server.counts['recorded']} responses recorded in {args.fixtures}")
+        print(dict(server.counts))
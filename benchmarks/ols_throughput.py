@@ -0,0 +1,110 @@
+"""
+Throughput of the tier 1 conversion of a flat file under different OLS network conditions,
+against the local OLS stand-in (ols_standin.py). Each profile starts a stand-in with its latency,
+jitter and failure rate and converts the flat file with cold OLS caches, reporting the conversion
+time, the rows converted per second and the OLS requests by outcome.
+
+    python3 benchmarks/ols_throughput.py -s data/denormalised_spreadsheet/<name>_denormalised.csv
+        [--fixtures ols_fixtures.json] [--profiles local realistic degraded]
+
+No recorded fixture file is bundled, since recording needs the real OLS (ols_standin.py --record).
+Lookups missing from the fixtures get synthetic responses, so any flat file can be benchmarked,
+but with only synthetic responses the results differ from OLS in two ways:
+- responses hold only the label and ID the conversion reads, much smaller than the OLS pages,
+  so transfer and JSON parsing time is underestimated. Recorded fixtures are trimmed the same way
+- every term is found and its lookup cached, while OLS finds nothing for unknown or misspelled
+  terms, and those lookups are not cached but sent again by every edit function and chunk that
+  meets the term. With --missing not_found, lookups missing from the fixtures are not found
+The number of synthetic responses is reported with each profile. Use a recorded fixture file of
+the spreadsheets to compare request counts and the cache hits with the real OLS.
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from benchmarks.ols_standin import MISSING, OlsStandIn, load_fixtures
+
+# seconds of latency and jitter, and fraction of failed requests
+PROFILES = {
+    'local': {'latency': 0.0, 'jitter': 0.0, 'failure_rate': 0.0},
+    'realistic': {'latency': 0.08, 'jitter': 0.04, 'failure_rate': 0.0},
+    'degraded': {'latency': 0.4, 'jitter': 0.3, 'failure_rate': 0.1},
+}
+
+
+def define_parser():
+    parser = argparse.ArgumentParser(description='Tier 1 conversion throughput under OLS network conditions')
+    parser.add_argument('--flat_path', '-s', action='store', dest='flat_path', type=str, required=True,
+                        help='flat dcp spreadsheet path')
+    parser.add_argument('--fixtures', action='store', dest='fixtures', type=str, required=False,
+                        help='JSON fixture file of recorded OLS responses')
+    parser.add_argument('--profiles', action='store', nargs='+', default=list(PROFILES), choices=list(PROFILES),
+                        dest='profiles', type=str, required=False, help='network conditions to benchmark')
+    parser.add_argument('--missing', action='store', dest='missing', type=str, required=False, default='synthetic',
+                        choices=MISSING, help='response to lookups missing from the fixtures, a made up term or not found')
+    parser.add_argument('--seed', action='store', dest='seed', type=int, required=False, default=0,
+                        help='seed of the latency and failure random numbers')
+    return parser
+
+
+def clear_ols_caches():
+    from src.convert_flat_dcp_to_tier1 import ols_search, ols_session, ols_term
+    for cached in (ols_search, ols_term, ols_session):
+        cached.cache_clear()
+
+
+def run_profile(flat_path: str, fixtures: dict, profile: dict, seed: int = 0, missing: str = 'synthetic') -> dict:
+    """Convert flat_path against a stand-in with the profile, with cold OLS caches"""
+    from src.convert_flat_dcp_to_tier1 import main as dcp_to_tier1
+    from src.table_io import read_table
+    server = OlsStandIn(('127.0.0.1', 0), fixtures, missing=missing, seed=seed, **profile)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = os.environ.get('OLS_BASE_URL')
+    os.environ['OLS_BASE_URL'] = server.base_url
+    clear_ols_caches()
+    try:
+        with tempfile.TemporaryDirectory() as output_dir, contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            dcp_to_tier1(flat_path, output_dir, validate='off')
+            seconds = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+        if base_url is None:
+            os.environ.pop('OLS_BASE_URL')
+        else:
+            os.environ['OLS_BASE_URL'] = base_url
+        clear_ols_caches()
+    rows = len(read_table(flat_path))
+    return {'seconds': seconds, 'rows_per_second': rows / seconds, 'requests': sum(server.counts.values()),
+            **server.counts}
+
+
+def main(flat_path: str, fixtures_path: str = None, profiles: list = list(PROFILES), seed: int = 0,
+         missing: str = 'synthetic') -> dict:
+    fixtures = load_fixtures(fixtures_path)
+    missing_label = 'synthetic' if missing == 'synthetic' else 'not found'
+    results = {}
+    for name in profiles:
+        results[name] = run_profile(flat_path, fixtures, PROFILES[name], seed, missing)
+        result = results[name]
+        print(f"{name:<10} {result['seconds']:8.2f} s {result['rows_per_second']:10.1f} rows/s "
+              f"{result['requests']:5d} requests ({result.get('served', 0)} served, "
+              f"{result.get('missing', 0)} {missing_label}, {result.get('failed', 0)} failed)")
+    if missing == 'synthetic' and any(result.get('missing', 0) for result in results.values()):
+        print('Synthetic responses are smaller than OLS pages and always found, see the module docstring')
+    return results
+
+
+if __name__ == '__main__':
+    args = define_parser().parse_args()
+    main(args.flat_path, args.fixtures, args.profiles, args.seed, args.missing)
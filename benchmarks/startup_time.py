@@ -0,0 +1,62 @@
+"""
+Startup benchmark of the entry points: import time of each script / module, measured with
+`python -X importtime` in fresh interpreters, against the budgets of startup_budget.json.
+Also fails if an entry point imports a dependency that should only be loaded at first use.
+
+    python3 benchmarks/startup_time.py [-n 5] [--tolerance 0.2]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startup_budget.json')
+ENTRY_POINTS = ['dcp_to_tier1', 'run_bionetwork', 'serve_tier1', 'inspect_spreadsheets', 'src.flatten_dcp',
+                'src.convert_flat_dcp_to_tier1']
+# loaded at first use only, pandas itself already imports dateutil and pyarrow
+LAZY_MODULES = ['requests', 'openpyxl', 'duckdb', 'anndata']
+
+
+def define_parser():
+    parser = argparse.ArgumentParser(description='Import time of the entry points')
+    parser.add_argument('-n', '--runs', action='store', dest='runs', type=int, required=False, default=5,
+                        help='number of interpreters started per entry point, the median is reported')
+    parser.add_argument('--tolerance', action='store', dest='tolerance', type=float, required=False, default=0.2,
+                        help='fraction above the budget that is still accepted')
+    return parser
+
+
+def import_time(module: str) -> tuple:
+    """Cumulative import time of module in ms and the lazy modules it loaded, in a fresh interpreter"""
+    check = f"import {module}, sys, json; print(json.dumps([lazy for lazy in {LAZY_MODULES!r} if lazy in sys.modules]))"
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', check], cwd=PROJECT_ROOT,
+                            capture_output=True, text=True, check=True)
+    # lines are "import time: self [us] | cumulative | imported package"
+    cumulative = [int(line.split('|')[1]) for line in result.stderr.splitlines()
+                  if line.startswith('import time:') and line.split('|')[2].strip() == module]
+    return cumulative[-1] / 1000, json.loads(result.stdout)
+
+
+def main(runs: int = 5, tolerance: float = 0.2) -> bool:
+    with open(BUDGET_PATH) as budget_file:
+        budgets = json.load(budget_file)
+    passed = True
+    for module in ENTRY_POINTS:
+        timings = [import_time(module) for _ in range(runs)]
+        median = statistics.median(timing for timing, _ in timings)
+        loaded = timings[0][1]
+        over_budget = median > budgets[module] * (1 + tolerance)
+        status = 'ok' if not over_budget and not loaded else 'FAILED'
+        print(f'{module:<32} {median:8.1f} ms (budget {budgets[module]} ms) {status}')
+        if loaded:
+            print(f'    imports {loaded} at startup')
+        passed &= status == 'ok'
+    return passed
+
+
+if __name__ == '__main__':
+    args = define_parser().parse_args()
+    sys.exit(0 if main(args.runs, args.tolerance) else 1)
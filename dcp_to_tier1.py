@@ -1,8 +1,14 @@
 import os
+import sys
 import argparse
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from src.flatten_dcp import main as flatten_dcp
-from src.convert_flat_dcp_to_tier1 import main as dcp_to_tier1
+from src.flatten_dcp import main as flatten_dcp, ENGINES, INPUT_DIR, add_plan_arguments, join_limits
+from src.convert_flat_dcp_to_tier1 import main as dcp_to_tier1, TEMPLATES, TIER1_FORMATS, template_list
+from src.tier1_validator import VALIDATE
+from src.table_io import TABLE_FORMATS
+from src.spreadsheet_paths import expand_spreadsheet_paths
 
 
 FLAT_DIR = 'data/denormalised_spreadsheet'
@@ -12,29 +18,129 @@ OUTPUT_DIR = 'data/tier1_output'
 def define_parser():
     """Defines and returns the argument parser."""
     parser = argparse.ArgumentParser(description='Parser for the arguments')
-    parser.add_argument('-s', '--spreadsheet_path', action='store',
-                        dest='spreadsheet_path', type=str, required=True, help='dcp spreadsheet path')
-    parser.add_argument("-g", "--group_field", action="store", default='specimen_from_organism.biomaterial_core.biomaterial_id',
-                        dest="group_field", type=str, required=False, help="DCP field to group output with")
+    parser.add_argument('-s', '--spreadsheet_path', action='store', nargs='+', default=[],
+                        dest='spreadsheet_path', type=str, required=False, help='dcp spreadsheet paths or glob patterns')
+    parser.add_argument('--manifest', action='store', dest='manifest', type=str, required=False,
+                        help='file listing dcp spreadsheet paths or glob patterns, one per line')
+    parser.add_argument('-j', '--jobs', action='store', default=1, dest='jobs', type=int, required=False,
+                        help='number of spreadsheets converted in parallel')
+    parser.add_argument("-g", "--group_field", action="store", default=['specimen_from_organism.biomaterial_core.biomaterial_id'], nargs='+',
+                        dest="group_field", type=str, required=False, help="DCP fields to group output with, one output per field")
     parser.add_argument('-d', action='store_true', dest='denormalised', required=False,
                         help='use the denormalised flat file instead of the grouped one')
+    parser.add_argument('--with_denormalised', action='store_true', dest='with_denormalised', required=False,
+                        help='convert the denormalised flat file as well as the grouped ones')
+    parser.add_argument('-f', '--format', action='store', default='csv', choices=TIER1_FORMATS,
+                        dest='table_format', type=str, required=False,
+                        help='format of the flat files and tier 1 obs table, h5ad flat files are written as csv')
+    parser.add_argument('--chunk_rows', action='store', default=None, dest='chunk_rows', type=int, required=False,
+                        help='convert the flat files this many rows at a time, bounding memory of the tier 1 conversion')
+    parser.add_argument('--templates', action='store', default=['golden'], dest='templates', type=template_list, required=False,
+                        help=f"comma separated tier 1 spreadsheet templates to write from one conversion, of {', '.join(TEMPLATES)}")
+    parser.add_argument('--validate', action='store', default='warn', choices=VALIDATE, dest='validate', type=str, required=False,
+                        help='validate each tier 1 obs table before writing it, abort to fail the spreadsheet on any problem')
+    parser.add_argument('--tier1_only', action='store_true', dest='tier1_only', required=False,
+                        help='flatten only the fields needed for the tier 1 conversion')
+    parser.add_argument('--engine', action='store', default='pandas', choices=ENGINES,
+                        dest='engine', type=str, required=False, help='engine to join and group worksheets with')
+    parser.add_argument('--no-sheet-cache', action='store_false', dest='sheet_cache', required=False,
+                        help='always parse the spreadsheet instead of using the cleaned sheets cache')
+    parser.add_argument('--profile', action='store_true', dest='profile', required=False,
+                        help='sample each conversion into a profile in data/profiles, with a summary of all of them')
+    add_plan_arguments(parser)
     return parser
 
-def main(spreadsheet_path, flat_dir, output_dir, group_field, denormalised):
-
+def main(spreadsheet_path, flat_dir, output_dir, group_field, denormalised, table_format='csv', tier1_only=False,
+         engine='pandas', use_sheet_cache=True, with_denormalised=False, plan_only=False, limits=None,
+         check_links='warn', chunk_rows=None, templates=('golden',), validate='warn', tmp_dir=INPUT_DIR):
+    """
+    Flatten the spreadsheet once and convert each of its views: one per group field (a field or a list of them),
+    plus the denormalised one if with_denormalised. Returns the converted flat file paths.
+    The cleaned copy of the spreadsheet is saved in tmp_dir.
+    With plan_only, only print the join plan of the spreadsheet.
+    """
     os.makedirs(flat_dir, exist_ok=True)
     os.makedirs(output_dir, exist_ok=True)
 
-    if group_field == "" or denormalised:
-        denormalised = True
-        group_field = ""
+    group_fields = [group_field] if isinstance(group_field, str) else list(group_field)
+    if denormalised:
+        group_fields = [""]
+    elif with_denormalised:
+        group_fields.append("")
+
+    flat_format = table_format if table_format in TABLE_FORMATS else 'csv'
+    flat_paths = flatten_dcp(spreadsheet_path, flat_dir, group_fields, flat_format, tier1_only, engine, use_sheet_cache,
+                             plan_only, limits, check_links, tmp_dir)
+    # a missing group field falls back to the denormalised file, convert every file once
+    flat_paths = list(dict.fromkeys(flat_paths.values()))
+    for flat_path in flat_paths:
+        dcp_to_tier1(flat_path, output_dir, table_format, chunk_rows, templates, validate)
+    return flat_paths
+
+def profile_name(spreadsheet_path):
+    """Name of the spreadsheet with a hash of its absolute path, unique for spreadsheets of the same name"""
+    path_hash = hashlib.sha1(os.path.abspath(spreadsheet_path).encode()).hexdigest()[:8]
+    return f'{os.path.splitext(os.path.basename(spreadsheet_path))[0]}-{path_hash}'
+
+def convert_spreadsheet(spreadsheet_path, flat_dir, output_dir, options, profile=False):
+    print(f"=====Processing {spreadsheet_path}=====")
+    if not profile:
+        return main(spreadsheet_path, flat_dir, output_dir, **options)
+    from src.profiler import SamplingProfiler, write_speedscope
+    profiler = SamplingProfiler()
+    try:
+        with profiler:
+            return main(spreadsheet_path, flat_dir, output_dir, **options)
+    finally:
+        write_speedscope(profiler, profile_name(spreadsheet_path))
 
-    flatten_dcp(spreadsheet_path, flat_dir, group_field)
-    flat_filename = os.path.basename(spreadsheet_path).replace('.xlsx', '_denormalised.csv' if denormalised else '.csv')
-    dcp_to_tier1(os.path.join(flat_dir, flat_filename), output_dir)
+def convert_batch(spreadsheet_paths, flat_dir, output_dir, jobs=1, profile=False, **options):
+    """
+    Convert each spreadsheet with the options of main, in this process or over a pool of jobs processes,
+    so that imports and OLS lookups are shared between spreadsheets. A failing spreadsheet does not stop
+    the batch. Returns the error of each spreadsheet, None if it was converted.
+    With profile, each conversion is sampled into a profile file and a summary of all of them is written.
+    """
+    statuses = {}
+    def report(spreadsheet_path, error):
+        statuses[spreadsheet_path] = error
+        print(f"[{len(statuses)}/{len(spreadsheet_paths)}] {spreadsheet_path}: {'ok' if error is None else f'failed {error}'}")
+    if jobs <= 1:
+        for spreadsheet_path in spreadsheet_paths:
+            try:
+                convert_spreadsheet(spreadsheet_path, flat_dir, output_dir, options, profile)
+                report(spreadsheet_path, None)
+            except Exception as e:
+                report(spreadsheet_path, repr(e))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(convert_spreadsheet, spreadsheet_path, flat_dir, output_dir, options, profile): spreadsheet_path
+                       for spreadsheet_path in spreadsheet_paths}
+            for future in as_completed(futures):
+                error = future.exception()
+                report(futures[future], None if error is None else repr(error))
+    if profile and spreadsheet_paths:
+        from src.profiler import PROFILE_DIR, write_summary
+        write_summary([os.path.join(PROFILE_DIR, f'{profile_name(spreadsheet_path)}.speedscope.json')
+                       for spreadsheet_path in spreadsheet_paths])
+    return statuses
 
 if __name__ == "__main__":
-    args = define_parser().parse_args()
+    parser = define_parser()
+    args = parser.parse_args()
+    if not args.spreadsheet_path and not args.manifest:
+        parser.error('at least one of -s/--spreadsheet_path or --manifest is required')
 
-    main(spreadsheet_path=args.spreadsheet_path, flat_dir=FLAT_DIR, output_dir=OUTPUT_DIR,
-        group_field=args.group_field, denormalised=args.denormalised)
\ No newline at end of file
+    spreadsheet_paths = expand_spreadsheet_paths(args.spreadsheet_path, args.manifest)
+    statuses = convert_batch(spreadsheet_paths, flat_dir=FLAT_DIR, output_dir=OUTPUT_DIR, jobs=args.jobs, profile=args.profile,
+        group_field=args.group_field, denormalised=args.denormalised, table_format=args.table_format,
+        tier1_only=args.tier1_only, engine=args.engine, use_sheet_cache=args.sheet_cache,
+        with_denormalised=args.with_denormalised, plan_only=args.plan_only, limits=join_limits(args),
+        check_links=args.check_links, chunk_rows=args.chunk_rows, templates=args.templates,
+        validate=args.validate)
+    failed = [spreadsheet_path for spreadsheet_path, error in statuses.items() if error is not None]
+    if len(spreadsheet_paths) > 1:
+        print(f'Converted {len(statuses) - len(failed)} of {len(statuses)} spreadsheets')
+    for spreadsheet_path in failed:
+        print(f'Failed: {spreadsheet_path}: {statuses[spreadsheet_path]}')
+    sys.exit(1 if failed or not spreadsheet_paths else 0)
\ No newline at end of file
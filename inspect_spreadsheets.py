@@ -0,0 +1,120 @@
+"""
+Inspect DCP spreadsheets without flattening them: tab names, dimensions, header rows and the link
+topology of each file entity, printed as JSON to schedule bionetwork batches and estimate their cost.
+Workbooks are opened read-only and only the header and field description rows of each tab are read.
+Row counts come from the sheet dimensions, so they include trailing formatted but empty rows.
+Vague friendly names are renamed and links derived from the headers alone, so unlike flattening,
+a link field that is empty in every row still counts as a link.
+"""
+import argparse
+import json
+import os
+import sys
+
+from src.flatten_dcp import (FIRST_DATA_LINE, INPUT_DIR, design_paths, rename_vague_field,
+                             uses_vague_names)
+from src.spreadsheet_paths import expand_spreadsheet_paths
+
+REPORT_ENTITIES = ['Analysis file', 'Sequence file', 'Image file']
+# the programmatic name is the third description row, below the header
+PROGRAM_NAME_ROW = 3
+
+
+def define_parser():
+    parser = argparse.ArgumentParser(description='Inspect DCP spreadsheets without flattening them')
+    parser.add_argument('-s', '--spreadsheet_path', action='store', nargs='+', default=[],
+                        dest='spreadsheet_path', type=str, required=False, help='dcp spreadsheet paths or glob patterns')
+    parser.add_argument('--manifest', action='store', dest='manifest', type=str, required=False,
+                        help='file listing dcp spreadsheet paths or glob patterns, one per line')
+    parser.add_argument('--csv', '-c', action='store', dest='csv', type=str, required=False,
+                        help=f'bionetwork CSV file, inspecting all of its spreadsheets in {INPUT_DIR}')
+    parser.add_argument('--output', '-o', action='store', dest='output', type=str, required=False,
+                        help='JSON file to write, by default the JSON is printed')
+    return parser
+
+
+def sheet_summary(worksheet) -> dict:
+    if worksheet.max_row is None:
+        # no dimensions saved in the sheet, count its rows
+        worksheet.calculate_dimension(force=True)
+    header_rows = [list(row) for row in worksheet.iter_rows(max_row=FIRST_DATA_LINE + 1, values_only=True)]
+    header_rows += [[]] * (FIRST_DATA_LINE + 1 - len(header_rows))
+    fields = header_rows[0]
+    program_names = header_rows[PROGRAM_NAME_ROW] + [None] * (len(fields) - len(header_rows[PROGRAM_NAME_ROW]))
+    columns = [(field, program_name) for field, program_name in zip(fields, program_names) if field is not None]
+    return {
+        'name': worksheet.title,
+        'rows': max(0, (worksheet.max_row or 0) - FIRST_DATA_LINE - 1),
+        'columns': len(columns),
+        'fields': [str(field) for field, _ in columns],
+        'programmatic_names': [program_name for _, program_name in columns]
+    }
+
+
+def inspect_spreadsheet(spreadsheet_path: str) -> dict:
+    import openpyxl
+    workbook = openpyxl.load_workbook(spreadsheet_path, read_only=True, data_only=True)
+    try:
+        sheets = [sheet_summary(worksheet) for worksheet in workbook.worksheets]
+    finally:
+        workbook.close()
+    # tabs without data rows are removed before flattening
+    all_fields = {sheet['name']: sheet['fields'] for sheet in sheets if sheet['rows']}
+    vague_names = uses_vague_names(all_fields)
+    if vague_names:
+        for sheet in sheets:
+            if sheet['name'] in all_fields:
+                all_fields[sheet['name']] = [rename_vague_field(field, sheet['name'], program_name)
+                                             for field, program_name in zip(sheet['fields'], sheet['programmatic_names'])]
+    report_entities = {}
+    for report_entity in [entity for entity in REPORT_ENTITIES if entity in all_fields]:
+        paths, links = design_paths(report_entity, all_fields.get)
+        report_entities[report_entity] = {
+            'rows': next(sheet['rows'] for sheet in sheets if sheet['name'] == report_entity),
+            'paths': paths,
+            'links': [{'source': link.source, 'target': link.target, 'source_field': link.source_field,
+                       'target_field': link.target_field} for link in links]
+        }
+    return {
+        'spreadsheet': spreadsheet_path,
+        'size_bytes': os.path.getsize(spreadsheet_path),
+        'vague_names': vague_names,
+        'sheets': sheets,
+        'report_entities': report_entities
+    }
+
+
+def inspect_spreadsheets(spreadsheet_paths: list) -> list:
+    """Inspection of each spreadsheet, or its error, in order"""
+    inspections = []
+    for spreadsheet_path in spreadsheet_paths:
+        try:
+            inspections.append(inspect_spreadsheet(spreadsheet_path))
+        except Exception as e:
+            inspections.append({'spreadsheet': spreadsheet_path, 'error': repr(e)})
+    return inspections
+
+
+def bionetwork_spreadsheets(csv: str) -> list:
+    import pandas as pd
+    spreadsheets = pd.read_csv(csv)['spreadsheet'].drop_duplicates()
+    return [os.path.join(INPUT_DIR, spreadsheet) for spreadsheet in spreadsheets]
+
+
+if __name__ == '__main__':
+    parser = define_parser()
+    args = parser.parse_args()
+    if not args.spreadsheet_path and not args.manifest and not args.csv:
+        parser.error('at least one of -s/--spreadsheet_path, --manifest or --csv is required')
+    spreadsheet_paths = expand_spreadsheet_paths(args.spreadsheet_path, args.manifest)
+    if args.csv:
+        spreadsheet_paths = list(dict.fromkeys(spreadsheet_paths + bionetwork_spreadsheets(args.csv)))
+    inspections = inspect_spreadsheets(spreadsheet_paths)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(inspections, output, indent=2, default=str)
+        print(f'Inspection of {len(inspections)} spreadsheets created at {args.output}')
+    else:
+        json.dump(inspections, sys.stdout, indent=2, default=str)
+        print()
+    sys.exit(1 if any('error' in inspection for inspection in inspections) else 0)
@@ -1,37 +1,74 @@
 import os
+import sys
 from os.path import basename, splitext
 import argparse
-import zipfile
 
 import pandas as pd
-from dcp_to_tier1 import main as dcp_to_tier1
+from dcp_to_tier1 import convert_batch
+from src.task_queue import TaskQueue, run_worker, task_name
+from src.zip_writer import CODECS, normalise_xlsx, write_zip_if_changed
 
 INPUT_DIR = 'data/dcp_spreadsheet'
 FLAT_DIR = 'data/denormalised_spreadsheet'
 OUTPUT_DIR = 'data/tier1_output'
 GROUP_FIELD = 'specimen_from_organism.biomaterial_core.biomaterial_id'
 DENORMALISED = False
+WORK_DIR = 'data/work_queue'
 
 def define_parser():
     parser = argparse.ArgumentParser(description='Run bionetwork script')
-    parser.add_argument('--bionetwork', '-b', action='store', dest='bionetwork', type=str, 
-                        required=True, help='Name of the bionetwork to process')
+    bionetworks = parser.add_mutually_exclusive_group(required=True)
+    bionetworks.add_argument('--bionetwork', '-b', action='store', dest='bionetwork', type=str,
+                             help='Name of the bionetwork to process')
+    bionetworks.add_argument('--all', action='store_const', const=None, dest='bionetwork',
+                             help='process all bionetworks of the CSV file, converting each spreadsheet once')
     parser.add_argument('--csv', '-c', action='store', dest='csv', type=str,
                         required=False, default='data/bionetworks.csv', help='Path to bionetwork CSV file')
     parser.add_argument('--group_field', '-g', action='store', dest='group_field', type=str,
                         required=False, default=GROUP_FIELD, help='DCP field to group output with')
     parser.add_argument('--denormalised', '-d', action='store_true', dest='denormalised',
                         required=False, default=DENORMALISED, help='use the denormalised flat file instead of the grouped one')
+    parser.add_argument('--with_denormalised', action='store_true', dest='with_denormalised', required=False,
+                        help='zip the denormalised tier 1 files as well as the grouped ones, from a single flatten pass')
     parser.add_argument('--format', '-f', action='store', dest='output_format', type=str,
-                        required=False, default='both', help='Output format (csv, xlsx, both)')
+                        required=False, default='both', choices=['csv', 'xlsx', 'both', 'parquet', 'feather', 'h5ad'],
+                        help='Output format (csv, xlsx, both, parquet, feather, h5ad)')
+    parser.add_argument('--tier1_only', action='store_true', dest='tier1_only', required=False,
+                        help='flatten only the fields needed for the tier 1 conversion')
+    parser.add_argument('--workers', '-w', action='store', dest='workers', type=int, required=False, default=1,
+                        help='number of processes converting spreadsheets in parallel')
+    parser.add_argument('--zip_codec', action='store', dest='zip_codec', type=str, required=False, default='stored',
+                        choices=list(CODECS), help='compression of the zip file members')
+    parser.add_argument('--zip_level', action='store', dest='zip_level', type=int, required=False, default=None,
+                        help='compression level of the zip codec')
+    parser.add_argument('--profile', action='store_true', dest='profile', required=False,
+                        help='sample each conversion into a profile in data/profiles, with a summary of all of them')
+    parser.add_argument('--worker', action='store_true', dest='worker', required=False,
+                        help='pull spreadsheets from the task queue in --work_dir, shared with workers on other nodes')
+    parser.add_argument('--work_dir', action='store', dest='work_dir', type=str, required=False, default=WORK_DIR,
+                        help='shared work directory of the task queue, one per build')
     return parser
 
-def make_zipfile(input_filenames:list, output_filename:str, filename_mapping:dict=None):
-    with zipfile.ZipFile(output_filename, "w") as zip_file:
-        for filename in input_filenames:
-            arcname = filename_mapping.get(filename, os.path.basename(filename)) if filename_mapping else os.path.basename(filename)
-            zip_file.write(filename, arcname=arcname)
-    print(f"Zip file created at {output_filename}")
+def make_zipfile(input_filenames:list, output_filename:str, filename_mapping:dict=None, codec:str='stored',
+                 level:int=None):
+    """
+    Deterministic zip of the input files, compressed in parallel. An existing identical zip file is left
+    untouched, so unchanged bionetworks keep the same file and do not need to be uploaded again.
+    """
+    members = {}
+    for filename in sorted(input_filenames):
+        arcname = filename_mapping.get(filename, os.path.basename(filename)) if filename_mapping else os.path.basename(filename)
+        if arcname in members:
+            print(f"Skipping {filename}, {arcname} already in {output_filename}")
+            continue
+        with open(filename, 'rb') as input_file:
+            members[arcname] = input_file.read()
+        if filename.endswith('.xlsx'):
+            members[arcname] = normalise_xlsx(members[arcname])
+    if write_zip_if_changed(members, output_filename, codec, level):
+        print(f"Zip file created at {output_filename}")
+    else:
+        print(f"Zip file at {output_filename} is unchanged")
 
 def select_zip_files(xlsx_files, denormalised, output_format):
     selected_files = []
@@ -47,29 +84,115 @@ def select_zip_files(xlsx_files, denormalised, output_format):
     return selected_files
 
 def orig_filename(output_filename):
-    return basename(output_filename.replace('_denormalised', '').replace('_tier1', '').replace('.csv', '.xlsx'))
+    return basename(splitext(output_filename)[0].replace('_denormalised', '').replace('_tier1', '') + '.xlsx')
 
-def main(csv, bionetwork, group_field, denormalised, output_format):
-    df = pd.read_csv(csv)
-    xlsx_files = df.loc[df['bionetwork'] == bionetwork.lower(), 'spreadsheet'].tolist()
-    for xlsx_file in xlsx_files:
+def table_format(output_format):
+    return output_format if output_format in ('parquet', 'feather', 'h5ad') else 'csv'
+
+def convert_spreadsheets(xlsx_files, group_field, denormalised, output_format, tier1_only=False,
+                         with_denormalised=False, workers=1, profile=False):
+    """
+    Convert each unique spreadsheet once. With more than one worker, spreadsheets are spread over a
+    process pool whose workers are reused, so imports and the OLS lookups stay warm between spreadsheets.
+    A failing spreadsheet is reported and left out of the zip files instead of stopping the batch.
+    """
+    spreadsheet_paths = []
+    for xlsx_file in dict.fromkeys(xlsx_files):
         if xlsx_file not in os.listdir(INPUT_DIR):
             print(f"File {xlsx_file} not found in {INPUT_DIR}")
             continue
-        print(f"=====Processing {xlsx_file}=====")
-        dcp_to_tier1(os.path.join(INPUT_DIR, xlsx_file), FLAT_DIR, OUTPUT_DIR, group_field, denormalised)
-    
-    selected_files = select_zip_files(xlsx_files, denormalised, output_format)
-    
+        spreadsheet_paths.append(os.path.join(INPUT_DIR, xlsx_file))
+    statuses = convert_batch(spreadsheet_paths, FLAT_DIR, OUTPUT_DIR, jobs=workers, profile=profile, group_field=group_field,
+                             denormalised=denormalised, table_format=table_format(output_format),
+                             tier1_only=tier1_only, with_denormalised=with_denormalised)
+    return [basename(path) for path, error in statuses.items() if error is None]
+
+def zip_bionetwork(df, bionetwork, denormalised, output_format, with_denormalised=False, zip_codec='stored',
+                   zip_level=None, converted=None):
+    """
+    Zip the tier 1 files of the spreadsheets of a bionetwork. With converted, only the spreadsheets in it
+    are zipped, so the files left from an earlier run of a spreadsheet failing now are not.
+    """
+    xlsx_files = df.loc[df['bionetwork'] == bionetwork.lower(), 'spreadsheet'].tolist()
+    if converted is not None:
+        xlsx_files = [xlsx_file for xlsx_file in xlsx_files if xlsx_file in converted]
     study_dict = df[['spreadsheet','source_study']].set_index('spreadsheet').to_dict()['source_study']
-    files_mapping = {file: f"{study_dict.get(orig_filename(file), '')}{splitext(file)[1]}" for file in selected_files}
-    
-    denorm_fnm = "_denormalised" if denormalised else ""
     format_fnm = f"_{output_format}" if output_format != 'both' else ""
+    views = [True] if denormalised else [False, True] if with_denormalised else [False]
+    for view_denormalised in views:
+        selected_files = select_zip_files(xlsx_files, view_denormalised, output_format)
+        files_mapping = {file: f"{study_dict.get(orig_filename(file), '')}{splitext(file)[1]}" for file in selected_files}
 
-    output_filename = f"{OUTPUT_DIR}/{bionetwork}{denorm_fnm}{format_fnm}_tier1.zip"
-    make_zipfile(selected_files, output_filename, files_mapping)
+        denorm_fnm = "_denormalised" if view_denormalised else ""
+        output_filename = f"{OUTPUT_DIR}/{bionetwork}{denorm_fnm}{format_fnm}_tier1.zip"
+        make_zipfile(selected_files, output_filename, files_mapping, zip_codec, zip_level)
+
+def queue_worker(df, bionetworks, group_field, denormalised, output_format, tier1_only=False, with_denormalised=False,
+                 zip_codec='stored', zip_level=None, profile=False, work_dir=WORK_DIR):
+    """
+    Convert spreadsheets taken from the task queue in work_dir until none is left, then zip the bionetworks
+    with the spreadsheets whose task is done. Every worker seeds the queue with a task per spreadsheet and
+    a final zip task, each added once, so workers can start in any order on any node. Tasks run with the
+    options of the worker that added them. Returns whether no task failed.
+    """
+    queue = TaskQueue(work_dir)
+    selected = df['bionetwork'].isin([name.lower() for name in bionetworks])
+    options = {'group_field': group_field, 'denormalised': denormalised, 'output_format': output_format,
+               'tier1_only': tier1_only, 'with_denormalised': with_denormalised}
+    for xlsx_file in df.loc[selected, 'spreadsheet'].drop_duplicates():
+        queue.add(task_name(xlsx_file), stage=0, payload={'spreadsheet': xlsx_file, **options})
+    queue.add('zip', stage=1, payload={'bionetworks': bionetworks, 'zip_codec': zip_codec, 'zip_level': zip_level,
+                                       **options})
+
+    def handle(task):
+        payload = dict(task.payload)
+        if task.stage == 0:
+            xlsx_file = payload.pop('spreadsheet')
+            if not convert_spreadsheets([xlsx_file], workers=1, profile=profile, **payload):
+                raise RuntimeError(f'{xlsx_file} was not converted')
+            return {'spreadsheet': xlsx_file}
+        converted = {result['spreadsheet'] for result in queue.results('done').values() if 'spreadsheet' in result}
+        for bionetwork in payload['bionetworks']:
+            zip_bionetwork(df, bionetwork, payload['denormalised'], payload['output_format'],
+                           payload['with_denormalised'], payload['zip_codec'], payload['zip_level'], converted)
+        return {'bionetworks': payload['bionetworks']}
+
+    handled = run_worker(queue, handle)
+    failed = queue.results('failed')
+    print(f'Worker {queue.worker_id} ran {handled} tasks, the queue has {len(queue.results("done"))} done '
+          f'and {len(failed)} failed tasks')
+    for task_id, result in failed.items():
+        print(f"Failed task {task_id}: {result['error']}")
+    return not failed
+
+def main(csv, bionetwork, group_field, denormalised, output_format, tier1_only=False, with_denormalised=False,
+         workers=1, zip_codec='stored', zip_level=None, profile=False, worker=False, work_dir=WORK_DIR):
+    """
+    Convert the spreadsheets of a bionetwork, or of all bionetworks of the csv if bionetwork is None,
+    and zip the tier 1 files of each bionetwork. A spreadsheet listed in several bionetworks is converted once.
+    With worker, spreadsheets are converted by all workers sharing the task queue in work_dir.
+    Only converted spreadsheets are zipped. Returns whether every spreadsheet was converted.
+    """
+    df = pd.read_csv(csv)
+    bionetworks = df['bionetwork'].drop_duplicates().tolist() if bionetwork is None else [bionetwork]
+    if worker:
+        return queue_worker(df, bionetworks, group_field, denormalised, output_format, tier1_only, with_denormalised,
+                            zip_codec, zip_level, profile, work_dir)
+    selected = df['bionetwork'].isin([name.lower() for name in bionetworks])
+    xlsx_files = df.loc[selected, 'spreadsheet'].drop_duplicates().tolist()
+    converted = convert_spreadsheets(xlsx_files, group_field, denormalised, output_format,
+                                     tier1_only, with_denormalised, workers, profile)
+    for bionetwork in bionetworks:
+        zip_bionetwork(df, bionetwork, denormalised, output_format, with_denormalised, zip_codec, zip_level,
+                       converted)
+    failed = [xlsx_file for xlsx_file in xlsx_files if xlsx_file not in converted]
+    for xlsx_file in failed:
+        print(f'Failed: {xlsx_file} was not converted, it is left out of the zip files')
+    return not failed
 
 if __name__ == '__main__':
     args = define_parser().parse_args()
-    main(args.csv, args.bionetwork, args.group_field, args.denormalised, args.output_format)
\ No newline at end of file
+    converted = main(args.csv, args.bionetwork, args.group_field, args.denormalised, args.output_format,
+                     args.tier1_only, args.with_denormalised, args.workers, args.zip_codec, args.zip_level,
+                     args.profile, args.worker, args.work_dir)
+    sys.exit(0 if converted else 1)
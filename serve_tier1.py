@@ -0,0 +1,227 @@
+"""
+Local conversion service: an HTTP server wrapping dcp_to_tier1.main, so that curators can convert
+spreadsheets without paying for python, pandas and mapping imports and cold OLS lookups every time.
+Conversions run on a pool of long-lived worker processes, each keeping its imports and OLS lookups
+warm between requests. Each upload is converted in its own temporary directory, and its cleaned sheets
+are stored in the sheet cache only with --sheet_cache. Up to --queue_size requests wait for a free worker, any
+further request is refused with 503 until the queue drains.
+
+    POST /convert?filename=<name>.xlsx[&group_field=...][&denormalised=1][&with_denormalised=1]
+                  [&tier1_only=1][&engine=duckdb][&output=zip|csv|xlsx]
+         with the DCP spreadsheet as request body
+    GET  /health
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from os.path import basename, splitext
+from urllib.parse import parse_qs, urlparse
+
+from dcp_to_tier1 import main as dcp_to_tier1
+from src.flatten_dcp import ENGINES
+from src.zip_writer import normalise_xlsx, write_zip
+
+GROUP_FIELD = 'specimen_from_organism.biomaterial_core.biomaterial_id'
+OUTPUTS = {
+    'zip': 'application/zip',
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+}
+MAX_UPLOAD_BYTES = 200 * 1024 ** 2
+
+
+def define_parser():
+    parser = argparse.ArgumentParser(description='Local DCP to tier 1 conversion service')
+    parser.add_argument('--host', action='store', dest='host', type=str, required=False, default='127.0.0.1',
+                        help='address to listen on')
+    parser.add_argument('--port', '-p', action='store', dest='port', type=int, required=False, default=8801,
+                        help='port to listen on')
+    parser.add_argument('--workers', '-w', action='store', dest='workers', type=int, required=False, default=2,
+                        help='number of worker processes converting spreadsheets')
+    parser.add_argument('--queue_size', '-q', action='store', dest='queue_size', type=int, required=False, default=8,
+                        help='number of requests waiting for a worker before new ones are refused')
+    parser.add_argument('--timeout', action='store', dest='timeout', type=float, required=False, default=600,
+                        help='seconds to wait for a conversion before answering 504')
+    parser.add_argument('--sheet_cache', action='store_true', dest='sheet_cache', required=False,
+                        help='store the cleaned sheets of uploads in the sheet cache, so that uploading a workbook '
+                             'again converts faster')
+    return parser
+
+
+def convert_upload(filename: str, data: bytes, options: dict, sheet_cache: bool = False) -> dict:
+    """
+    Convert an uploaded spreadsheet in a temporary directory, returning the tier 1 files (name: bytes).
+    The sheet cache is used only with sheet_cache
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        spreadsheet_path = os.path.join(work_dir, filename)
+        with open(spreadsheet_path, 'wb') as spreadsheet:
+            spreadsheet.write(data)
+        flat_paths = dcp_to_tier1(spreadsheet_path, os.path.join(work_dir, 'flat'), os.path.join(work_dir, 'tier1'),
+                                  options['group_field'], options['denormalised'], tier1_only=options['tier1_only'],
+                                  engine=options['engine'], use_sheet_cache=sheet_cache,
+                                  with_denormalised=options['with_denormalised'], tmp_dir=work_dir)
+        outputs = {}
+        for flat_path in flat_paths:
+            for extension in ('csv', 'xlsx'):
+                output_name = f"{splitext(basename(flat_path))[0]}_tier1.{extension}"
+                with open(os.path.join(work_dir, 'tier1', output_name), 'rb') as output_file:
+                    outputs[output_name] = output_file.read()
+        return outputs
+
+
+def parse_options(query: str) -> dict:
+    params = parse_qs(query)
+    def flag(name):
+        return params.get(name, ['0'])[-1].lower() in ('1', 'true', 'yes')
+    options = {
+        'filename': basename(params.get('filename', ['spreadsheet.xlsx'])[-1]),
+        'group_field': params.get('group_field', [GROUP_FIELD]),
+        'denormalised': flag('denormalised'),
+        'with_denormalised': flag('with_denormalised'),
+        'tier1_only': flag('tier1_only'),
+        'engine': params.get('engine', ['pandas'])[-1],
+        'output': params.get('output', ['zip'])[-1]
+    }
+    if not options['filename'].endswith('.xlsx'):
+        raise ValueError(f"filename should be an .xlsx file: {options['filename']}")
+    if options['engine'] not in ENGINES:
+        raise ValueError(f"Unsupported engine {options['engine']}. Possible engines {ENGINES}")
+    if options['output'] not in OUTPUTS:
+        raise ValueError(f"Unsupported output {options['output']}. Possible outputs {list(OUTPUTS)}")
+    return options
+
+
+def response_body(outputs: dict, output: str) -> tuple:
+    """Body and file name of the response: all tier 1 files zipped, or the first csv / xlsx file"""
+    if output == 'zip':
+        members = {name: normalise_xlsx(data) if name.endswith('.xlsx') else data for name, data in outputs.items()}
+        body = BytesIO()
+        write_zip(members, body, codec='deflated')
+        return body.getvalue(), f"{splitext(next(iter(outputs)))[0]}.zip"
+    name = next(name for name in outputs if name.endswith(f'.{output}'))
+    return outputs[name], name
+
+
+class ConversionService(ThreadingHTTPServer):
+    """HTTP server with a bounded pool of conversion worker processes"""
+    daemon_threads = True
+
+    def __init__(self, address, workers: int = 2, queue_size: int = 8, timeout: float = 600,
+                 sheet_cache: bool = False):
+        super().__init__(address, ConversionHandler)
+        self.workers = workers
+        self.sheet_cache = sheet_cache
+        self.conversion_timeout = timeout
+        # slots of running and queued conversions, released when a conversion is done
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.capacity = workers + queue_size
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        # spawned, not forked, so that workers do not inherit the server threads and sockets
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def warm_up(self):
+        """Start all workers, so that the first requests do not pay for their imports"""
+        for future in [self.executor.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+    def submit(self, filename: str, data: bytes, options: dict):
+        """Queue a conversion, or return None if the queue is full"""
+        if not self.slots.acquire(blocking=False):
+            return None
+        with self.lock:
+            self.in_flight += 1
+        future = self.executor.submit(convert_upload, filename, data, options, self.sheet_cache)
+        future.add_done_callback(self.release)
+        return future
+
+    def release(self, _future):
+        with self.lock:
+            self.in_flight -= 1
+        self.slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(cancel_futures=True)
+
+
+class ConversionHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, status: int, content: dict, headers: dict = None):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if urlparse(self.path).path != '/health':
+            self.send_json(404, {'error': f'Unknown path {self.path}'})
+            return
+        with self.server.lock:
+            in_flight = self.server.in_flight
+        self.send_json(200, {'workers': self.server.workers, 'in_flight': in_flight, 'capacity': self.server.capacity})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/convert':
+            self.send_json(404, {'error': f'Unknown path {url.path}'})
+            return
+        try:
+            options = parse_options(url.query)
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        if length == 0 or length > MAX_UPLOAD_BYTES:
+            self.send_json(413 if length else 400, {'error': f'Upload should be between 1 and {MAX_UPLOAD_BYTES} bytes'})
+            return
+        data = self.rfile.read(length)
+        future = self.server.submit(options.pop('filename'), data, options)
+        if future is None:
+            self.send_json(503, {'error': 'Conversion queue is full'}, headers={'Retry-After': '30'})
+            return
+        try:
+            outputs = future.result(timeout=self.server.conversion_timeout)
+        except FutureTimeoutError:
+            self.send_json(504, {'error': 'Conversion did not finish in time'})
+            return
+        except Exception as e:
+            self.send_json(422, {'error': f'Conversion failed: {e!r}'})
+            return
+        body, name = response_body(outputs, options['output'])
+        self.send_response(200)
+        self.send_header('Content-Type', OUTPUTS[options['output']])
+        self.send_header('Content-Disposition', f'attachment; filename="{name}"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main(host: str = '127.0.0.1', port: int = 8801, workers: int = 2, queue_size: int = 8, timeout: float = 600,
+         sheet_cache: bool = False):
+    server = ConversionService((host, port), workers, queue_size, timeout, sheet_cache)
+    server.warm_up()
+    print(f'Conversion service listening on http://{host}:{server.server_address[1]} with {workers} workers')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    args = define_parser().parse_args()
+    main(args.host, args.port, args.workers, args.queue_size, args.timeout, args.sheet_cache)
@@ -1,20 +1,49 @@
 import argparse
+import copy
 import os
 import re
-
-import requests
-from dateutil.parser import parse
+from functools import lru_cache
 
 import pandas as pd
 import numpy as np
 
 from src.dcp_to_tier1_mapping import (
     DCP_TIER1_MAP, TIER1, HSAP_AGE_TO_DEV_DICT, 
-    GOLDEN_SPREADSHEET, COLLECTION_DICT
+    GOLDEN_SPREADSHEET, IMMUNE_SPREADSHEET, COLLECTION_DICT, DCP_EDIT_FIELDS
 )
 from src.flatten_dcp import explode_csv_col
+from src.multi_value import SEP, MultiValue
+from src.table_io import TABLE_FORMATS, read_table, read_table_chunks, table_path, write_table
+from src.vocabulary import map_distinct, map_values, print_unmapped
+from src.h5ad_export import write_h5ad
+from src.ontology_closure import load_index
+from src.tier1_validator import VALIDATE, validate_tier1
 
 OUTPUT_DIR = 'data/tier1_output'
+# h5ad is a metadata-only AnnData file, written for the tier 1 obs table only
+TIER1_FORMATS = TABLE_FORMATS + ['h5ad']
+# spreadsheet templates, golden is written as <name>_tier1.xlsx and any other one as <name>_tier1_<template>.xlsx
+TEMPLATES = {'golden': GOLDEN_SPREADSHEET, 'immune': IMMUNE_SPREADSHEET}
+# HsapDv stages before birth, and the post-fertilization week stages, found by label in the closure index
+PRENATAL_STAGE_LABELS = ['prenatal stage', 'embryonic stage', 'embryonic human stage', 'fetal stage']
+WEEK_STAGE_LABEL = r'(\d+)(?:st|nd|rd|th) week post-fertilization(?: human)? stage'
+AGE_UNIT_WEEKS = {'week': 1, 'day': 1 / 7}
+AGE_UNIT_YEARS = {'year': 1, 'month': 12, 'day': 365}
+OLS_BASE_URL = 'https://www.ebi.ac.uk/ols4'
+OLS_RETRIES = 3
+OLS_CACHE_SIZE = 65536
+# || separated fields that edit functions read value by value
+MULTI_VALUE_FIELDS = ['donor_organism.diseases.ontology_label', 'donor_organism.diseases.ontology',
+                      'analysis_file.genome_assembly_version', 'specimen_from_organism.organ_parts.ontology']
+
+
+def template_list(value:str)->list:
+    '''Comma separated template names of the --templates argument'''
+    templates = [template.strip() for template in value.split(',') if template.strip()]
+    unknown = [template for template in templates if template not in TEMPLATES]
+    if unknown or not templates:
+        raise argparse.ArgumentTypeError(f"Unsupported templates {unknown}. Possible templates {list(TEMPLATES)}")
+    return list(dict.fromkeys(templates))
 
 
 def define_parser():
@@ -24,33 +53,76 @@ def define_parser():
                         dest='flat_path', type=str, required=True, help='flat dcp spreadsheet path')
     parser.add_argument("-o", "--output_dir", action="store", default=OUTPUT_DIR,
                         dest="output_dir", type=str, required=False, help="directory to output tier1 spreadsheet")
+    parser.add_argument("-f", "--format", action="store", default='csv', choices=TIER1_FORMATS,
+                        dest="table_format", type=str, required=False, help="format of the tier 1 obs table")
+    parser.add_argument("--chunk_rows", action="store", default=None,
+                        dest="chunk_rows", type=int, required=False, help="convert the flat file this many rows at a time")
+    parser.add_argument("--templates", action="store", default=['golden'], dest="templates", type=template_list,
+                        required=False, help=f"comma separated spreadsheet templates to write, of {', '.join(TEMPLATES)}")
+    parser.add_argument("--validate", action="store", default='warn', choices=VALIDATE, dest="validate", type=str,
+                        required=False, help="validate the tier 1 obs table before writing it, abort to stop on any problem")
     return parser
 
+def ols_url(path:str)->str:
+    """URL of an OLS API path, on the OLS_BASE_URL environment variable if set, e.g. a local stand-in"""
+    return os.environ.get('OLS_BASE_URL', OLS_BASE_URL).rstrip('/') + path
+
+@lru_cache(maxsize=None)
+def ols_session():
+    """Session keeping the OLS connection alive between lookups, retrying failed or throttled requests"""
+    # requests is only needed for OLS lookups, imported at first use to keep startup fast
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    session = requests.Session()
+    adapter = HTTPAdapter(max_retries=Retry(total=OLS_RETRIES, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504]))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+# successful lookups are cached for the process, so batch runs query each term once. Failures and terms
+# OLS does not find are not cached, so that a long-lived process recovers from an OLS outage
+@lru_cache(maxsize=OLS_CACHE_SIZE)
+def ols_search(term, ontology):
+    """OBO ID of the first OLS search result of term in ontology, LookupError if there is none"""
+    request_query = ols_url('/api/search?q=')
+    response = ols_session().get(request_query + f"{term.replace(' ', '+')}&ontology={ontology}", timeout=10).json()
+    if response["response"]["numFound"] == 0:
+        raise LookupError(f"No ontology found for {term} in {ontology}")
+    return response["response"]["docs"][0]['obo_id']
+
 def get_ols_id(term, ontology):
-    request_query = 'https://www.ebi.ac.uk/ols4/api/search?q='
     if term is np.nan:
         return term
-    response = requests.get(request_query + f"{term.replace(' ', '+')}&ontology={ontology}", timeout=10).json()
-    if response["response"]["numFound"] == 0:
-        print(f"No ontology found for {term} in {ontology}")
+    try:
+        return ols_search(term, ontology)
+    except LookupError as e:
+        print(e)
         return term
-    return response["response"]["docs"][0]['obo_id']
+
+@lru_cache(maxsize=OLS_CACHE_SIZE)
+def ols_term(url):
+    """OLS term page of url, raising on a failed request"""
+    response = ols_session().get(url, timeout=10)
+    response.raise_for_status()
+    return response.json()
 
 def get_ols_label(ontology_id, only_label=True, ontology=None):
     if ontology_id is np.nan or not re.match(r"\w+:\d+", ontology_id):
         return ontology_id
     ontology_name = ontology if ontology else ontology_id.split(":")[0].lower()
     ontology_term = ontology_id.replace(":", "_")
-    url = f'https://www.ebi.ac.uk/ols4/api/ontologies/{ontology_name}/terms/http%253A%252F%252Fpurl.obolibrary.org%252Fobo%252F{ontology_term}'
+    url = ols_url(f'/api/ontologies/{ontology_name}/terms/http%253A%252F%252Fpurl.obolibrary.org%252Fobo%252F{ontology_term}')
     if ontology_name == 'efo':
-        url = f'https://www.ebi.ac.uk/ols4/api/ontologies/{ontology_name}/terms/http%253A%252F%252Fwww.ebi.ac.uk%252Fefo%252F{ontology_term}'
+        url = ols_url(f'/api/ontologies/{ontology_name}/terms/http%253A%252F%252Fwww.ebi.ac.uk%252Fefo%252F{ontology_term}')
     try:
-        response = requests.get(url, timeout=10)
-        results = response.json()
-    except ConnectionError as e:
+        results = ols_term(url)
+    except OSError as e:
+        # connection and HTTP errors of requests are OSErrors
         print(e)
         return ontology_id
-    return results['label'] if only_label else results
+    # a copy, so that callers do not change the cached term
+    return results['label'] if only_label else copy.deepcopy(results)
 
 def edit_sample_source(dcp_df:pd.DataFrame):
     if 'donor_organism.is_living' not in dcp_df:
@@ -103,7 +175,7 @@ def merge_sample_ids(dcp_df):
         ]
     merge_cols = [col for col in tissue_type_dcp if col in dcp_df]
     dcp_df['sample_id'] = dcp_df[merge_cols].bfill(axis=1)[merge_cols[0]]
-    return explode_csv_col(dcp_df, column='sample_id', sep='\|\|').reset_index(drop=True)
+    return explode_csv_col(dcp_df, column='sample_id', sep=SEP).reset_index(drop=True)
 
 def get_sex_id(term):
     if term in ['mixed', 'unknown']:
@@ -111,43 +183,46 @@ def get_sex_id(term):
     return get_ols_id(term, 'pato')
 
 def edit_sex(dcp_df):
-    sex_dict = {sex: get_sex_id(sex) for sex in dcp_df['donor_organism.sex'].unique()}
-    dcp_df['sex_ontology_term_id'] = dcp_df['donor_organism.sex'].replace(sex_dict)
-    dcp_df['sex_ontology_term'] = dcp_df['donor_organism.sex'].replace({'mixed': 'unknown'})
+    dcp_df['sex_ontology_term_id'] = map_values(dcp_df['donor_organism.sex'], get_sex_id)
+    dcp_df['sex_ontology_term'] = map_values(dcp_df['donor_organism.sex'], {'mixed': 'unknown'})
     return dcp_df
 
-def convert_to_years(age, age_unit):
+def convert_to_years(age, age_unit, report=True):
     if age_unit == 'year':
         return age
     if isinstance(age, str) and '-' in age:
         if age_unit == 'year':
             return age
-        print("Can't convert range to years")
+        if report:
+            print("Can't convert range to years")
         return age
-    age_to_years = {
-        'year': 1,
-        'month': 12,
-        'day': 365
-    }
+    # other units are reported once by report_age_units
+    if age_unit not in AGE_UNIT_YEARS:
+        return None
     try:
-        return round(int(age) / age_to_years[age_unit], 2)
+        return round(int(age) / AGE_UNIT_YEARS[age_unit], 2)
     except ValueError:
-        print("Age " + str(age) + " is not a number")
+        if report:
+            print("Age " + str(age) + " is not a number")
 
-def age_to_dev(age, age_unit, age_to_dev_dict):
-    # TODO add a way to record the following options
-    # Embryonic stage = A term from the set of Carnegie stages 1-23 = (up to 8 weeks after conception; e.g. HsapDv:0000003)
-    # Fetal development = A term from the set of 9 to 38 week post-fertilization human stages = (9 weeks after conception and before birth; e.g. HsapDv:0000046)
+def report_age_units(age_units:pd.Series):
+    unconverted = [str(unit) for unit in age_units.dropna().unique() if unit not in AGE_UNIT_YEARS]
+    for unit in unconverted:
+        print(f"Age unit {unit} can't be converted to years")
+
+def age_to_dev(age, age_unit, age_to_dev_dict, report=True):
+    # embryonic and fetal stages (Carnegie and post-fertilization week stages) are mapped by prenatal_week_stages
     if not age:
         return None
-    age = convert_to_years(age, age_unit)
+    age = convert_to_years(age, age_unit, report=report)
     if isinstance(age, str) and '-' in age:
         age = [float(age) for age in age.split('-')]
         for age_range, label in age_to_dev_dict.items():
             if age_range[0] <= age[0] <= age_range[1] and \
                     age_range[0] <= age[1] <= age_range[1]:
                 return age_range
-            print(f"Given range {age} overlaps the acceptable ranges. Will use 'developmental stage' instead.")
+            if report:
+                print(f"Given range {age} overlaps the acceptable ranges. Will use 'developmental stage' instead.")
             return None
     if isinstance(age, (int, float, str)) and (age.isdigit() or age.replace('.', '', 1).isdigit()):
         age = float(age) if isinstance(age, str) else age
@@ -157,32 +232,64 @@ def age_to_dev(age, age_unit, age_to_dev_dict):
     # print(f"Age {age} could not be mapped to accepted ranges {['-'.join(map(str, age)) for age in age_to_dev_dict.keys()]}")
     return None
 
-def dev_stage_helper(row):
+def dev_stage_helper(row, report=True):
     if 'donor_organism.organism_age' in row and row['donor_organism.biomaterial_core.ncbi_taxon_id'] == '9606':
         dev_stage = age_to_dev(age=row['donor_organism.organism_age'],
                                age_unit=row['donor_organism.organism_age_unit.ontology_label'],
-                               age_to_dev_dict=HSAP_AGE_TO_DEV_DICT)
+                               age_to_dev_dict=HSAP_AGE_TO_DEV_DICT, report=report)
         if dev_stage:
             return dev_stage
     return None
 
-def edit_developement_stage(dcp_df):
-    dev_age_stage = dcp_df.apply(dev_stage_helper, axis=1)
+def prenatal_week_stages(dcp_df, stage_index)->pd.Series:
+    """
+    Post-fertilization week stage of the donors of a prenatal development stage aged in weeks or days,
+    NaN for other rows. The n-th week stage is given to ages above n - 1 and up to n weeks
+    """
+    age = 'donor_organism.organism_age'
+    unit = 'donor_organism.organism_age_unit.ontology_label'
+    stage = 'donor_organism.development_stage.ontology'
+    week_stages = pd.Series(np.nan, index=dcp_df.index, dtype=object)
+    if any(column not in dcp_df for column in (age, unit, stage)):
+        return week_stages
+    prenatal_stages = stage_index.find('|'.join(f'({re.escape(label)})' for label in PRENATAL_STAGE_LABELS)).index
+    week_stage_ids = {int(week): stage_id for stage_id, week in stage_index.find(WEEK_STAGE_LABEL).items()}
+    prenatal = map_distinct(dcp_df[stage], lambda stages: pd.Series(
+        stage_index.descends_from(stages.to_numpy(dtype=object), prenatal_stages), dtype=object)).astype(bool)
+    weeks = np.ceil(pd.to_numeric(dcp_df[age], errors='coerce') * dcp_df[unit].map(AGE_UNIT_WEEKS))
+    return week_stages.where(~prenatal, weeks.map(week_stage_ids))
+
+def stage_label(stage_id, stage_index=None):
+    if stage_index is not None and stage_index.label(stage_id) is not None:
+        return stage_index.label(stage_id)
+    return get_ols_label(stage_id)
+
+def edit_developement_stage(dcp_df, report=True):
+    dev_age_stage = dcp_df.apply(dev_stage_helper, axis=1, report=report)
+    if report and 'donor_organism.organism_age_unit.ontology_label' in dcp_df:
+        report_age_units(dcp_df['donor_organism.organism_age_unit.ontology_label'])
     dcp_df['age_range'] = dev_age_stage.apply(lambda x: '-'.join(map(str, x)) if x else np.nan)
     dcp_df['development_stage_ontology_term_id'] = dev_age_stage.apply(lambda x: HSAP_AGE_TO_DEV_DICT[x] if x in HSAP_AGE_TO_DEV_DICT else None)
+    # embryonic and fetal week stages need the HsapDv hierarchy, only mapped with its closure index
+    stage_index = load_index('hsapdv')
+    if stage_index is not None:
+        week_stages = prenatal_week_stages(dcp_df, stage_index)
+        dcp_df['development_stage_ontology_term_id'] = week_stages.where(week_stages.notna(),
+                                                                         dcp_df['development_stage_ontology_term_id'])
     dcp_df.fillna({'development_stage_ontology_term_id': dcp_df['donor_organism.development_stage.ontology']}, inplace=True)
-    dev_dict = {dev: get_ols_label(dev) for dev in dcp_df['development_stage_ontology_term_id'].unique() if dev != 'unknown'}
-    dcp_df['development_stage_ontology_term'] = dcp_df['development_stage_ontology_term_id'].replace(dev_dict)
+    dcp_df['development_stage_ontology_term'] = map_values(dcp_df['development_stage_ontology_term_id'],
+                                                           lambda dev: dev if dev == 'unknown' else stage_label(dev, stage_index))
     return dcp_df
 
-def edit_suspension_type(dcp_df):
+def edit_suspension_type(dcp_df, unmapped=None):
     suspension_type_dict = {
         'single cell': 'cell',
         'single nucleus': 'nucleus',
         'bulk cell': 'na',
         'bulk nuclei': 'na'
     }
-    dcp_df['suspension_type'] = dcp_df['library_preparation_protocol.nucleic_acid_source'].replace(suspension_type_dict)
+    dcp_df['suspension_type'] = map_values(dcp_df['library_preparation_protocol.nucleic_acid_source'],
+                                           suspension_type_dict, unmapped)
     return dcp_df
 
 def edit_alignment_software(dcp_df):
@@ -197,19 +304,18 @@ def edit_alignment_software(dcp_df):
         dcp_df['alignment_software'] = dcp_df[[software, version]].apply(lambda x: " ".join(x.astype(str)), axis=1)
     return dcp_df
 
-def edit_reference_genome(dcp_df):
+def edit_reference_genome(dcp_df, multi_values):
     if 'analysis_file.genome_assembly_version' not in dcp_df:
         print('No genome assembly version provided')
         return dcp_df
-    dcp_df['reference_genome'] = dcp_df['analysis_file.genome_assembly_version'].dropna()\
-        .apply(lambda x: x if x == "Not Applicable" else (
-            x.replace('||Not Applicable', '')
-            .replace('Not Applicable||', '')
-            .replace('Not Applicable', '')
-            ))
+    genome = dcp_df['analysis_file.genome_assembly_version']
+    # keep Not Applicable only when no genome is provided at all
+    dcp_df['reference_genome'] = genome.where(
+        genome == "Not Applicable", multi_values['analysis_file.genome_assembly_version'].drop("Not Applicable").join())
     return dcp_df
 
 def parse_year(date_value):
+    from dateutil.parser import parse
     try:
         if isinstance(date_value, str):
             return parse(date_value, fuzzy=True).year
@@ -224,9 +330,10 @@ def edit_collection_year(dcp_df):
         dcp_df['collection_year'] = dcp_df['specimen_from_organism.collection_time'].apply(parse_year)
     return dcp_df
 
-def edit_collection_method(dcp_df):
+def edit_collection_method(dcp_df, unmapped=None):
     if 'collection_protocol.method.ontology_label' in dcp_df:
-        dcp_df['sample_collection_method'] = dcp_df['collection_protocol.method.ontology_label'].replace(COLLECTION_DICT)
+        dcp_df['sample_collection_method'] = map_values(dcp_df['collection_protocol.method.ontology_label'],
+                                                        COLLECTION_DICT, unmapped)
     return dcp_df
 
 def tissue_helper(row, ontology=False):
@@ -237,9 +344,34 @@ def tissue_helper(row, ontology=False):
         return row[f'specimen_from_organism.organ.{field}']
     return None
 
-def edit_tissue(dcp_df):
+def organ_roll_ups(organ_parts:MultiValue, organs:pd.Series, tissue_index)->pd.Series:
+    """
+    Organ of the specimens with several organ parts that all roll up to it, NaN for other rows.
+    A tier 1 tissue is a single term, so such specimens get their organ instead of the list of their parts
+    """
+    parts = organ_parts.notna()
+    rolled = pd.Series(np.nan, index=organs.index, dtype=object)
+    several = np.bincount(parts.rows, minlength=len(parts)) > 1
+    if not several.any():
+        return rolled
+    organ_ids = organs.to_numpy(dtype=object)
+    part_organs = tissue_index.roll_up(parts.values, pd.unique(organ_ids[several]))
+    # parts that do not roll up to the organ of their specimen
+    outside = np.bincount(parts.rows, weights=(part_organs != organ_ids[parts.rows]).astype(float), minlength=len(parts))
+    return rolled.where(~several | (outside > 0), organs)
+
+def edit_tissue(dcp_df, multi_values):
     dcp_df['tissue_ontology_term'] = dcp_df.apply(tissue_helper, axis=1)
     dcp_df['tissue_ontology_term_id'] = dcp_df.apply(tissue_helper, axis=1, ontology=True)
+    # the UBERON hierarchy is only used with its closure index
+    tissue_index = load_index('uberon')
+    if tissue_index is not None and 'specimen_from_organism.organ_parts.ontology' in multi_values and \
+            'specimen_from_organism.organ.ontology' in dcp_df:
+        organs = organ_roll_ups(multi_values['specimen_from_organism.organ_parts.ontology'],
+                                dcp_df['specimen_from_organism.organ.ontology'], tissue_index)
+        rolled = organs.notna()
+        dcp_df.loc[rolled, 'tissue_ontology_term_id'] = organs[rolled]
+        dcp_df.loc[rolled, 'tissue_ontology_term'] = organs[rolled].map(tissue_index.label)
     return dcp_df
 
 def tissue_free_text_helper(row):
@@ -257,19 +389,27 @@ def edit_tissue_free_text(dcp_df):
     dcp_df['tissue_free_text'] = dcp_df.apply(tissue_free_text_helper, axis=1)
     return dcp_df
 
-def edit_diseases(dcp_df):
+def disease_choices(diseases:MultiValue)->pd.DataFrame:
+    """Unique combinations of the selected (0) and the other (1) diseases of rows with multiple diseases"""
+    return pd.DataFrame({0: diseases.first(), 1: diseases.rest()}).drop_duplicates().dropna()
+
+def report_disease_choices(unique_diseases:pd.DataFrame):
+    if not unique_diseases.empty:
+        selected_disease = ", ".join(np.unique(unique_diseases[0]))
+        unselected_diseases = " and ".join(unique_diseases[1])
+        print(f"From multiple diseases, we will use {selected_disease}, instead of {unselected_diseases}")
+
+def edit_diseases(dcp_df, multi_values, report=True):
     # if we have multiple diseases, we would need to select one. by default select the first and print what was not selected
     if 'donor_organism.diseases.ontology_label' in dcp_df:
-        unique_diseases = dcp_df['donor_organism.diseases.ontology_label'].str.split("\\|\\|", expand=True, n=1).drop_duplicates().dropna()
-        if unique_diseases.shape[1] > 1:
-            selected_disease = ", ".join(np.unique(unique_diseases[0]))
-            unselected_diseases = " and ".join(unique_diseases[1])
-            print(f"From multiple diseases, we will use {selected_disease}, instead of {unselected_diseases}")
-        dcp_df['disease_ontology_term_id'] = dcp_df['donor_organism.diseases.ontology'].str.split("\\|\\|").str[0]
-        dcp_df['disease_ontology_term'] = dcp_df['donor_organism.diseases.ontology_label'].str.split("\\|\\|").str[0]
+        diseases = multi_values['donor_organism.diseases.ontology_label']
+        if report:
+            report_disease_choices(disease_choices(diseases))
+        dcp_df['disease_ontology_term_id'] = multi_values['donor_organism.diseases.ontology'].first()
+        dcp_df['disease_ontology_term'] = diseases.first()
     return dcp_df
 
-def edit_sampled_site_condition(dcp_df):
+def edit_sampled_site_condition(dcp_df, report=True):
     """Diseased donor and healthy specimen does not mean adjacent every time. 
     i.e. if donor has lung cancer the heart specimen will not be adjacent
     This needs to be inspected manually
@@ -282,7 +422,7 @@ def edit_sampled_site_condition(dcp_df):
                     (dcp_df['specimen_from_organism.diseases.ontology_label'] == 'normal'), 'sampled_site_condition'] = 'adjacent'
         dcp_df.loc[(dcp_df['specimen_from_organism.diseases.ontology_label'] != 'normal'), 'sampled_site_condition'] = 'diseased'
         
-        if any(dcp_df['sampled_site_condition'] == 'adjacent'):
+        if report and any(dcp_df['sampled_site_condition'] == 'adjacent'):
             print("Found diseases in donor but with healthy specimen.",
                 "Please investigate if diseases of donor could apply in specimen,",
                 "in order to define healthy or adjacent sampled_site_condition.")
@@ -302,7 +442,7 @@ def edit_manner_of_death(dcp_df):
     dcp_df['manner_of_death'] = dcp_df.apply(manner_of_death_helper, axis=1)
     return dcp_df
 
-def edit_sequenced_fragment(dcp_df):
+def edit_sequenced_fragment(dcp_df, unmapped=None):
     seq_frag = {
         '3 prime tag': '3 prime tag',
         '3 prime end bias': '3 prime tag',
@@ -311,21 +451,29 @@ def edit_sequenced_fragment(dcp_df):
         'full length': 'full length'
         # no dcp option for 'probe-based' "sequencing"
     }
-    dcp_df['sequenced_fragment'] = dcp_df['library_preparation_protocol.end_bias'].replace(seq_frag)
+    dcp_df['sequenced_fragment'] = map_values(dcp_df['library_preparation_protocol.end_bias'], seq_frag, unmapped)
     return dcp_df
 
 def edit_consortia(dcp_df):
     dcp_df['consortia'] = 'HCA'
     return dcp_df
 
-def get_uns(dcp_df:pd.DataFrame)->pd.DataFrame:
-    return pd.DataFrame({
-        'title': dcp_df['project.project_core.project_title'].unique(), 
-        'study_pi': dcp_df['project.contributors.name'].unique() if 'project.contributors.name' in dcp_df else None,
-        'contact_email': dcp_df['project.contributors.email'].unique() if 'project.contributors.email' in dcp_df else None,
+def unique_values(dcp_df:pd.DataFrame, field:str)->list:
+    if field not in dcp_df:
+        return []
+    values = MultiValue.parse(dcp_df[field].astype(object)).notna().values
+    return list(dict.fromkeys(values.astype(str)))
+
+def get_uns(dcp_df:pd.DataFrame)->dict:
+    """Dataset level metadata, the unique values of each field. Fields without values are left out"""
+    uns = {
+        'title': unique_values(dcp_df, 'project.project_core.project_title'),
+        'study_pi': unique_values(dcp_df, 'project.contributors.name'),
+        'contact_email': unique_values(dcp_df, 'project.contributors.email'),
         'consortia': ['HCA'],
-        'publication_doi': dcp_df['project.publications.doi'].unique() if 'project.publications.doi' in dcp_df else None
-        })
+        'publication_doi': unique_values(dcp_df, 'project.publications.doi')
+        }
+    return {key: values for key, values in uns.items() if values}
 
 def rename_cols(dcp_df:pd.DataFrame, map_dict:dict)->pd.DataFrame:
     dcp_df = dcp_df.rename(columns=map_dict)
@@ -336,41 +484,158 @@ def select_cols(dcp_df:pd.DataFrame, cols:list)->pd.DataFrame:
     dcp_df[na_cols] = np.nan
     return dcp_df[cols].drop_duplicates()
 
-def main(flat_path:str, output_dir:str):
-    filename = os.path.basename(flat_path)
-    dcp_spreadsheet = pd.read_csv(flat_path, dtype=str)
-    
+def parse_multi_values(dcp_df:pd.DataFrame)->dict:
+    """The || separated edit fields of the flat file, parsed once for all edit functions"""
+    return {field: MultiValue.parse(dcp_df[field].astype(object)) for field in MULTI_VALUE_FIELDS if field in dcp_df}
+
+def edit_rows(dcp_spreadsheet:pd.DataFrame, unmapped:dict, report:bool=True)->pd.DataFrame:
+    """
+    Edit all conditionally mapped tier 1 fields. Rows are edited independently of each other.
+    Without report, the disease choices, age ranges and adjacent specimens are not reported, e.g. for
+    chunks, whose warnings are reported once by the caller
+    """
+    multi_values = parse_multi_values(dcp_spreadsheet)
     dcp_spreadsheet = edit_sample_source(dcp_spreadsheet)
     dcp_spreadsheet = edit_tissue_type(dcp_spreadsheet)
     dcp_spreadsheet = edit_sex(dcp_spreadsheet)
-    dcp_spreadsheet = edit_developement_stage(dcp_spreadsheet)
-    dcp_spreadsheet = edit_suspension_type(dcp_spreadsheet)
+    dcp_spreadsheet = edit_developement_stage(dcp_spreadsheet, report=report)
+    dcp_spreadsheet = edit_suspension_type(dcp_spreadsheet, unmapped)
     dcp_spreadsheet = edit_alignment_software(dcp_spreadsheet)
-    dcp_spreadsheet = edit_reference_genome(dcp_spreadsheet)
+    dcp_spreadsheet = edit_reference_genome(dcp_spreadsheet, multi_values)
     dcp_spreadsheet = edit_collection_year(dcp_spreadsheet)
-    dcp_spreadsheet = edit_collection_method(dcp_spreadsheet)
-    dcp_spreadsheet = edit_tissue(dcp_spreadsheet)
+    dcp_spreadsheet = edit_collection_method(dcp_spreadsheet, unmapped)
+    dcp_spreadsheet = edit_tissue(dcp_spreadsheet, multi_values)
     dcp_spreadsheet = edit_tissue_free_text(dcp_spreadsheet)
-    dcp_spreadsheet = edit_diseases(dcp_spreadsheet)
-    dcp_spreadsheet = edit_sampled_site_condition(dcp_spreadsheet)
+    dcp_spreadsheet = edit_diseases(dcp_spreadsheet, multi_values, report=report)
+    dcp_spreadsheet = edit_sampled_site_condition(dcp_spreadsheet, report=report)
     dcp_spreadsheet = edit_manner_of_death(dcp_spreadsheet)
-    dcp_spreadsheet = edit_sequenced_fragment(dcp_spreadsheet)
+    dcp_spreadsheet = edit_sequenced_fragment(dcp_spreadsheet, unmapped)
     dcp_spreadsheet = edit_consortia(dcp_spreadsheet)
-    dcp_spreadsheet = merge_sample_ids(dcp_spreadsheet)
+    return merge_sample_ids(dcp_spreadsheet)
 
+def tier1_tables(dcp_spreadsheet:pd.DataFrame, templates:list=('golden',))->dict:
+    """
+    Distinct rows of the tier 1 obs table and of the tabs of the templates, by their fields, from the edited rows.
+    Tabs with the same fields, in one template or several, are selected once
+    """
     dcp_spreadsheet = rename_cols(dcp_spreadsheet, map_dict=DCP_TIER1_MAP)
+    field_lists = [TIER1['obs']] + [fields for template in templates for fields in TEMPLATES[template].values()]
+    return {fields: select_cols(dcp_spreadsheet, cols=list(fields)) for fields in dict.fromkeys(map(tuple, field_lists))}
 
-    obs = select_cols(dcp_spreadsheet, cols=TIER1['obs'])
-    obs.to_csv(os.path.join(output_dir, f"{filename.replace('.csv', '_tier1.csv')}"), index=False)
+class DistinctRows:
+    """
+    Rows of a table added in chunks, keeping the first occurrence of each row like drop_duplicates.
+    Only a hash of every row kept so far is compared. Missing values hash alike, and unlike the string 'nan'
+    """
+    def __init__(self):
+        self.hashes = np.array([], dtype=np.uint64)
+        self.chunks = []
+
+    def add(self, df:pd.DataFrame):
+        hashes = pd.util.hash_pandas_object(df.astype(object), index=False).to_numpy()
+        keep = ~pd.Series(hashes).duplicated().to_numpy() & ~np.isin(hashes, self.hashes)
+        self.hashes = np.concatenate([self.hashes, hashes[keep]])
+        self.chunks.append(df[keep])
+
+    def frame(self)->pd.DataFrame:
+        return pd.concat(self.chunks)
+
+# fields of the age range and adjacent specimen warnings
+AGE_FIELDS = ['donor_organism.organism_age', 'donor_organism.organism_age_unit.ontology_label',
+              'donor_organism.biomaterial_core.ncbi_taxon_id']
+WARNING_FIELDS = AGE_FIELDS + ['donor_organism.diseases.ontology_label',
+                               'specimen_from_organism.diseases.ontology_label', 'specimen_from_organism.organ.text']
+GLOBAL_FIELDS = ['donor_organism.sex', 'donor_organism.development_stage.ontology',
+                 'donor_organism.diseases.ontology_label'] + DCP_EDIT_FIELDS['get_uns'] + WARNING_FIELDS
+
+def report_warnings(warning_rows:pd.DataFrame):
+    """Age range and adjacent specimen warnings of the distinct rows of the warning fields"""
+    if warning_rows.empty:
+        return
+    warning_rows[[field for field in AGE_FIELDS if field in warning_rows]].drop_duplicates().apply(dev_stage_helper, axis=1)
+    if 'donor_organism.organism_age_unit.ontology_label' in warning_rows:
+        report_age_units(warning_rows['donor_organism.organism_age_unit.ontology_label'])
+    edit_sampled_site_condition(warning_rows.copy())
+
+def global_facts(flat_path:str, chunk_rows:int)->tuple:
+    """
+    First pass of the chunked conversion, over the few columns that need all rows: warm up the OLS
+    lookups of the sex and development stage terms, and collect the disease choices, uns values and
+    distinct rows of the warning fields
+    """
+    choices, uns, warnings = [], {}, []
+    for chunk in read_table_chunks(flat_path, chunk_rows, columns=GLOBAL_FIELDS):
+        if 'donor_organism.sex' in chunk:
+            for sex in chunk['donor_organism.sex'].unique():
+                get_sex_id(sex)
+        if 'donor_organism.development_stage.ontology' in chunk:
+            for dev in chunk['donor_organism.development_stage.ontology'].unique():
+                if dev != 'unknown':
+                    get_ols_label(dev)
+        if 'donor_organism.diseases.ontology_label' in chunk:
+            choices.append(disease_choices(parse_multi_values(chunk)['donor_organism.diseases.ontology_label']))
+        if 'project.project_core.project_title' in chunk:
+            for key, values in get_uns(chunk).items():
+                uns[key] = list(dict.fromkeys(uns.get(key, []) + values))
+        warnings.append(chunk[[field for field in WARNING_FIELDS if field in chunk]].drop_duplicates())
+    disease_choices_all = pd.concat(choices).drop_duplicates() if choices else pd.DataFrame()
+    warning_rows = pd.concat(warnings).drop_duplicates() if warnings else pd.DataFrame()
+    return disease_choices_all, uns, warning_rows
+
+def convert_chunks(flat_path:str, chunk_rows:int, unmapped:dict, templates:list=('golden',))->tuple:
+    """
+    Tier 1 tables of the flat file, converted chunk_rows rows at a time, so that memory is bounded by the
+    chunk size and the distinct tier 1 rows. Gives the same tables as converting the whole file
+    """
+    unique_diseases, uns, warning_rows = global_facts(flat_path, chunk_rows)
+    report_disease_choices(unique_diseases)
+    report_warnings(warning_rows)
+    tables = {}
+    offset = 0
+    for chunk in read_table_chunks(flat_path, chunk_rows):
+        chunk = edit_rows(chunk, unmapped, report=False)
+        # index of the edited rows in the whole file, written in the golden spreadsheet
+        chunk.index = chunk.index + offset
+        offset += len(chunk)
+        for fields, table in tier1_tables(chunk, templates).items():
+            tables.setdefault(fields, DistinctRows()).add(table)
+    return {fields: distinct.frame() for fields, distinct in tables.items()}, uns
+
+def main(flat_path:str, output_dir:str, table_format:str='csv', chunk_rows:int=None, templates:list=('golden',),
+         validate:str='warn'):
+    """
+    Convert the flat file to the tier 1 obs table and a spreadsheet per template, all from one conversion.
+    With chunk_rows, the flat file is read and converted in chunks. The obs table is validated before anything is written
+    """
+    filename = os.path.splitext(os.path.basename(flat_path))[0]
+    # values of the vocabulary columns without a tier 1 mapping, reported once
+    unmapped = {}
+    if chunk_rows:
+        tables, uns = convert_chunks(flat_path, chunk_rows, unmapped, templates)
+    else:
+        dcp_spreadsheet = edit_rows(read_table(flat_path), unmapped)
+        uns = get_uns(dcp_spreadsheet) if table_format == 'h5ad' else None
+        tables = tier1_tables(dcp_spreadsheet, templates)
+    print_unmapped(unmapped)
+
+    obs = tables[tuple(TIER1['obs'])]
+    validate_tier1(obs, validate)
+    if table_format == 'h5ad':
+        write_h5ad(obs, uns, os.path.join(output_dir, f"{filename}_tier1.h5ad"))
+    else:
+        write_table(obs, table_path(os.path.join(output_dir, f"{filename}_tier1"), table_format), index=False)
 
-    output_path = os.path.join(output_dir, f"{filename.replace('.csv', '_tier1.xlsx')}")
-    with pd.ExcelWriter(output_path) as writer:
-        for tab, fields in GOLDEN_SPREADSHEET.items():
-            select_cols(dcp_spreadsheet, cols=fields).to_excel(writer, sheet_name=tab, index=True, header=True)
-    print(f"Tier 1 spreadsheet created at {output_path}")
+    for template in templates:
+        suffix = '' if template == 'golden' else f'_{template}'
+        output_path = os.path.join(output_dir, f"{filename}_tier1{suffix}.xlsx")
+        with pd.ExcelWriter(output_path) as writer:
+            for tab, fields in TEMPLATES[template].items():
+                tables[tuple(fields)].to_excel(writer, sheet_name=tab, index=True, header=True)
+        print(f"Tier 1 spreadsheet created at {output_path}")
 
 
 if __name__ == "__main__":
     args = define_parser().parse_args()
 
-    main(flat_path=args.flat_path, output_dir=args.output_dir)
+    main(flat_path=args.flat_path, output_dir=args.output_dir, table_format=args.table_format, chunk_rows=args.chunk_rows,
+         templates=args.templates, validate=args.validate)
@@ -1,5 +1,6 @@
 """
 DCP_TIER1_MAP: dictionary with mapping between DCP and Tier 1 fields
+DCP_EDIT_FIELDS: DCP fields that each edit function of convert_flat_dcp_to_tier1 reads
 tier1: tier 1 v1 list
 for updated mapping:
 https://docs.google.com/spreadsheets/d/13oqRLh1awe7bClpX617_HQaoS8XPZV5JKPtPEff8-p4/
@@ -58,6 +59,61 @@ DCP_TIER1_MAP = {
     # 'donor_organism.human_specific.ethnicity.ontology': 'self_reported_ethnicity_ontology_term_id'
     # 'donor_organism.organism_age': 'development_stage_ontology_term_id'
 }
+DCP_EDIT_FIELDS = {
+    "edit_sample_source": ["donor_organism.is_living", "specimen_from_organism.transplant_organ"],
+    "edit_tissue_type": [
+        "organoid.biomaterial_core.biomaterial_id",
+        "cell_line.biomaterial_core.biomaterial_id",
+        "specimen_from_organism.biomaterial_core.biomaterial_id",
+        "cell_suspension.biomaterial_core.biomaterial_id",
+    ],
+    "edit_sex": ["donor_organism.sex"],
+    "edit_developement_stage": [
+        "donor_organism.organism_age",
+        "donor_organism.organism_age_unit.ontology_label",
+        "donor_organism.biomaterial_core.ncbi_taxon_id",
+        "donor_organism.development_stage.ontology",
+    ],
+    "edit_suspension_type": ["library_preparation_protocol.nucleic_acid_source"],
+    "edit_alignment_software": [
+        "analysis_protocol.alignment_software",
+        "analysis_protocol.alignment_software_version",
+    ],
+    "edit_reference_genome": ["analysis_file.genome_assembly_version"],
+    "edit_collection_year": ["specimen_from_organism.collection_time"],
+    "edit_collection_method": ["collection_protocol.method.ontology_label"],
+    "edit_tissue": [
+        "specimen_from_organism.organ_parts.ontology",
+        "specimen_from_organism.organ_parts.ontology_label",
+        "specimen_from_organism.organ.ontology",
+        "specimen_from_organism.organ.ontology_label",
+    ],
+    "edit_tissue_free_text": [
+        "specimen_from_organism.organ_parts.text",
+        "specimen_from_organism.organ_parts.ontology_label",
+        "specimen_from_organism.organ.text",
+        "specimen_from_organism.organ.ontology_label",
+    ],
+    "edit_diseases": ["donor_organism.diseases.ontology", "donor_organism.diseases.ontology_label"],
+    "edit_sampled_site_condition": [
+        "donor_organism.diseases.ontology_label",
+        "specimen_from_organism.diseases.ontology_label",
+        "specimen_from_organism.organ.text",
+    ],
+    "edit_manner_of_death": ["donor_organism.death.hardy_scale", "donor_organism.is_living"],
+    "edit_sequenced_fragment": ["library_preparation_protocol.end_bias"],
+    "merge_sample_ids": [
+        "organoid.biomaterial_core.biomaterial_id",
+        "cell_line.biomaterial_core.biomaterial_id",
+        "specimen_from_organism.biomaterial_core.biomaterial_id",
+    ],
+    "get_uns": [
+        "project.project_core.project_title",
+        "project.contributors.name",
+        "project.contributors.email",
+        "project.publications.doi",
+    ],
+}
 TIER1 = {
     "uns": ["title", "study_pi", "batch_condition", "default_embedding", "comments"],
     "obs": [
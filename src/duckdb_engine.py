@@ -0,0 +1,129 @@
+"""
+DuckDB execution of the flatten joins and grouping (`--engine duckdb`).
+Every cleaned sheet is registered as a table and the links of a report entity are turned into
+a single query, which DuckDB runs multithreaded and out-of-core. The query follows the pandas
+engine step by step (explode on ||, left join, reconcile repeated columns like
+merge_multiple_input_entities) so that both engines write identical spreadsheets.
+"""
+import duckdb
+import pandas as pd
+
+from src.flatten_dcp import Link, format_column_name, prefix_columns, remove_field_desc_lines
+from src.multi_value import SEP
+from src.table_io import with_nan
+
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def string_frame(df: pd.DataFrame) -> pd.DataFrame:
+    return df.astype(str).where(df.notna(), None)
+
+
+def sheet_table(spreadsheet_obj: pd.ExcelFile, sheet: str, key_fields: set) -> pd.DataFrame:
+    df = remove_field_desc_lines(prefix_columns(spreadsheet_obj.parse(sheet), prefix=sheet))
+    table = string_frame(df)
+    for field in key_fields & set(table.columns):
+        # pandas splits only str link IDs, any other value becomes NaN when exploded
+        table[field] = table[field].where(df[field].map(lambda value: isinstance(value, str)), None)
+    return table.reset_index(drop=True).assign(_rn=range(len(table)))
+
+
+def explode_query(table: str, column: str) -> str:
+    values = f"coalesce(string_split({quote(column)}, {literal(SEP)}), [NULL::VARCHAR])"
+    return f"SELECT * REPLACE (unnest({values}) AS {quote(column)}), generate_subscripts({values}, 1) AS _xi FROM {table}"
+
+
+def join_query(columns: list, target_columns: list, source_field: str, target_field: str, link: Link):
+    """Select list of a join step and the resulting columns, as join_worksheet would return them"""
+    overlap = set(columns) & set(target_columns)
+    select, result_columns = [], []
+    for col in columns:
+        if overlap and col == source_field:
+            continue
+        if col in overlap:
+            orig, dup = f'l.{quote(col)}', f'r.{quote(col)}'
+            select.append(f"CASE WHEN {orig} IS NOT NULL AND {dup} IS NOT NULL AND {orig} <> {dup} "
+                          f"THEN {orig} || {literal(SEP)} || {dup} ELSE coalesce({orig}, {dup}) END AS {quote(col)}")
+        else:
+            select.append(f'l.{quote(col)}')
+        result_columns.append(col)
+    for col in target_columns:
+        if col not in overlap:
+            select.append(f'r.{quote(col)}')
+            result_columns.append(col)
+    select.append('row_number() OVER (ORDER BY l._rn, l._xi, r._rn, r._xi) AS _rn')
+    join = f"{link.join_type.upper()} JOIN"
+    return f"SELECT {', '.join(select)} FROM {{left}} AS l {join} {{right}} AS r " \
+           f"ON l.{quote(source_field)} IS NOT DISTINCT FROM r.{quote(target_field)}", result_columns
+
+
+def flatten_spreadsheet(spreadsheet_obj: pd.ExcelFile, report_entity: str, links: list,
+                        con: duckdb.DuckDBPyConnection = None) -> pd.DataFrame:
+    if report_entity not in spreadsheet_obj.sheet_names:
+        raise ValueError(f'spreadsheet does not contain {report_entity} sheet')
+    con = con or duckdb.connect()
+    key_fields = {report_entity: set()}
+    for link in links:
+        if link.target not in spreadsheet_obj.sheet_names:
+            raise ValueError(f'spreadsheet does not contain {link.target} sheet. Possible names {sorted(spreadsheet_obj.sheet_names)}')
+        key_fields.setdefault(link.source, set()).add(format_column_name(column_name=link.source_field, namespace=link.source))
+        key_fields.setdefault(link.target, set()).add(format_column_name(column_name=link.target_field, namespace=link.target))
+
+    tables = {}
+    for idx, sheet in enumerate(key_fields):
+        table = sheet_table(spreadsheet_obj, sheet, key_fields[sheet])
+        con.register(f'sheet_{idx}', table)
+        tables[sheet] = (f'sheet_{idx}', table.columns.drop('_rn').tolist())
+
+    report_table, columns = tables[report_entity]
+    ctes = [f'step_0 AS (SELECT * FROM {report_table})']
+    for step, link in enumerate(links, start=1):
+        print(f'joining [{link.source}] to [{link.target}]')
+        source_field = format_column_name(column_name=link.source_field, namespace=link.source)
+        target_field = format_column_name(column_name=link.target_field, namespace=link.target)
+        target_table, target_columns = tables[link.target]
+        if source_field not in columns or target_field not in target_columns:
+            missing = source_field if source_field not in columns else target_field
+            raise RuntimeError(f'problem joining [{link.source}] to [{link.target}] using fields [{source_field}] and [{target_field}]: {missing!r}')
+        query, columns = join_query(columns, target_columns, source_field, target_field, link)
+        ctes.append(f'left_{step} AS ({explode_query(f"step_{step - 1}", source_field)})')
+        ctes.append(f'right_{step} AS ({explode_query(target_table, target_field)})')
+        ctes.append(f'step_{step} AS ({query.format(left=f"left_{step}", right=f"right_{step}")})')
+
+    select = ', '.join(quote(col) for col in columns)
+    flattened = con.sql(f"WITH {', '.join(ctes)} SELECT {select} FROM step_{len(links)} ORDER BY _rn").df()
+    if len(flattened.index) == 0:
+        raise RuntimeError(f'problem flattening [{report_entity}]: join resulted in zero rows')
+    return with_nan(flattened)
+
+
+def join_unique(df: pd.DataFrame, group_field: str, sep: str = SEP,
+                con: duckdb.DuckDBPyConnection = None) -> pd.DataFrame:
+    """
+    DuckDB version of multi_value.join_unique: unpivot all columns, keep the distinct values
+    of each group and column and string_agg them in their order of appearance.
+    """
+    con = con or duckdb.connect()
+    con.register('flattened', string_frame(df).assign(_pos=range(len(df))))
+    group = quote(group_field)
+    long = con.sql(f"""
+        WITH long AS (
+            UNPIVOT (SELECT * FROM flattened WHERE {group} IS NOT NULL)
+            ON COLUMNS(* EXCLUDE ({group}, _pos)) INTO NAME _column VALUE _value
+        ), distinct_values AS (
+            SELECT {group}, _column, _value, min(_pos) AS _pos FROM long GROUP BY ALL
+        )
+        SELECT {group}, _column, string_agg(_value, {literal(sep)} ORDER BY _pos) AS _value
+        FROM distinct_values GROUP BY {group}, _column
+    """).df()
+    con.unregister('flattened')
+    groups = pd.Index(df[group_field].dropna().astype(str).drop_duplicates().sort_values(), name=group_field)
+    grouped = long.pivot(index=group_field, columns='_column', values='_value')
+    columns = df.columns.drop(group_field)
+    return grouped.reindex(index=groups, columns=columns).fillna('').rename_axis(None, axis=1)
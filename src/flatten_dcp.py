@@ -9,11 +9,16 @@ from dataclasses import dataclass
 
 import pandas as pd
 
+from src.dcp_to_tier1_mapping import DCP_TIER1_MAP, DCP_EDIT_FIELDS
+from src.multi_value import SEP, MultiValue, join_columns, join_unique
+from src import sheet_cache
+from src.table_io import TABLE_FORMATS, table_path, write_table
+
 
-SEP = '\\|\\|'
 FIRST_DATA_LINE = 4
 INPUT_DIR = 'data/dcp_spreadsheet'
 OUTPUT_DIR = 'data/denormalised_spreadsheet'
+ENGINES = ['pandas', 'duckdb']
 
 
 def define_parser():
@@ -21,13 +26,40 @@ def define_parser():
     parser = argparse.ArgumentParser(description="Parser for the arguments")
     parser.add_argument("-s", "--spreadsheet_path", action="store",
                         dest="spreadsheet_path", type=str, required=True, help="dcp spreadsheet path")
-    parser.add_argument("-g", "--group_field", action="store", default='specimen_from_organism.biomaterial_core.biomaterial_id',
-                        dest="group_field", type=str, required=False, help="field to group output with, use empty to denormalise")
+    parser.add_argument("-g", "--group_field", action="store", default=['specimen_from_organism.biomaterial_core.biomaterial_id'], nargs='+',
+                        dest="group_field", type=str, required=False, help="fields to group output with, use empty to denormalise")
     parser.add_argument("-o", "--output_dir", action="store", default='data/denormalised_spreadsheet',
                         dest="output_dir", type=str, required=False, help="directory to output denormalised spreadsheet")
+    parser.add_argument("-f", "--format", action="store", default='csv', choices=TABLE_FORMATS,
+                        dest="table_format", type=str, required=False, help="format of the denormalised/grouped output")
+    parser.add_argument("--tier1_only", action="store_true", dest="tier1_only", required=False,
+                        help="keep only the fields needed for the tier 1 conversion")
+    parser.add_argument("--engine", action="store", default='pandas', choices=ENGINES,
+                        dest="engine", type=str, required=False, help="engine to join and group worksheets with")
+    parser.add_argument("--no-sheet-cache", action="store_false", dest="sheet_cache", required=False,
+                        help="always parse the spreadsheet instead of using the cleaned sheets cache")
+    add_plan_arguments(parser)
     return parser
 
 
+def add_plan_arguments(parser):
+    # join_plan and link_check import this module, so they are imported once it is loaded
+    from src.join_plan import LIMIT_ACTIONS
+    from src.link_check import CHECK_LINKS
+    parser.add_argument("--plan", action="store_true", dest="plan_only", required=False,
+                        help="print the join plan with estimated rows and memory, without flattening")
+    parser.add_argument("--max_rows", action="store", default=None, dest="max_rows", type=int, required=False,
+                        help="limit of rows of any join")
+    parser.add_argument("--max_memory_gb", action="store", default=None, dest="max_memory_gb", type=float, required=False,
+                        help="limit of the estimated memory of any join")
+    parser.add_argument("--on_limit", action="store", default='abort', choices=LIMIT_ACTIONS,
+                        dest="on_limit", type=str, required=False,
+                        help="abort, or flatten the file entity rows in chunks, when a join would exceed the limits")
+    parser.add_argument("--check_links", action="store", default='warn', choices=CHECK_LINKS,
+                        dest="check_links", type=str, required=False,
+                        help="check link IDs for orphaned references and duplicated IDs before flattening, and report or abort")
+
+
 @dataclass
 class Link:
     source: str
@@ -119,60 +151,113 @@ def remove_empty_tabs_and_fields(spreadsheet_obj: pd.ExcelFile, first_data_line:
     return spreadsheet_obj
 
 
-def rename_vague_friendly_names(spreadsheet_obj: pd.ExcelFile, first_data_line: int = FIRST_DATA_LINE):
-    req_str = "(Required)"
-    vague_entities = ['BIOMATERIAL', 'PROTOCOL']
-    vague_entities = [id + suffix for id in vague_entities for suffix in [' ID', ' NAME', ' DESCRIPTION']]
-    vague_entities.extend([id + ' ' + req_str for id in vague_entities if id.endswith('ID')])
-    # check if biomaterial ID of donor exists in donor tab
-    vague_exists = False
-    all_fields = {sheet.title: [field.value for field in sheet[1]] for sheet in spreadsheet_obj.book}
+REQUIRED = "(Required)"
+VAGUE_ENTITIES = [entity + suffix for entity in ['BIOMATERIAL', 'PROTOCOL'] for suffix in [' ID', ' NAME', ' DESCRIPTION']]
+VAGUE_ENTITIES.extend([entity + ' ' + REQUIRED for entity in VAGUE_ENTITIES if entity.endswith('ID')])
+
+
+def uses_vague_names(all_fields: dict) -> bool:
+    """Whether any link of two present tabs (tab: header fields) misses its ID fields"""
     for link in links_all:
         if link.source in all_fields and link.target in all_fields:
             if link.source_field not in all_fields[link.source] or link.target_field not in all_fields[link.target]:
-                vague_exists = True
-                break
-    if not vague_exists:
+                return True
+    return False
+
+
+def rename_vague_field(field: str, sheet: str, program_name: str = None) -> str:
+    """Consistent header of a field, using its programmatic name for vague BIOMATERIAL / PROTOCOL fields"""
+    field = (field.removesuffix(REQUIRED).upper() + REQUIRED) if REQUIRED in field else field.upper()
+    if sheet == 'Analysis file':
+        field = field.replace('INPUT ', '')
+    # without a programmatic name the entity of a vague field is unknown, it is only capitalised
+    if program_name and any(entity == field for entity in VAGUE_ENTITIES):
+        field_friendly_entity = program_name.split('.')[0].replace('_',' ').capitalize()
+        entity = field.split(' ')[0]
+        field = field.replace(entity, field_friendly_entity.upper())
+        if sheet == 'Analysis file' and field_friendly_entity == 'Cell suspension':
+            pass
+        elif field_friendly_entity != sheet and entity == 'BIOMATERIAL':
+            field = f'INPUT {field}'
+        if REQUIRED not in field and field.endswith('ID'):
+            field = f'{field} {REQUIRED}'
+    return field
+
+
+def rename_vague_friendly_names(spreadsheet_obj: pd.ExcelFile, first_data_line: int = FIRST_DATA_LINE):
+    # check if biomaterial ID of donor exists in donor tab
+    all_fields = {sheet.title: [field.value for field in sheet[1]] for sheet in spreadsheet_obj.book}
+    if not uses_vague_names(all_fields):
         return spreadsheet_obj
     print('Spreadsheet uses vague fiendly names. Will try to edit accordingly')
     for sheet in spreadsheet_obj.sheet_names:
+        program_names = [cell.value for cell in spreadsheet_obj.book[sheet][first_data_line]]
         for field in spreadsheet_obj.book[sheet][1]:
             if not field.value:
                 continue
-            field.value = (field.value.removesuffix(req_str).upper() +  req_str) if req_str in field.value else field.value.upper()
-            if sheet == 'Analysis file':
-                field.value = field.value.replace('INPUT ', '')
-            if any(entity == field.value for entity in vague_entities):
-                field_program_name = spreadsheet_obj.book[sheet][first_data_line][field.column - 1].value
-                field_friendly_entity = field_program_name.split('.')[0].replace('_',' ').capitalize()
-                entity = field.value.split(' ')[0]
-                field.value = field.value.replace(entity, field_friendly_entity.upper())
-                if sheet == 'Analysis file' and field_friendly_entity == 'Cell suspension':
-                    pass
-                elif field_friendly_entity != sheet and entity == 'BIOMATERIAL':
-                    field.value = f'INPUT {field.value}'
-                if req_str not in field.value and field.value.endswith('ID'):
-                    field.value = f'{field.value} {req_str}'
+            field.value = rename_vague_field(field.value, sheet, program_names[field.column - 1])
     return spreadsheet_obj
 
 
-def derive_exprimental_design(report_entity, spreadsheet_obj):
-    sheet_cache = {}
+def tier1_fields(group_fields: list = ()) -> set:
+    """Programmatic fields read by the tier 1 conversion, either mapped directly or by an edit function"""
+    fields = set(DCP_TIER1_MAP.keys())
+    fields.update(field for edit_fields in DCP_EDIT_FIELDS.values() for field in edit_fields)
+    fields.update(group_field for group_field in group_fields if group_field)
+    return fields
+
+
+def link_fields() -> dict:
+    """Fields of each tab used by any link"""
+    fields = {}
+    for link in links_all:
+        fields.setdefault(link.source, set()).add(link.source_field)
+        fields.setdefault(link.target, set()).add(link.target_field)
+    return fields
+
+
+def remove_unused_fields(spreadsheet_obj: pd.ExcelFile, fields: set, first_data_line: int = FIRST_DATA_LINE):
+    """
+    Delete all columns of biomaterial, protocol and file tabs that are neither link fields
+    nor have a programmatic name in fields, so that they are never parsed or joined.
+    Project tabs are kept as they are since project info is extracted using friendly names.
+    """
+    link_fields_all = link_fields()
+    for sheet in spreadsheet_obj.book:
+        if sheet.title.startswith('Project'):
+            continue
+        keep = [field.value in link_fields_all.get(sheet.title, set()) or
+                field.value == 'LOCATION' or
+                sheet.cell(first_data_line, field.column).value in fields
+                for field in sheet[1]]
+        # delete consecutive unused columns at once, starting from the last one so indices stay valid
+        col = len(keep)
+        while col > 0:
+            if keep[col - 1]:
+                col -= 1
+                continue
+            amount = 0
+            while col - amount > 0 and not keep[col - amount - 1]:
+                amount += 1
+            sheet.delete_cols(col - amount + 1, amount)
+            col -= amount
+    return spreadsheet_obj
+
+
+def design_paths(report_entity, sheet_fields):
+    """
+    Paths of the experimental design starting from report_entity, and the links they apply.
+    sheet_fields(sheet) returns the header fields of a sheet, None if the workbook has no such sheet
+    """
     applied_links = []
-    
-    def parse_sheet(sheet_name):
-        if sheet_name not in sheet_cache:
-            sheet_cache[sheet_name] = spreadsheet_obj.parse(sheet_name)
-        return sheet_cache[sheet_name]
-    
+
     def check_link_exists(link):
-        if link.target not in spreadsheet_obj.sheet_names:
+        target_fields = sheet_fields(link.target)
+        if target_fields is None:
             return False
-        source_sheet = parse_sheet(link.source)
-        target_sheet = parse_sheet(link.target)
-        if link.source_field not in source_sheet.columns:
+        if link.source_field not in sheet_fields(link.source):
             return False
-        if link.target_field not in target_sheet.columns:
+        if link.target_field not in target_fields:
             return False
         return True
     
@@ -190,7 +275,20 @@ def derive_exprimental_design(report_entity, spreadsheet_obj):
     
     all_paths = []
     dfs(report_entity, [], all_paths)
-    all_paths = sorted(all_paths, key=len)
+    return sorted(all_paths, key=len), applied_links
+
+
+def derive_exprimental_design(report_entity, spreadsheet_obj):
+    sheet_cache = {}
+    
+    def sheet_fields(sheet_name):
+        if sheet_name not in spreadsheet_obj.sheet_names:
+            return None
+        if sheet_name not in sheet_cache:
+            sheet_cache[sheet_name] = spreadsheet_obj.parse(sheet_name).columns
+        return sheet_cache[sheet_name]
+    
+    all_paths, applied_links = design_paths(report_entity, sheet_fields)
     print(f"All different paths in the experimental design starting from {report_entity} (no: {len(all_paths)}):")
     for path in all_paths:
         print('->'.join(path))
@@ -226,9 +324,7 @@ def extract_project_info(spreadsheet_obj: pd.ExcelFile, fields: list):
 
 
 def explode_csv_col(df: pd.DataFrame, column: str, sep=',') -> pd.DataFrame:
-    cols = {}
-    cols[column] = df[column].str.split(sep)
-    return df.assign(**cols).explode(column)
+    return MultiValue.parse(df[column], sep=sep).explode(df, column)
 
 
 def format_column_name(column_name, namespace):
@@ -265,8 +361,7 @@ def merge_multiple_input_entities(worksheet: pd.DataFrame,
             combine_mask = conflict_mask & ~identical_mask
             if combine_mask.any():
                 print(f"Combining non-identical values in {orig_col}")
-                result.loc[combine_mask, orig_col] = result.loc[combine_mask, [orig_col, dup_col]]\
-                    .apply(lambda x: '||'.join(x.astype(str)))
+                result.loc[combine_mask, orig_col] = join_columns(result.loc[combine_mask, [orig_col, dup_col]])
             
             # For identical values, keep the original
             result.loc[identical_mask, orig_col] = result.loc[identical_mask, orig_col]
@@ -301,6 +396,10 @@ def join_worksheet(worksheet: pd.DataFrame,
         target = spreadsheet_obj.parse(link.target)
         
         target = remove_field_desc_lines(target)
+        if link.join_type in ('left', 'inner'):
+            # semi-join: drop the target rows no worksheet key refers to before exploding and merging them.
+            # Later links take their keys from the joined rows, so the reduction cascades to deeper sheets
+            target = target[MultiValue.parse(target[link.target_field], sep=SEP).isin(worksheet[source_field].unique())]
         target = prefix_columns(target, prefix=link.target)
         
         target = explode_csv_col(target, column=target_field, sep=SEP)
@@ -324,12 +423,22 @@ def join_worksheet(worksheet: pd.DataFrame,
     return result
 
 
-def flatten_spreadsheet(spreadsheet_obj, report_entity, links):
+def flatten_spreadsheet(spreadsheet_obj, report_entity, links, chunks=1):
     if report_entity not in spreadsheet_obj.sheet_names:
         raise ValueError(f'spreadsheet does not contain {report_entity} sheet')
     report_sheet = spreadsheet_obj.parse(report_entity)
     report_sheet = prefix_columns(report_sheet, prefix=report_entity)
     report_sheet = remove_field_desc_lines(report_sheet)
+    if chunks > 1:
+        # joins keep the order of the report rows, so joining chunks gives the same rows with smaller joins
+        print(f'flattening [{report_entity}] in {chunks} chunks')
+        chunk_size = -(-len(report_sheet) // chunks)
+        return pd.concat([flatten_spreadsheet_rows(report_sheet.iloc[start:start + chunk_size], links, spreadsheet_obj)
+                          for start in range(0, len(report_sheet), chunk_size)], ignore_index=True)
+    return flatten_spreadsheet_rows(report_sheet, links, spreadsheet_obj)
+
+
+def flatten_spreadsheet_rows(report_sheet, links, spreadsheet_obj):
     flattened = reduce(partial(join_worksheet, spreadsheet_obj=spreadsheet_obj),
                        links,
                        report_sheet)
@@ -341,43 +450,113 @@ def check_merge_conflict(df, column1, column2):
 
 
 def append_merge_conflicts(df, column1, column2, merge_conflict):
-    df.loc[merge_conflict, column1] = df.loc[merge_conflict, [column1, column2]].apply(lambda x: '||'.join(x.astype(str)), axis=1)
+    df.loc[merge_conflict, column1] = join_columns(df.loc[merge_conflict, [column1, column2]])
     return df
 
 
-def collapse_values(series):
-    return "||".join(series.dropna().unique().astype(str))
-
-
-def main(spreadsheet_path: str, output_dir: str = OUTPUT_DIR, 
-         group_field: str = 'specimen_from_organism.biomaterial_core.biomaterial_id'):
+def open_spreadsheet(spreadsheet_path: str, fields: set = None, use_cache: bool = True, tmp_dir: str = INPUT_DIR):
+    """
+    Open and clean the spreadsheet, keeping only fields if given, and save the cleaned copy in tmp_dir.
+    Cleaned sheets are loaded from the sheet cache when this workbook was cleaned before
+    """
+    if use_cache:
+        key = sheet_cache.cache_key(spreadsheet_path, fields)
+        cached_obj = sheet_cache.load(key)
+        if cached_obj is not None:
+            print(f'Using cached sheets of {spreadsheet_path}')
+            return cached_obj
     filename = os.path.basename(spreadsheet_path)
     # open excel with write only to remove empty tabs & fields & unnamed columns
     spreadsheet_obj = pd.ExcelFile(spreadsheet_path, engine_kwargs={'read_only': False})
     spreadsheet_obj = remove_empty_tabs_and_fields(spreadsheet_obj)
     spreadsheet_obj = rename_vague_friendly_names(spreadsheet_obj)
-    spreadsheet_obj.book.save(os.path.join(INPUT_DIR, filename.replace('.xlsx', '.tmp.xlsx')))
-    report_entities = [entity for entity in ['Analysis file', 'Sequence file', 'Image file'] if entity in spreadsheet_obj.sheet_names]
-        
+    if fields is not None:
+        spreadsheet_obj = remove_unused_fields(spreadsheet_obj, fields)
+    spreadsheet_obj.book.save(os.path.join(tmp_dir, filename.replace('.xlsx', '.tmp.xlsx')))
+    if use_cache:
+        sheet_cache.store(key, spreadsheet_obj)
+        sheet_cache.evict()
+    return spreadsheet_obj
+
+
+def engine_functions(engine: str = 'pandas'):
+    """Flatten and group functions of the engine"""
+    if engine == 'duckdb':
+        # duckdb is an optional dependency, only needed for this engine
+        from src import duckdb_engine
+        return duckdb_engine.flatten_spreadsheet, duckdb_engine.join_unique
+    return flatten_spreadsheet, join_unique
+
+
+def report_entities_of(spreadsheet_obj) -> list:
+    return [entity for entity in ['Analysis file', 'Sequence file', 'Image file'] if entity in spreadsheet_obj.sheet_names]
+
+
+def plan_workbook(spreadsheet_obj, limits=None) -> list:
+    """Print the join plan of every file entity and the limits it would exceed"""
+    from src.join_plan import limit_violations, plan_entity, print_plan
+    plans = []
+    for report_entity in report_entities_of(spreadsheet_obj):
+        _, links_filt = derive_exprimental_design(report_entity, spreadsheet_obj)
+        plan = plan_entity(spreadsheet_obj, report_entity, links_filt)
+        print_plan(plan)
+        for violation in limit_violations(plan, limits) if limits else []:
+            print(f'Limit exceeded: {violation}')
+        plans.append(plan)
+    return plans
+
+
+def join_chunks(spreadsheet_obj, report_entity: str, links: list, limits, engine: str = 'pandas') -> int:
+    """Number of chunks to flatten report_entity in, or raise if a join would exceed the limits"""
+    from src.join_plan import chunk_count, limit_violations, plan_entity
+    plan = plan_entity(spreadsheet_obj, report_entity, links)
+    violations = limit_violations(plan, limits)
+    if not violations:
+        return 1
+    if limits.on_limit == 'abort':
+        raise RuntimeError(f'problem flattening [{report_entity}]: ' + '; '.join(violations))
+    if engine == 'duckdb':
+        print(f'{violations[0]}, flattening with duckdb which spills to disk')
+        return 1
+    return chunk_count(plan, limits)
+
+
+def flatten_workbook(spreadsheet_obj, engine: str = 'pandas', limits=None) -> pd.DataFrame:
+    """
+    Join all file entities of the spreadsheet, add project metadata and use ingest attribute names.
+    With limits (join_plan.JoinLimits), the joins are planned first, to abort or chunk them before they exceed the limits
+    """
+    flatten, _ = engine_functions(engine)
     flattened_list = []
-    for report_entity in report_entities:
+    for report_entity in report_entities_of(spreadsheet_obj):
         # Modify links to include only relevant to this report entity
         _, links_filt = derive_exprimental_design(report_entity, spreadsheet_obj)
-        flattened_list.append(flatten_spreadsheet(spreadsheet_obj, report_entity, links_filt))
+        chunks = join_chunks(spreadsheet_obj, report_entity, links_filt, limits, engine) if limits else 1
+        if chunks > 1:
+            flattened_list.append(flatten_spreadsheet(spreadsheet_obj, report_entity, links_filt, chunks))
+        else:
+            flattened_list.append(flatten(spreadsheet_obj, report_entity, links_filt))
     flattened = pd.concat(flattened_list, axis=0, ignore_index=True)
     
     # remove empty columns
     flattened.dropna(axis='columns', how='all', inplace=True)
     
-    # add project label
+    flattened = add_project_metadata(flattened, spreadsheet_obj)
+    return use_ingest_names(flattened, spreadsheet_obj)
+
+
+def add_project_metadata(flattened: pd.DataFrame, spreadsheet_obj) -> pd.DataFrame:
+    """Add the project, publication and PI fields to every flattened row"""
     project_fields = ['PROJECT LABEL (Required)', 'PROJECT TITLE (Required)', 'INSDC PROJECT ACCESSION', 'GEO SERIES ACCESSION', 'ARRAYEXPRESS ACCESSION',
                       'INSDC STUDY ACCESSION', 'BIOSTUDIES ACCESSION', 'EGA Study/Dataset Accession(s)', 'dbGap Study Accession(s)', 'PUBLICATION TITLE (Required)', 'PUBLICATION DOI']
     project_df = extract_project_info(spreadsheet_obj, project_fields)
     project_df = pd.concat([project_df, extract_pi(spreadsheet_obj).reset_index(drop=True)], axis=1)
     project_df = project_df.loc[project_df.index.repeat(len(flattened))].reset_index(drop=True)
-    flattened = pd.concat([flattened, project_df], axis=1)
+    return pd.concat([flattened, project_df], axis=1)
 
-    # use ingest attribute names as columns
+
+def use_ingest_names(flattened: pd.DataFrame, spreadsheet_obj) -> pd.DataFrame:
+    """Rename the <tab>_<field> columns to ingest attribute names, merging the columns of one attribute"""
     for column in flattened.columns:
         tab, original_column = column.split('_')
         if tab not in spreadsheet_obj.sheet_names:
@@ -401,24 +580,78 @@ def main(spreadsheet_path: str, output_dir: str = OUTPUT_DIR,
                 flattened = append_merge_conflicts(flattened, ingest_attribute_name, column, merge_conflict)
             flattened[ingest_attribute_name] = flattened[ingest_attribute_name].combine_first(flattened[column])
             flattened.drop(labels=column, axis='columns', inplace=True)
+    return flattened
 
 
-    
-    if group_field == '':
-        flattened.to_csv(f"{output_dir}/{filename.replace('.xlsx', '_denormalised.csv')}", index=False)
-        print(f'Denormalised spreadsheet created at {output_dir}/{filename.replace(".xlsx", "_denormalised.csv")}') 
-        return
-    if group_field not in flattened:
-        print(f'Group field provided not in spreadsheet: {group_field}\nProviding denormalised spreadsheet')
-        flattened.to_csv(f"{output_dir}/{filename.replace('.xlsx', '_denormalised.csv')}", index=False)
-        print(f'Denormalised spreadsheet created at {output_dir}/{filename.replace(".xlsx", "_denormalised.csv")}')
-        return
-    flattened_grouped = flattened.groupby(group_field).agg(collapse_values).dropna(axis=1, how='all')
-    flattened_grouped.to_csv(f"{output_dir}/{filename.replace('.xlsx', '.csv')}", index=True)
-    print(f'Grouped spreadsheet created at {output_dir}/{filename.replace(".xlsx", ".csv")}')
+def write_views(flattened: pd.DataFrame, filename: str, output_dir: str, group_fields: list,
+                table_format: str = 'csv', engine: str = 'pandas') -> dict:
+    """
+    Write one flat file per group field, where an empty group field is the denormalised view.
+    The first grouped view is named after the spreadsheet and any other one gets the entity of
+    its group field as suffix, or the whole field if that entity names a view already.
+    Returns the path written for each group field.
+    """
+    _, group = engine_functions(engine)
+    denormalised_path = table_path(f"{output_dir}/{filename.replace('.xlsx', '_denormalised.csv')}", table_format)
+    paths = {}
+    for group_field in group_fields:
+        if group_field and group_field not in flattened:
+            print(f'Group field provided not in spreadsheet: {group_field}\nProviding denormalised spreadsheet')
+        if not group_field or group_field not in flattened:
+            if denormalised_path not in paths.values():
+                write_table(flattened, denormalised_path, index=False)
+                print(f'Denormalised spreadsheet created at {denormalised_path}')
+            paths[group_field] = denormalised_path
+            continue
+        suffix = f"_{group_field.split('.')[0]}" if any(path != denormalised_path for path in paths.values()) else ''
+        grouped_path = table_path(f"{output_dir}/{filename.replace('.xlsx', f'{suffix}.csv')}", table_format)
+        if grouped_path in [path for field, path in paths.items() if field != group_field]:
+            suffix = f"_{group_field.replace('.', '_')}"
+            grouped_path = table_path(f"{output_dir}/{filename.replace('.xlsx', f'{suffix}.csv')}", table_format)
+        flattened_grouped = group(flattened, group_field).dropna(axis=1, how='all')
+        write_table(flattened_grouped, grouped_path, index=True)
+        print(f'Grouped spreadsheet created at {grouped_path}')
+        paths[group_field] = grouped_path
+    return paths
+
+
+def main(spreadsheet_path: str, output_dir: str = OUTPUT_DIR, 
+         group_field = 'specimen_from_organism.biomaterial_core.biomaterial_id',
+         table_format: str = 'csv', tier1_only: bool = False, engine: str = 'pandas',
+         use_sheet_cache: bool = True, plan_only: bool = False, limits=None, check_links: str = 'warn',
+         tmp_dir: str = INPUT_DIR) -> dict:
+    """
+    Flatten the spreadsheet once and write a view for each group field (a field or a list of them,
+    empty for the denormalised view). Returns the flat file path of each group field.
+    The cleaned copy of the spreadsheet is saved in tmp_dir.
+    The link IDs are checked first (link_check.CHECK_LINKS), to report or abort on broken links.
+    With plan_only, only print the join plan and return no paths.
+    """
+    group_fields = [group_field] if isinstance(group_field, str) else list(group_field)
+    filename = os.path.basename(spreadsheet_path)
+    spreadsheet_obj = open_spreadsheet(spreadsheet_path, tier1_fields(group_fields) if tier1_only else None,
+                                       use_sheet_cache, tmp_dir)
+    from src.link_check import preflight_links
+    preflight_links(spreadsheet_obj, check_links)
+    if plan_only:
+        plan_workbook(spreadsheet_obj, limits)
+        return {}
+    flattened = flatten_workbook(spreadsheet_obj, engine, limits)
+    return write_views(flattened, filename, output_dir, group_fields, table_format, engine)
+
+
+def join_limits(args):
+    """JoinLimits of the parsed plan arguments, None without limits"""
+    if args.max_rows is None and args.max_memory_gb is None:
+        return None
+    from src.join_plan import JoinLimits
+    return JoinLimits(max_rows=args.max_rows, max_memory_gb=args.max_memory_gb, on_limit=args.on_limit)
 
 
 if __name__ == "__main__":
     args = define_parser().parse_args()
     main(spreadsheet_path=args.spreadsheet_path,
-         output_dir=args.output_dir, group_field=args.group_field)
+         output_dir=args.output_dir, group_field=args.group_field,
+         table_format=args.table_format, tier1_only=args.tier1_only, engine=args.engine,
+         use_sheet_cache=args.sheet_cache, plan_only=args.plan_only, limits=join_limits(args),
+         check_links=args.check_links)
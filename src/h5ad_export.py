@@ -0,0 +1,22 @@
+"""
+Metadata-only AnnData (h5ad) export of the tier 1 obs table and of the dataset level uns metadata,
+so that downstream loaders read them directly, lazily if they want to, instead of parsing the
+csv file again. obs columns are stored as categoricals of strings, missing values as missing
+categories. anndata is an optional dependency, only needed for this format.
+"""
+import pandas as pd
+
+from src.table_io import to_string_frame
+
+
+def obs_frame(obs: pd.DataFrame) -> pd.DataFrame:
+    """Categorical string columns, with a string index as AnnData expects it"""
+    obs = to_string_frame(obs.reset_index(drop=True)).astype('category')
+    obs.index = obs.index.astype(str)
+    return obs
+
+
+def write_h5ad(obs: pd.DataFrame, uns: dict, path: str):
+    # anndata is only needed for the h5ad format, imported at first use
+    import anndata
+    anndata.AnnData(obs=obs_frame(obs), uns=uns).write_h5ad(path)
@@ -0,0 +1,188 @@
+"""
+Join plan of the flatten step (`--plan`), estimated without materialising the joins.
+Only the link ID fields still needed by later links are carried through the joins, as distinct
+key combinations with the number of rows they stand for, so that a join of millions of rows
+is estimated from a few thousand key combinations. Row counts are exact, memory is estimated
+from the columns of each join and the size of the parsed sheets.
+Guard limits (JoinLimits) abort a run, or split the report entity rows into chunks, before
+a join exceeds them.
+"""
+import math
+from dataclasses import dataclass
+
+import pandas as pd
+
+from src.flatten_dcp import (Link, append_merge_conflicts, check_merge_conflict, explode_csv_col,
+                             format_column_name, prefix_columns, remove_field_desc_lines)
+from src.multi_value import SEP
+
+# object columns hold one pointer per cell, the values themselves are shared between joins
+BYTES_PER_CELL = 8
+LIMIT_ACTIONS = ['abort', 'chunk']
+ROWS, MATCHES = '_rows', '_matches'
+
+
+@dataclass
+class JoinLimits:
+    max_rows: int = None
+    max_memory_gb: float = None
+    on_limit: str = 'abort'
+
+
+@dataclass
+class LinkEstimate:
+    link: Link
+    input_rows: int
+    exploded_rows: int
+    target_rows: int
+    target_keys: int
+    max_matches: int
+    output_rows: int
+    output_columns: int
+    peak_bytes: int
+
+    @property
+    def fan_out(self) -> float:
+        return self.exploded_rows / self.input_rows if self.input_rows else 1.0
+
+
+@dataclass
+class EntityPlan:
+    report_entity: str
+    rows: int
+    columns: int
+    sheet_bytes: int
+    links: list
+
+    @property
+    def output_rows(self) -> int:
+        return self.links[-1].output_rows if self.links else self.rows
+
+    @property
+    def peak_bytes(self) -> int:
+        return max([estimate.peak_bytes for estimate in self.links], default=0)
+
+
+def sheet_frame(spreadsheet_obj, sheet: str) -> pd.DataFrame:
+    return remove_field_desc_lines(prefix_columns(spreadsheet_obj.parse(sheet), prefix=sheet))
+
+
+def count_rows(df: pd.DataFrame, keys: list, weight: str = None) -> pd.DataFrame:
+    """Distinct combinations of keys, with the number of (weighted) rows of each"""
+    if not keys:
+        return pd.DataFrame({ROWS: [int(df[weight].sum()) if weight else len(df)]})
+    grouped = df.groupby(keys, dropna=False, sort=False)
+    counts = grouped[weight].sum() if weight else grouped.size()
+    return counts.rename(weight or ROWS).reset_index()
+
+
+def plan_entity(spreadsheet_obj, report_entity: str, links: list) -> EntityPlan:
+    if report_entity not in spreadsheet_obj.sheet_names:
+        raise ValueError(f'spreadsheet does not contain {report_entity} sheet')
+    sheets = {report_entity: sheet_frame(spreadsheet_obj, report_entity)}
+    for link in links:
+        if link.target not in spreadsheet_obj.sheet_names:
+            raise ValueError(f'spreadsheet does not contain {link.target} sheet. Possible names {sorted(spreadsheet_obj.sheet_names)}')
+        sheets.setdefault(link.target, sheet_frame(spreadsheet_obj, link.target))
+    sheet_bytes = sum(int(sheet.memory_usage(deep=True).sum()) for sheet in sheets.values())
+    source_fields = [format_column_name(column_name=link.source_field, namespace=link.source) for link in links]
+
+    report_sheet = sheets[report_entity]
+    columns = set(report_sheet.columns)
+    keys = count_rows(report_sheet, [field for field in dict.fromkeys(source_fields) if field in columns])
+    estimates = []
+    for step, link in enumerate(links):
+        source_field = source_fields[step]
+        target_field = format_column_name(column_name=link.target_field, namespace=link.target)
+        target = sheets[link.target]
+        if source_field not in keys or target_field not in target:
+            missing = source_field if source_field not in keys else target_field
+            raise RuntimeError(f'problem joining [{link.source}] to [{link.target}] using fields [{source_field}] and [{target_field}]: {missing!r}')
+        later_fields = list(dict.fromkeys(source_fields[step + 1:]))
+        input_rows = int(keys[ROWS].sum())
+        keys = explode_csv_col(keys, column=source_field, sep=SEP)
+        exploded_rows = int(keys[ROWS].sum())
+
+        target = explode_csv_col(target, column=target_field, sep=SEP)
+        target_keys = count_rows(target, list(dict.fromkeys([target_field] + [field for field in later_fields if field in target])))
+        target_keys = target_keys.rename(columns={ROWS: MATCHES})
+        overlap = (columns & set(target.columns)) - {source_field}
+        joined = keys.merge(target_keys, how=link.join_type, suffixes=(None, '_y'),
+                            left_on=source_field, right_on=target_field)
+        for column in overlap & set(later_fields):
+            # same reconciliation as merge_multiple_input_entities, the combined value is exploded by later links
+            merge_conflict = check_merge_conflict(joined, column, f'{column}_y')
+            joined = append_merge_conflicts(joined, column, f'{column}_y', merge_conflict)
+            joined[column] = joined[column].combine_first(joined[f'{column}_y'])
+        joined[ROWS] = joined[ROWS] * joined[MATCHES].fillna(1).astype(int)
+        output_rows = int(joined[ROWS].sum())
+
+        output_columns = columns | set(target.columns)
+        if overlap and source_field != target_field:
+            output_columns = output_columns - {source_field}
+        # explode copies the left side, merge builds the result (twice when input entities are merged)
+        cells = exploded_rows * len(columns) + len(target) * len(target.columns) \
+            + output_rows * len(output_columns) * (2 if overlap else 1)
+        per_key = target_keys.groupby(target_field, dropna=False)[MATCHES].sum()
+        estimates.append(LinkEstimate(link=link, input_rows=input_rows, exploded_rows=exploded_rows,
+                                      target_rows=len(target), target_keys=len(per_key),
+                                      max_matches=int(per_key.max()) if len(per_key) else 0,
+                                      output_rows=output_rows, output_columns=len(output_columns),
+                                      peak_bytes=sheet_bytes + cells * BYTES_PER_CELL))
+        columns = output_columns
+        keys = count_rows(joined, [field for field in later_fields if field in joined], weight=ROWS)
+    return EntityPlan(report_entity=report_entity, rows=len(report_sheet), columns=len(report_sheet.columns),
+                      sheet_bytes=sheet_bytes, links=estimates)
+
+
+def format_bytes(size: float) -> str:
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024:
+            return f'{size:.0f} {unit}'
+        size /= 1024
+    return f'{size:.1f} TB'
+
+
+def print_plan(plan: EntityPlan):
+    print(f'Join plan of {plan.report_entity} ({plan.rows} rows, {plan.columns} columns):')
+    table = pd.DataFrame([{
+        'link': f'{estimate.link.source} -> {estimate.link.target}',
+        'rows': estimate.input_rows,
+        'fan-out': round(estimate.fan_out, 2),
+        'target rows': estimate.target_rows,
+        'target keys': estimate.target_keys,
+        'max matches': estimate.max_matches,
+        'output rows': estimate.output_rows,
+        'columns': estimate.output_columns,
+        'peak memory': format_bytes(estimate.peak_bytes)
+    } for estimate in plan.links])
+    if not table.empty:
+        print(table.to_string(index=False))
+    print(f'Estimated rows: {plan.output_rows}, estimated peak memory: {format_bytes(plan.peak_bytes)}')
+
+
+def limit_violations(plan: EntityPlan, limits: JoinLimits) -> list:
+    violations = []
+    for estimate in plan.links:
+        link = f'[{estimate.link.source}] to [{estimate.link.target}]'
+        if limits.max_rows and estimate.output_rows > limits.max_rows:
+            violations.append(f'joining {link} gives {estimate.output_rows} rows, over the limit of {limits.max_rows}')
+        if limits.max_memory_gb and estimate.peak_bytes > limits.max_memory_gb * 1024 ** 3:
+            violations.append(f'joining {link} needs about {format_bytes(estimate.peak_bytes)}, over the limit of {limits.max_memory_gb} GB')
+    return violations
+
+
+def chunk_count(plan: EntityPlan, limits: JoinLimits) -> int:
+    """
+    Number of chunks of the report entity rows that keeps every join within the limits, assuming rows
+    and join memory split evenly over the chunks. The parsed sheets are needed by every chunk.
+    """
+    ratios = [1.0]
+    max_join_bytes = limits.max_memory_gb * 1024 ** 3 - plan.sheet_bytes if limits.max_memory_gb else None
+    for estimate in plan.links:
+        if limits.max_rows:
+            ratios.append(estimate.output_rows / limits.max_rows)
+        if max_join_bytes is not None:
+            join_bytes = estimate.peak_bytes - plan.sheet_bytes
+            ratios.append(join_bytes / max_join_bytes if max_join_bytes > 0 else plan.rows)
+    return min(max(1, plan.rows), math.ceil(max(ratios)))
@@ -0,0 +1,108 @@
+"""
+Referential integrity of the link IDs, checked before flattening (`--check_links`).
+Every link of links_all present in the workbook is checked on the parsed sheets, without joining:
+the target IDs of each sheet are split and hashed once, and the split source IDs are looked up in
+them. A link reports its orphaned references (source IDs without a target row), duplicated target
+IDs (which multiply the joined rows) and unused target entities (not referenced by this link).
+Orphans and duplicates are errors, that abort the run with check_links='abort'.
+"""
+from dataclasses import dataclass
+
+import pandas as pd
+
+from src.flatten_dcp import Link, links_all, remove_field_desc_lines
+from src.multi_value import SEP, MultiValue
+
+CHECK_LINKS = ['off', 'warn', 'abort']
+MAX_EXAMPLES = 5
+
+
+@dataclass
+class LinkReport:
+    link: Link
+    source_rows: int
+    references: int
+    target_rows: int
+    orphans: list
+    duplicates: list
+    unused: list
+
+    @property
+    def errors(self) -> list:
+        link = f'[{self.link.source}] to [{self.link.target}]'
+        errors = []
+        if self.orphans:
+            errors.append(f'{len(self.orphans)} {self.link.source_field} of {link} not found: {examples(self.orphans)}')
+        if self.duplicates:
+            errors.append(f'{len(self.duplicates)} duplicated {self.link.target_field} in [{self.link.target}]: {examples(self.duplicates)}')
+        return errors
+
+
+def examples(values: list) -> str:
+    more = f' and {len(values) - MAX_EXAMPLES} more' if len(values) > MAX_EXAMPLES else ''
+    return ', '.join(map(str, values[:MAX_EXAMPLES])) + more
+
+
+def link_ids(sheet: pd.DataFrame, field: str) -> pd.Series:
+    """Non missing IDs of field, one per value of multi-valued cells"""
+    ids = MultiValue.parse(sheet[field].astype(object), sep=SEP).notna().values
+    return pd.Series(ids, dtype=object).astype(str)
+
+
+def check_link(source_sheet: pd.DataFrame, target_sheet: pd.DataFrame, link: Link) -> LinkReport:
+    references = link_ids(source_sheet, link.source_field)
+    target_ids = link_ids(target_sheet, link.target_field)
+    target_index = pd.Index(target_ids.unique())
+    referenced = references.unique()
+    return LinkReport(link=link, source_rows=len(source_sheet), references=len(references),
+                      target_rows=len(target_sheet),
+                      orphans=list(referenced[~pd.Index(referenced).isin(target_index)]),
+                      duplicates=list(target_ids[target_ids.duplicated()].unique()),
+                      unused=list(target_index[~target_index.isin(referenced)]))
+
+
+def check_links(spreadsheet_obj) -> list:
+    """Reports of the links of links_all whose sheets and ID fields are all in the workbook"""
+    sheets = {}
+    def sheet(name):
+        if name not in sheets:
+            sheets[name] = remove_field_desc_lines(spreadsheet_obj.parse(name))
+        return sheets[name]
+    reports = []
+    for link in links_all:
+        if link.source not in spreadsheet_obj.sheet_names or link.target not in spreadsheet_obj.sheet_names:
+            continue
+        if link.source_field not in sheet(link.source) or link.target_field not in sheet(link.target):
+            continue
+        reports.append(check_link(sheet(link.source), sheet(link.target), link))
+    return reports
+
+
+def print_link_report(reports: list):
+    print('Link check:')
+    table = pd.DataFrame([{
+        'link': f'{report.link.source} -> {report.link.target}',
+        'rows': report.source_rows,
+        'references': report.references,
+        'target rows': report.target_rows,
+        'orphans': len(report.orphans),
+        'duplicates': len(report.duplicates),
+        'unused': len(report.unused)
+    } for report in reports])
+    if not table.empty:
+        print(table.to_string(index=False))
+    for report in reports:
+        for error in report.errors:
+            print(f'Link error: {error}')
+
+
+def preflight_links(spreadsheet_obj, check: str = 'warn') -> list:
+    """Check the links, print the report and, with check='abort', raise on orphans or duplicates"""
+    if check == 'off':
+        return []
+    reports = check_links(spreadsheet_obj)
+    print_link_report(reports)
+    errors = [error for report in reports for error in report.errors]
+    if errors and check == 'abort':
+        raise RuntimeError('problem linking worksheets: ' + '; '.join(errors))
+    return reports
@@ -0,0 +1,106 @@
+"""
+Multi-valued fields of DCP spreadsheets are stored as `||` separated strings.
+MultiValue parses such a column once into a flat array of values and the row position
+of each value (offsets), so that the first/unique/contains/join operations are vectorized
+and the `||` string is only built again when the column is written.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+
+SEP = '||'
+
+
+@dataclass
+class MultiValue:
+    values: np.ndarray
+    rows: np.ndarray
+    index: pd.Index
+
+    @classmethod
+    def parse(cls, series: pd.Series, sep: str = SEP) -> 'MultiValue':
+        """Split each value on sep. Missing values are kept as a single NaN value of their row"""
+        split = series.str.split(sep, regex=False)
+        rows = np.repeat(np.arange(len(series)), np.nan_to_num(split.str.len().to_numpy(dtype=float), nan=1).astype(int))
+        return cls(values=split.explode().to_numpy(dtype=object), rows=rows, index=series.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def _series(self, values, rows) -> pd.Series:
+        result = np.full(len(self), np.nan, dtype=object)
+        result[rows] = values
+        return pd.Series(result, index=self.index, dtype=object)
+
+    def _starts(self) -> np.ndarray:
+        return np.flatnonzero(np.r_[True, self.rows[1:] != self.rows[:-1]]) if len(self.rows) else self.rows
+
+    def notna(self) -> 'MultiValue':
+        mask = pd.notna(self.values)
+        return MultiValue(values=self.values[mask], rows=self.rows[mask], index=self.index)
+
+    def first(self) -> pd.Series:
+        starts = self._starts()
+        return self._series(self.values[starts], self.rows[starts])
+
+    def rest(self) -> pd.Series:
+        """All but the first value of each row joined, NaN for rows with a single value"""
+        mask = np.ones(len(self.rows), dtype=bool)
+        mask[self._starts()] = False
+        return MultiValue(values=self.values[mask], rows=self.rows[mask], index=self.index).join()
+
+    def unique(self) -> 'MultiValue':
+        """Drop repeated values within each row, keeping the first occurrence"""
+        keep = ~pd.DataFrame({'row': self.rows, 'value': self.values}).duplicated().to_numpy()
+        return MultiValue(values=self.values[keep], rows=self.rows[keep], index=self.index)
+
+    def drop(self, value) -> 'MultiValue':
+        keep = self.values != value
+        return MultiValue(values=self.values[keep], rows=self.rows[keep], index=self.index)
+
+    def contains(self, value) -> pd.Series:
+        matches = np.zeros(len(self), dtype=bool)
+        matches[self.rows[self.values == value]] = True
+        return pd.Series(matches, index=self.index)
+
+    def isin(self, values) -> pd.Series:
+        """Rows with any of their values in values. Missing values match missing values, like merge keys"""
+        matches = np.zeros(len(self), dtype=bool)
+        matches[self.rows[pd.Series(self.values, dtype=object).isin(values).to_numpy()]] = True
+        return pd.Series(matches, index=self.index)
+
+    def join(self, sep: str = SEP) -> pd.Series:
+        """Serialise back to sep separated strings, NaN for rows without values"""
+        present = self.notna()
+        if not len(present.rows):
+            return self._series(present.values, present.rows)
+        joined = pd.Series(present.values, dtype=object).astype(str).groupby(present.rows, sort=False).agg(sep.join)
+        return self._series(joined.to_numpy(dtype=object), joined.index.to_numpy())
+
+    def explode(self, df: pd.DataFrame, column: str) -> pd.DataFrame:
+        """Repeat the rows of df once for every value, placing the values in column"""
+        return df.iloc[self.rows].assign(**{column: self.values})
+
+
+def join_columns(df: pd.DataFrame, sep: str = SEP) -> pd.Series:
+    """Join the values of all columns of each row"""
+    joined = df.iloc[:, 0].astype(str)
+    for column in df.columns[1:]:
+        joined = joined + sep + df[column].astype(str)
+    return joined
+
+
+def join_unique(df: pd.DataFrame, group_field: str, sep: str = SEP) -> pd.DataFrame:
+    """
+    Group df by group_field and join the unique non missing values of every other column,
+    keeping the order of appearance. Groups without values get an empty string.
+    """
+    groups = pd.Index(df[group_field].dropna().drop_duplicates().sort_values(), name=group_field)
+    grouped = {}
+    for column in df.columns.drop(group_field):
+        values = df[[group_field, column]].dropna().drop_duplicates()
+        joined = values[column].astype(str).groupby(values[group_field], sort=False).agg(sep.join)
+        grouped[column] = joined.reindex(groups).fillna('')
+    return pd.DataFrame(grouped, index=groups)
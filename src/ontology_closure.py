@@ -0,0 +1,197 @@
+"""
+Precomputed ancestor closure of ontologies (HsapDv, UBERON), to answer hierarchy questions offline.
+Terms get compact integer codes in topological order, parents before children, and the closure
+stores the ancestor codes of every term, itself included, as one CSR array. Each (term, ancestor)
+pair is hashed once at load into an index of pair codes, so ancestor queries are a hash lookup and
+are vectorized over arrays of terms.
+Snapshots are built from OBO files over is_a and part_of (stages and tissues nest with part_of):
+
+    python -m src.ontology_closure --obo hsapdv.obo -o data/ontology/hsapdv.npz
+
+and loaded from ONTOLOGY_DIR with load_index. Without a snapshot the lookups fall back to OLS.
+"""
+import argparse
+import os
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+ONTOLOGY_DIR = 'data/ontology'
+RELATIONS = ['is_a', 'part_of']
+
+
+@dataclass
+class ClosureIndex:
+    ids: np.ndarray
+    names: np.ndarray
+    # ancestors of code c are indices[indptr[c]:indptr[c + 1]], c included
+    indptr: np.ndarray
+    indices: np.ndarray
+
+    def __post_init__(self):
+        self._codes = pd.Index(self.ids)
+        self.depth = np.diff(self.indptr)
+        terms = np.repeat(np.arange(len(self.ids), dtype=np.int64), self.depth)
+        self._pairs = pd.Index(terms * len(self.ids) + self.indices)
+
+    def codes(self, term_ids) -> np.ndarray:
+        """Code of each term ID, -1 for IDs not in the ontology"""
+        return self._codes.get_indexer(pd.Index(np.atleast_1d(np.asarray(term_ids, dtype=object))))
+
+    def label(self, term_id):
+        code = self.codes([term_id])[0]
+        return self.names[code] if code >= 0 else None
+
+    def find(self, pattern: str) -> pd.Series:
+        """Regex match of the labels fully matching pattern, by term ID"""
+        names = pd.Series(self.names, index=self.ids, dtype=object)
+        return names.str.extract(f'^(?:{pattern})$').dropna(how='all').squeeze(axis=1)
+
+    def is_a(self, term_ids, ancestor_id) -> np.ndarray:
+        """Whether each term is ancestor_id or one of its descendants"""
+        codes = self.codes(term_ids)
+        ancestor = self.codes([ancestor_id])[0]
+        if ancestor < 0:
+            return np.zeros(len(codes), dtype=bool)
+        pairs = codes.astype(np.int64) * len(self.ids) + ancestor
+        return (codes >= 0) & (self._pairs.get_indexer(pairs) >= 0)
+
+    def descends_from(self, term_ids, ancestor_ids) -> np.ndarray:
+        """Whether each term is any of ancestor_ids or one of their descendants"""
+        matches = np.zeros(len(np.atleast_1d(term_ids)), dtype=bool)
+        for ancestor_id in ancestor_ids:
+            matches |= self.is_a(term_ids, ancestor_id)
+        return matches
+
+    def ancestors(self, term_id) -> list:
+        code = self.codes([term_id])[0]
+        if code < 0:
+            return []
+        return list(self.ids[self.indices[self.indptr[code]:self.indptr[code + 1]]])
+
+    def roll_up(self, term_ids, target_ids) -> np.ndarray:
+        """Nearest of target_ids that each term is, or descends from, None when none"""
+        # only the distinct terms are rolled up
+        codes, inverse = np.unique(self.codes(term_ids), return_inverse=True)
+        rolled = np.full(len(codes), None, dtype=object)
+        known = np.flatnonzero(codes >= 0)
+        lengths = self.depth[codes[known]]
+        if not lengths.sum():
+            return rolled[inverse]
+        # ancestor codes of all known terms, flattened
+        rows = np.repeat(known, lengths)
+        starts = np.repeat(self.indptr[codes[known]] - np.r_[0, np.cumsum(lengths)[:-1]], lengths)
+        ancestors = self.indices[starts + np.arange(lengths.sum())]
+        is_target = np.zeros(len(self.ids), dtype=bool)
+        target_codes = self.codes(target_ids)
+        is_target[target_codes[target_codes >= 0]] = True
+        candidates = pd.DataFrame({'row': rows, 'code': ancestors, 'depth': self.depth[ancestors]})
+        candidates = candidates[is_target[candidates['code']]]
+        # the target with the most ancestors is the most specific one
+        nearest = candidates.sort_values('depth', kind='stable').drop_duplicates('row', keep='last')
+        rolled[nearest['row'].to_numpy()] = self.ids[nearest['code'].to_numpy()]
+        return rolled[inverse]
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez_compressed(path, ids=self.ids.astype(str), names=self.names.astype(str),
+                            indptr=self.indptr, indices=self.indices)
+
+    @classmethod
+    def load(cls, path: str) -> 'ClosureIndex':
+        with np.load(path, allow_pickle=False) as snapshot:
+            return cls(ids=snapshot['ids'].astype(object), names=snapshot['names'].astype(object),
+                       indptr=snapshot['indptr'], indices=snapshot['indices'])
+
+
+def parse_obo(obo_path: str, relations: list = RELATIONS) -> dict:
+    """Name and parent IDs of each non obsolete term of an OBO file, over relations"""
+    terms = {}
+    term = None
+    relation_pattern = re.compile(r'relationship:\s*(\S+)\s+(\S+)')
+    with open(obo_path, encoding='utf-8') as obo:
+        for line in obo:
+            line = line.strip()
+            if line.startswith('['):
+                term = {'id': None, 'name': '', 'parents': [], 'obsolete': False} if line == '[Term]' else None
+                continue
+            if term is None or ':' not in line:
+                continue
+            tag, value = line.split(':', 1)
+            value = value.split(' ! ')[0].strip()
+            if tag == 'id':
+                term['id'] = value
+                terms[value] = term
+            elif tag == 'name':
+                term['name'] = value
+            elif tag == 'is_obsolete':
+                term['obsolete'] = value == 'true'
+            elif tag == 'is_a' and 'is_a' in relations:
+                term['parents'].append(value.split()[0])
+            elif tag == 'relationship':
+                match = relation_pattern.match(line)
+                if match and match.group(1) in relations:
+                    term['parents'].append(match.group(2))
+    return {term_id: (term['name'], term['parents']) for term_id, term in terms.items() if not term['obsolete']}
+
+
+def build_index(terms: dict) -> ClosureIndex:
+    """Closure of the terms, a dict of (name, parent IDs) by term ID. Parents outside the terms are left out"""
+    parents = {term_id: [parent for parent in dict.fromkeys(term_parents) if parent in terms]
+               for term_id, (_, term_parents) in terms.items()}
+    children = {term_id: [] for term_id in terms}
+    for term_id, term_parents in parents.items():
+        for parent in term_parents:
+            children[parent].append(term_id)
+    # topological order, parents before children
+    waiting = {term_id: len(term_parents) for term_id, term_parents in parents.items()}
+    order = [term_id for term_id, count in waiting.items() if not count]
+    for term_id in order:
+        for child in children[term_id]:
+            waiting[child] -= 1
+            if not waiting[child]:
+                order.append(child)
+    if len(order) < len(terms):
+        raise ValueError(f'{len(terms) - len(order)} terms are in a cycle of parents')
+    code = {term_id: idx for idx, term_id in enumerate(order)}
+    closure = []
+    for term_id in order:
+        ancestors = {code[term_id]}
+        for parent in parents[term_id]:
+            ancestors.update(closure[code[parent]])
+        closure.append(ancestors)
+    indptr = np.r_[0, np.cumsum([len(ancestors) for ancestors in closure])].astype(np.int64)
+    indices = np.fromiter((ancestor for ancestors in closure for ancestor in sorted(ancestors)),
+                          dtype=np.int32, count=indptr[-1])
+    return ClosureIndex(ids=np.array(order, dtype=object), names=np.array([terms[term_id][0] for term_id in order], dtype=object),
+                        indptr=indptr, indices=indices)
+
+
+@lru_cache(maxsize=None)
+def load_index(ontology: str, ontology_dir: str = ONTOLOGY_DIR):
+    """Closure index snapshot of the ontology, e.g. hsapdv, None when there is no snapshot"""
+    path = os.path.join(ontology_dir, f'{ontology}.npz')
+    if not os.path.exists(path):
+        return None
+    return ClosureIndex.load(path)
+
+
+def define_parser():
+    parser = argparse.ArgumentParser(description='Build an ontology closure index snapshot from an OBO file')
+    parser.add_argument('--obo', action='store', dest='obo', type=str, required=True,
+                        help='OBO file, e.g. http://purl.obolibrary.org/obo/hsapdv.obo')
+    parser.add_argument('--output', '-o', action='store', dest='output', type=str, required=True,
+                        help=f'snapshot to write, e.g. {ONTOLOGY_DIR}/hsapdv.npz')
+    parser.add_argument('--relations', action='store', nargs='+', default=RELATIONS, dest='relations', type=str,
+                        required=False, help='relations to close over')
+    return parser
+
+
+if __name__ == '__main__':
+    args = define_parser().parse_args()
+    index = build_index(parse_obo(args.obo, args.relations))
+    index.save(args.output)
+    print(f'Closure index of {len(index.ids)} terms and {len(index.indices)} ancestor pairs created at {args.output}')
@@ -0,0 +1,162 @@
+"""
+Sampling profiler of the conversions (`--profile`).
+A background thread samples the stack of the converting thread every SAMPLE_INTERVAL seconds,
+which costs a few percent of run time, unlike tracing profilers that slow pandas code down a lot.
+Samples are weighted by the time since the previous one, since long calls that hold the GIL delay
+the sampling thread.
+Each spreadsheet gets a speedscope file (open it at https://www.speedscope.app) and a folded stacks
+file for flamegraph.pl. The batch summary adds up the time of each stage, the innermost function of
+flatten_dcp or convert_flat_dcp_to_tier1 on the stack, and the hottest functions across all files.
+"""
+import json
+import os
+import sys
+import sysconfig
+import threading
+import time
+from collections import Counter
+
+PROFILE_DIR = 'data/profiles'
+SAMPLE_INTERVAL = 0.005
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STDLIB = sysconfig.get_paths()['stdlib']
+STAGE_MODULES = {'src/flatten_dcp.py': 'flatten', 'src/convert_flat_dcp_to_tier1.py': 'convert'}
+TOP_FUNCTIONS = 20
+
+
+class SamplingProfiler:
+    """Context manager sampling the stacks of the thread that enters it"""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        # seconds sampled in each stack
+        self.stacks = Counter()
+        self.samples = 0
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._target = threading.get_ident()
+        self._start = time.perf_counter()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self._start
+        return False
+
+    def _sample(self):
+        last = self._start
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            now = time.perf_counter()
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            # root first
+            self.stacks[tuple(reversed(stack))] += now - last
+            self.samples += 1
+            last = now
+
+
+def frame_info(code) -> dict:
+    path = code.co_filename
+    if 'site-packages' in path:
+        path = path.split('site-packages' + os.sep)[-1]
+    elif path.startswith(PROJECT_ROOT):
+        path = os.path.relpath(path, PROJECT_ROOT)
+    elif path.startswith(STDLIB):
+        path = os.path.relpath(path, STDLIB)
+    return {'name': getattr(code, 'co_qualname', code.co_name), 'file': path, 'line': code.co_firstlineno}
+
+
+def write_speedscope(profiler: SamplingProfiler, name: str, profile_dir: str = PROFILE_DIR) -> str:
+    """Write the samples as a speedscope sampled profile and as folded stacks, returns the speedscope path"""
+    os.makedirs(profile_dir, exist_ok=True)
+    frames, frame_index = [], {}
+    samples, weights = [], []
+    for stack, seconds in profiler.stacks.items():
+        for code in stack:
+            if code not in frame_index:
+                frame_index[code] = len(frames)
+                frames.append(frame_info(code))
+        samples.append([frame_index[code] for code in stack])
+        weights.append(seconds)
+    speedscope = {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': name,
+        'exporter': 'hca-dcp-to-tier1',
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': name,
+            'unit': 'seconds',
+            'startValue': 0,
+            'endValue': sum(weights),
+            'samples': samples,
+            'weights': weights
+        }]
+    }
+    speedscope_path = os.path.join(profile_dir, f'{name}.speedscope.json')
+    with open(speedscope_path, 'w') as speedscope_file:
+        json.dump(speedscope, speedscope_file)
+    with open(os.path.join(profile_dir, f'{name}.folded'), 'w') as folded_file:
+        for sample, weight in zip(samples, weights):
+            stack = ';'.join(f"{frames[idx]['name']} ({frames[idx]['file']})" for idx in sample)
+            # flamegraph.pl needs integer counts, use milliseconds
+            folded_file.write(f'{stack} {round(weight * 1000)}\n')
+    print(f'Profile of {name} ({profiler.duration:.1f}s, {profiler.samples} samples) created at {speedscope_path}')
+    return speedscope_path
+
+
+def stage_of(frames: list, sample: list) -> str:
+    """Innermost function of a stage module on the stack, e.g. flatten: join_worksheet"""
+    for idx in reversed(sample):
+        stage = STAGE_MODULES.get(frames[idx]['file'])
+        if stage:
+            return f"{stage}: {frames[idx]['name']}"
+    return 'other'
+
+
+def summarise(speedscope_paths: list, top: int = TOP_FUNCTIONS) -> str:
+    """Time per stage and hottest functions (own time) over all profiles"""
+    stage_time, function_time, function_stage, total = Counter(), Counter(), {}, 0.0
+    for speedscope_path in speedscope_paths:
+        with open(speedscope_path) as speedscope_file:
+            speedscope = json.load(speedscope_file)
+        frames = speedscope['shared']['frames']
+        profile = speedscope['profiles'][0]
+        for sample, weight in zip(profile['samples'], profile['weights']):
+            if not sample:
+                continue
+            total += weight
+            stage = stage_of(frames, sample)
+            stage_time[stage] += weight
+            leaf = frames[sample[-1]]
+            function = f"{leaf['name']} ({leaf['file']}:{leaf['line']})"
+            function_time[function] += weight
+            function_stage.setdefault(function, Counter())[stage] += weight
+    lines = [f'Profiled {len(speedscope_paths)} spreadsheets, {total:.1f}s sampled']
+    if not total:
+        return lines[0]
+    lines += ['', 'Time per stage:']
+    lines += [f'{seconds:8.2f}s {seconds / total:6.1%}  {stage}' for stage, seconds in stage_time.most_common()]
+    lines += ['', f'Top {top} functions (own time):']
+    lines += [f'{seconds:8.2f}s {seconds / total:6.1%}  {function}  [{function_stage[function].most_common(1)[0][0]}]'
+              for function, seconds in function_time.most_common(top)]
+    return '\n'.join(lines)
+
+
+def write_summary(speedscope_paths: list, profile_dir: str = PROFILE_DIR) -> str:
+    summary = summarise(speedscope_paths)
+    summary_path = os.path.join(profile_dir, 'summary.txt')
+    with open(summary_path, 'w') as summary_file:
+        summary_file.write(summary + '\n')
+    print(summary)
+    print(f'Profile summary created at {summary_path}')
+    return summary_path
@@ -0,0 +1,175 @@
+"""
+Cache of cleaned DCP spreadsheets, after remove_empty_tabs_and_fields and rename_vague_friendly_names,
+so that reruns of the same workbook skip the slow openpyxl parsing.
+Entries are keyed by the workbook content hash and CLEANER_VERSION (bump it whenever the cleaning
+functions change). Each sheet is stored as a feather file with one string column per field and one
+type column, so that parse() returns exactly the same values (str, int, float, bool, datetime) as
+pd.ExcelFile.parse would.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from dataclasses import dataclass
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+
+CACHE_DIR = 'data/sheet_cache'
+CLEANER_VERSION = 1
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+MAX_CACHE_AGE_DAYS = 30
+
+# type codes of the cached values
+NULL, STR, INT, FLOAT, BOOL, DATETIME = range(6)
+DECODERS = {
+    INT: int,
+    FLOAT: float,
+    BOOL: lambda value: value == 'True',
+    DATETIME: datetime.fromisoformat
+}
+
+
+@dataclass
+class CachedSpreadsheet:
+    """Cleaned sheets loaded from the cache, supporting the parts of pd.ExcelFile used for flattening"""
+    sheets: dict
+
+    @property
+    def sheet_names(self) -> list:
+        return list(self.sheets)
+
+    def parse(self, sheet_name: str) -> pd.DataFrame:
+        return self.sheets[sheet_name].copy()
+
+
+def workbook_hash(spreadsheet_path: str) -> str:
+    sha = hashlib.sha256()
+    with open(spreadsheet_path, 'rb') as spreadsheet:
+        for chunk in iter(lambda: spreadsheet.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def cache_key(spreadsheet_path: str, fields: set = None) -> str:
+    """Content hash and cleaner version, plus the kept fields when unused fields were removed"""
+    key = f'{workbook_hash(spreadsheet_path)}-v{CLEANER_VERSION}'
+    if fields is not None:
+        key += '-' + hashlib.sha256('\n'.join(sorted(fields)).encode()).hexdigest()[:16]
+    return key
+
+
+def type_code(value) -> int:
+    if pd.isna(value):
+        return NULL
+    if isinstance(value, str):
+        return STR
+    if isinstance(value, (bool, np.bool_)):
+        return BOOL
+    if isinstance(value, (int, np.integer)):
+        return INT
+    if isinstance(value, (float, np.floating)):
+        return FLOAT
+    if isinstance(value, datetime):
+        return DATETIME
+    # any other type (e.g. time) is kept as str
+    return STR
+
+
+def encode_column(series: pd.Series) -> tuple:
+    codes = np.array([type_code(value) for value in series], dtype=np.int8)
+    values = [value.isoformat() if code == DATETIME else str(value) if code != NULL else None
+              for value, code in zip(series, codes)]
+    return values, codes
+
+
+def decode_column(values: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    decoded = values.astype(object)
+    decoded[codes == NULL] = np.nan
+    for code, decoder in DECODERS.items():
+        idx = np.flatnonzero(codes == code)
+        decoded[idx] = [decoder(value) for value in values[idx]]
+    return decoded
+
+
+def store(key: str, spreadsheet_obj: pd.ExcelFile, cache_dir: str = CACHE_DIR):
+    from pyarrow import feather
+    import pyarrow as pa
+
+    tmp_dir = os.path.join(cache_dir, f'{key}.tmp-{os.getpid()}')
+    os.makedirs(tmp_dir, exist_ok=True)
+    manifest = {'sheets': []}
+    for idx, sheet in enumerate(spreadsheet_obj.sheet_names):
+        df = spreadsheet_obj.parse(sheet)
+        arrays = {}
+        for col_idx, col in enumerate(df.columns):
+            values, codes = encode_column(df[col])
+            arrays[f'{col_idx}'] = pa.array(values, type=pa.string())
+            arrays[f'{col_idx}_type'] = pa.array(codes, type=pa.int8())
+        feather.write_feather(pa.table(arrays), os.path.join(tmp_dir, f'{idx}.feather'), compression='uncompressed')
+        manifest['sheets'].append({
+            'name': sheet,
+            'columns': df.columns.tolist(),
+            'dtypes': [str(dtype) for dtype in df.dtypes]
+        })
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    entry_dir = os.path.join(cache_dir, key)
+    if os.path.exists(entry_dir):
+        shutil.rmtree(tmp_dir)
+        return
+    os.replace(tmp_dir, entry_dir)
+
+
+def load(key: str, cache_dir: str = CACHE_DIR):
+    """Return the cached CachedSpreadsheet, or None if there is no complete entry for key"""
+    entry_dir = os.path.join(cache_dir, key)
+    manifest_path = os.path.join(entry_dir, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return None
+    from pyarrow import feather
+
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+    sheets = {}
+    for idx, sheet in enumerate(manifest['sheets']):
+        table = feather.read_table(os.path.join(entry_dir, f'{idx}.feather'), memory_map=True)
+        columns = {}
+        for col_idx, (col, dtype) in enumerate(zip(sheet['columns'], sheet['dtypes'])):
+            values = table.column(f'{col_idx}').to_numpy(zero_copy_only=False)
+            codes = table.column(f'{col_idx}_type').to_numpy()
+            columns[col] = pd.Series(decode_column(values, codes), dtype=object)
+            if dtype != 'object':
+                columns[col] = columns[col].astype(dtype)
+        sheets[sheet['name']] = pd.DataFrame(columns, columns=sheet['columns'])
+    # last use time, for size eviction
+    os.utime(manifest_path)
+    return CachedSpreadsheet(sheets)
+
+
+def entry_size(entry_dir: str) -> int:
+    return sum(os.path.getsize(os.path.join(entry_dir, file)) for file in os.listdir(entry_dir))
+
+
+def evict(cache_dir: str = CACHE_DIR, max_bytes: int = MAX_CACHE_BYTES, max_age_days: float = MAX_CACHE_AGE_DAYS):
+    """Remove entries not used for max_age_days, then least recently used ones until the cache fits max_bytes"""
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for key in os.listdir(cache_dir):
+        manifest_path = os.path.join(cache_dir, key, 'manifest.json')
+        if os.path.exists(manifest_path):
+            entries.append((os.path.getmtime(manifest_path), key))
+    entries.sort()
+    now = time.time()
+    total_size = sum(entry_size(os.path.join(cache_dir, key)) for _, key in entries)
+    for last_used, key in entries:
+        if now - last_used <= max_age_days * 24 * 3600 and total_size <= max_bytes:
+            break
+        entry_dir = os.path.join(cache_dir, key)
+        total_size -= entry_size(entry_dir)
+        shutil.rmtree(entry_dir)
+        print(f'Removed {key} from sheet cache')
@@ -0,0 +1,28 @@
+"""
+Spreadsheet paths of the command line scripts, from paths, glob patterns and manifest files.
+Kept apart from the conversion modules, so that lightweight scripts like inspect_spreadsheets do
+not import the conversion stack.
+"""
+import os
+from glob import glob, has_magic
+
+
+def read_manifest(manifest_path):
+    """Paths or glob patterns of a manifest file, relative to its directory. Blank and # lines are skipped"""
+    manifest_dir = os.path.dirname(manifest_path)
+    with open(manifest_path) as manifest:
+        lines = [line.strip() for line in manifest]
+    return [os.path.join(manifest_dir, line) for line in lines if line and not line.startswith('#')]
+
+
+def expand_spreadsheet_paths(patterns, manifest_path=None):
+    """Unique spreadsheet paths matching the patterns. A path without matches is kept, to be reported as failed"""
+    if manifest_path:
+        patterns = list(patterns) + read_manifest(manifest_path)
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob(pattern)) if has_magic(pattern) else [pattern]
+        if not matches:
+            print(f'No spreadsheet matches {pattern}')
+        paths.extend(os.path.normpath(path) for path in matches)
+    return list(dict.fromkeys(paths))
@@ -0,0 +1,101 @@
+"""
+Read and write the intermediate (denormalised / grouped) and tier 1 tables
+in csv, parquet or feather format.
+Binary formats need pyarrow. Values are stored as nullable strings, the same way
+convert_flat_dcp_to_tier1 reads the csv files (dtype=str), so every format
+gives identical tier 1 outputs.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+
+TABLE_FORMATS = ['csv', 'parquet', 'feather']
+
+
+def table_path(path: str, table_format: str) -> str:
+    """Replace the extension of path with the one of table_format"""
+    if table_format not in TABLE_FORMATS:
+        raise ValueError(f'Unsupported table format {table_format}. Possible formats {TABLE_FORMATS}')
+    return f'{os.path.splitext(path)[0]}.{table_format}'
+
+
+def table_format_of(path: str) -> str:
+    table_format = os.path.splitext(path)[1].lstrip('.').lower()
+    if table_format not in TABLE_FORMATS:
+        raise ValueError(f'Unsupported table extension for {path}. Possible formats {TABLE_FORMATS}')
+    return table_format
+
+
+def to_string_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Cast all values to str, as read_csv(dtype=str) would return them. Missing and empty values become null"""
+    str_df = df.astype(str)
+    return str_df.where(df.notna() & (str_df != ''), None)
+
+
+def write_table(df: pd.DataFrame, path: str, index: bool = False):
+    table_format = table_format_of(path)
+    if table_format == 'csv':
+        df.to_csv(path, index=index)
+        return
+    if index:
+        df = df.reset_index()
+    df = to_string_frame(df.reset_index(drop=True))
+    if table_format == 'parquet':
+        df.to_parquet(path, index=False)
+    else:
+        # uncompressed feather can be memory mapped without decompressing
+        df.to_feather(path, compression='uncompressed')
+
+
+def read_table(path: str) -> pd.DataFrame:
+    table_format = table_format_of(path)
+    if table_format == 'csv':
+        return pd.read_csv(path, dtype=str)
+    if table_format == 'parquet':
+        df = pd.read_parquet(path, memory_map=True)
+    else:
+        from pyarrow import feather
+        df = feather.read_table(path, memory_map=True).to_pandas()
+    return with_nan(df)
+
+
+def read_table_chunks(path: str, chunk_rows: int, columns: list = None):
+    """Yield the table in chunks of chunk_rows rows, as read_table would read them, only the columns it has of columns if given"""
+    table_format = table_format_of(path)
+    if table_format == 'csv':
+        usecols = None if columns is None else (lambda column: column in columns)
+        yield from pd.read_csv(path, dtype=str, chunksize=chunk_rows, usecols=usecols)
+        return
+    if table_format == 'parquet':
+        from pyarrow import parquet
+        parquet_file = parquet.ParquetFile(path, memory_map=True)
+        names = parquet_file.schema_arrow.names
+        batches = parquet_file.iter_batches(batch_size=chunk_rows,
+                                            columns=None if columns is None else [name for name in names if name in columns])
+        for batch in batches:
+            yield with_nan(batch.to_pandas())
+        return
+    from pyarrow import feather
+    table = feather.read_table(path, memory_map=True)
+    if columns is not None:
+        table = table.select([name for name in table.column_names if name in columns])
+    for start in range(0, table.num_rows, chunk_rows):
+        yield with_nan(table.slice(start, chunk_rows).to_pandas())
+
+
+def with_nan(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Arrow based readers return None for missing strings, while the edit functions expect
+    the np.nan object itself (i.e. `value is np.nan` checks), as read_csv returns it.
+    Only the string columns with missing values are replaced, the other ones are kept as read
+    """
+    for position in np.flatnonzero((df.dtypes == object).to_numpy()):
+        column = df.iloc[:, position]
+        missing = column.isna().to_numpy()
+        if missing.any():
+            values = column.to_numpy(dtype=object, copy=True)
+            values[missing] = np.nan
+            df.isetitem(position, values)
+    return df
@@ -0,0 +1,272 @@
+"""
+Task queue in a shared work directory (e.g. on NFS), for workers on several nodes without a coordinator.
+Every task has a definition file in tasks/, written once by an exclusive hard link so that any worker
+can seed the queue, and a token file whose directory is its state:
+
+    pending/<task>~<attempt>            waiting for a worker
+    running/<task>~<attempt>~<worker>   claimed by a worker, by an atomic rename from pending/
+    done/<task>.json, failed/<task>.json   final, with the result or the error
+
+A worker refreshes the modification time of its running token every HEARTBEAT seconds. A token not
+refreshed for LEASE seconds belongs to a crashed worker and is renamed back to pending/ by any other
+worker, up to MAX_ATTEMPTS attempts. A definition left without a token for LEASE seconds, by a worker
+crashing while adding it, gets its first token from any other worker. Ages are measured against the
+modification time of a file touched in the work directory, so that the clocks of the nodes do not need
+to agree. Tasks of a later stage are claimed only when every defined task of the earlier stages is done
+or failed, whether its token was created yet or not.
+"""
+import json
+import os
+import re
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+HEARTBEAT = 30
+LEASE = 300
+MAX_ATTEMPTS = 3
+POLL = 10
+STATES = ['tasks', 'pending', 'running', 'done', 'failed']
+
+
+@dataclass
+class Task:
+    task_id: str
+    stage: int
+    payload: dict = field(default_factory=dict)
+    attempt: int = 1
+    token: str = None
+
+
+def task_name(name: str) -> str:
+    """Task ID of a name, e.g. a spreadsheet file name, safe in file names"""
+    return re.sub(r'[^\w.-]', '_', name)
+
+
+def default_worker_id() -> str:
+    return task_name(f'{socket.gethostname()}-{os.getpid()}')
+
+
+class TaskQueue:
+
+    def __init__(self, work_dir: str, worker_id: str = None, lease: float = LEASE, heartbeat: float = HEARTBEAT,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.work_dir = work_dir
+        self.worker_id = task_name(worker_id) if worker_id else default_worker_id()
+        self.lease = lease
+        self.heartbeat_interval = heartbeat
+        self.max_attempts = max_attempts
+        # definitions never change once written
+        self.definitions = {}
+        for state in STATES:
+            os.makedirs(self.path(state), exist_ok=True)
+
+    def path(self, state: str, name: str = '') -> str:
+        return os.path.join(self.work_dir, state, name)
+
+    def now(self) -> float:
+        """Current time of the work directory file system"""
+        clock = os.path.join(self.work_dir, 'clock')
+        with open(clock, 'a'):
+            os.utime(clock)
+        return os.stat(clock).st_mtime
+
+    def add(self, task_id: str, stage: int = 0, payload: dict = None) -> bool:
+        """Add a task unless it was already added, by any worker. Returns whether it was added"""
+        temporary = self.path('tasks', f'.{task_id}.{self.worker_id}.tmp')
+        with open(temporary, 'w') as definition:
+            json.dump({'task_id': task_id, 'stage': stage, 'payload': payload or {}}, definition)
+        try:
+            # the definition appears complete, and only once
+            os.link(temporary, self.path('tasks', f'{task_id}.json'))
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(temporary)
+        self.create_token(task_id)
+        return True
+
+    def create_token(self, task_id: str):
+        try:
+            os.close(os.open(self.path('pending', f'{task_id}~1'), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            pass
+
+    def task(self, task_id: str) -> Task:
+        if task_id not in self.definitions:
+            with open(self.path('tasks', f'{task_id}.json')) as definition:
+                self.definitions[task_id] = json.load(definition)
+        return Task(**self.definitions[task_id])
+
+    def task_ids(self) -> list:
+        return [name[:-len('.json')] for name in self.tokens('tasks') if name.endswith('.json')]
+
+    def tokens(self, state: str) -> list:
+        return sorted(name for name in os.listdir(self.path(state)) if not name.startswith('.'))
+
+    def finished(self, task_id: str) -> bool:
+        return any(os.path.exists(self.path(state, f'{task_id}.json')) for state in ('done', 'failed'))
+
+    def open_stages(self) -> set:
+        """Stages of the tasks not done or failed, including those whose token is not created yet"""
+        return {self.task(task_id).stage for task_id in self.task_ids() if not self.finished(task_id)}
+
+    def tokenless(self) -> list:
+        """Tasks defined at least a lease ago that have no token and no result, their worker crashed adding them"""
+        # tokens are listed before results, a token moving to a result in between is seen as one or the other
+        with_token = {name.lstrip('.').split('~')[0] for state in ('pending', 'running')
+                      for name in os.listdir(self.path(state))}
+        now = self.now()
+        tokenless = []
+        for task_id in self.task_ids():
+            if task_id in with_token or self.finished(task_id):
+                continue
+            try:
+                age = now - os.stat(self.path('tasks', f'{task_id}.json')).st_mtime
+            except FileNotFoundError:
+                continue
+            if age >= self.lease:
+                tokenless.append(task_id)
+        return tokenless
+
+    def requeue_expired(self) -> list:
+        """
+        Put the running tasks whose lease expired back in pending/, or fail them after max_attempts,
+        and create the missing tokens of tasks added by crashed workers
+        """
+        requeued = []
+        for task_id in self.tokenless():
+            print(f'Task {task_id} has no token, its worker crashed adding it')
+            self.create_token(task_id)
+            requeued.append(task_id)
+        now = self.now()
+        for token in self.tokens('running'):
+            try:
+                age = now - os.stat(self.path('running', token)).st_mtime
+            except FileNotFoundError:
+                continue
+            if age < self.lease:
+                continue
+            task_id, attempt, worker_id = token.split('~')
+            if int(attempt) >= self.max_attempts:
+                claimed = self.path('running', f'.{token}.expired')
+                try:
+                    os.rename(self.path('running', token), claimed)
+                except FileNotFoundError:
+                    continue
+                self.write_result('failed', task_id, {'error': f'lease expired {attempt} times, last on {worker_id}'})
+                os.remove(claimed)
+                continue
+            try:
+                os.rename(self.path('running', token), self.path('pending', f'{task_id}~{int(attempt) + 1}'))
+                requeued.append(task_id)
+            except FileNotFoundError:
+                continue
+        return requeued
+
+    def claim(self):
+        """Claim a pending task of the earliest open stage, None if none can be claimed now"""
+        self.requeue_expired()
+        open_stages = self.open_stages()
+        if not open_stages:
+            return None
+        stage = min(open_stages)
+        for token in self.tokens('pending'):
+            task_id, attempt = token.split('~')
+            if self.finished(task_id):
+                # requeued after its worker finished late
+                self.remove_token('pending', token)
+                continue
+            task = self.task(task_id)
+            if task.stage != stage:
+                continue
+            running = f'{token}~{self.worker_id}'
+            try:
+                os.rename(self.path('pending', token), self.path('running', running))
+            except FileNotFoundError:
+                # claimed by another worker
+                continue
+            task.attempt, task.token = int(attempt), running
+            return task
+        return None
+
+    def drained(self) -> bool:
+        """Whether every task is done or failed"""
+        return not self.open_stages()
+
+    @contextmanager
+    def heartbeat(self, task: Task):
+        """Refresh the lease of task while the block runs"""
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.heartbeat_interval):
+                try:
+                    os.utime(self.path('running', task.token))
+                except FileNotFoundError:
+                    print(f'Lease of task {task.task_id} lost, it may run again on another worker')
+                    return
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield task
+        finally:
+            stop.set()
+            thread.join()
+
+    def write_result(self, state: str, task_id: str, result: dict):
+        temporary = self.path(state, f'.{task_id}.{self.worker_id}.tmp')
+        with open(temporary, 'w') as result_file:
+            json.dump(result, result_file)
+        os.replace(temporary, self.path(state, f'{task_id}.json'))
+
+    def remove_token(self, state: str, token: str):
+        try:
+            os.remove(self.path(state, token))
+        except FileNotFoundError:
+            pass
+
+    def complete(self, task: Task, result: dict = None):
+        """Write the result of task, unless it is final already, e.g. failed after its lease expired"""
+        if not self.finished(task.task_id):
+            self.write_result('done', task.task_id, {'worker': self.worker_id, 'attempt': task.attempt, **(result or {})})
+        self.remove_token('running', task.token)
+
+    def fail(self, task: Task, error: str):
+        if not self.finished(task.task_id):
+            self.write_result('failed', task.task_id, {'worker': self.worker_id, 'attempt': task.attempt, 'error': error})
+        self.remove_token('running', task.token)
+
+    def results(self, state: str) -> dict:
+        results = {}
+        for name in self.tokens(state):
+            with open(self.path(state, name)) as result_file:
+                results[name[:-len('.json')]] = json.load(result_file)
+        return results
+
+
+def run_worker(queue: TaskQueue, handle, poll: float = POLL) -> int:
+    """
+    Claim and handle tasks until every task is done or failed, waiting poll seconds when all open tasks
+    are running elsewhere. handle(task) returns a result dict or raises. Returns the number of tasks handled
+    """
+    handled = 0
+    while True:
+        task = queue.claim()
+        if task is None:
+            if queue.drained():
+                return handled
+            time.sleep(poll)
+            continue
+        print(f'Worker {queue.worker_id} running task {task.task_id} (attempt {task.attempt})')
+        with queue.heartbeat(task):
+            try:
+                result = handle(task)
+            except Exception as e:
+                print(f'Task {task.task_id} failed: {e!r}')
+                queue.fail(task, repr(e))
+            else:
+                queue.complete(task, result)
+        handled += 1
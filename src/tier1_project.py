@@ -0,0 +1,285 @@
+"""
+Tier 1 metadata of a DCP spreadsheet computed on demand, for tools that need the tier 1 rows of a few donors
+or samples without converting and writing the whole project:
+
+    project = Tier1Project.open('spreadsheet.xlsx')
+    project.donors()
+    project.samples(donor_id='donor_1')
+    project.tab('Tier 1 Sample Metadata', donor_id='donor_1')
+
+The workbook is opened on the first query, from the sheet cache when it was cleaned before, otherwise read only,
+cleaning each sheet when a query first needs it. A query walks the links back from the specimens of the requested
+donors or samples to the file rows that use them, and flattens and converts only those rows, grouped by specimen
+like dcp_to_tier1.py does by default. Only the fields that the tier 1 conversion uses are kept, as with --tier1_only.
+Sheets and the tier 1 rows of every converted specimen are kept in the object.
+"""
+from io import StringIO
+
+import pandas as pd
+
+from src import sheet_cache
+from src.convert_flat_dcp_to_tier1 import TEMPLATES, edit_rows, rename_cols, select_cols
+from src.dcp_to_tier1_mapping import DCP_TIER1_MAP, TIER1
+from src.flatten_dcp import (FIRST_DATA_LINE, add_project_metadata, design_paths, flatten_spreadsheet_rows,
+                             link_fields, links_all, prefix_columns, remove_field_desc_lines, rename_vague_field,
+                             tier1_fields, use_ingest_names, uses_vague_names)
+from src.multi_value import SEP, MultiValue, join_unique
+
+GROUP_FIELD = 'specimen_from_organism.biomaterial_core.biomaterial_id'
+SPECIMEN_SHEET = 'Specimen from organism'
+DONOR_SHEET = 'Donor organism'
+# sheets of the biomaterials a tier 1 sample ID can come from, see merge_sample_ids
+SAMPLE_SHEETS = ['Organoid', 'Cell line', SPECIMEN_SHEET]
+REPORT_ENTITIES = ['Analysis file', 'Sequence file', 'Image file']
+PROJECT_SHEETS = ['Project', 'Project - Publications', 'Project - Contributors']
+# ID field of each sheet that links refer to
+ID_FIELDS = {link.target: link.target_field for link in links_all}
+LINK_FIELDS = link_fields()
+TIER1_FIELDS = tier1_fields([GROUP_FIELD])
+
+
+def id_list(ids) -> list:
+    """A single ID or a list of them as a list, None for no IDs"""
+    if ids is None:
+        return None
+    return [ids] if isinstance(ids, str) else list(ids)
+
+
+def clean_sheet(sheet: pd.DataFrame, sheet_name: str, vague: bool) -> pd.DataFrame:
+    """
+    Parsed sheet cleaned like remove_empty_tabs_and_fields and rename_vague_friendly_names clean the workbook,
+    None if it has no data rows
+    """
+    if len(sheet) <= FIRST_DATA_LINE:
+        return None
+    empty = sheet[FIRST_DATA_LINE:].isna().all()
+    sheet = sheet[[col for col in sheet.columns if not empty[col] and 'Unnamed' not in str(col)]]
+    if vague:
+        sheet.columns = [rename_vague_field(field, sheet_name, sheet[field].iloc[2]) for field in sheet.columns]
+    return sheet
+
+
+def keep_tier1_fields(sheet: pd.DataFrame, sheet_name: str) -> pd.DataFrame:
+    """Sheet without the fields that are neither link fields nor used by the tier 1 conversion, like remove_unused_fields"""
+    if sheet is None or sheet_name.startswith('Project'):
+        return sheet
+    return sheet[[field for field in sheet.columns if field in LINK_FIELDS.get(sheet_name, set()) or
+                  field == 'LOCATION' or sheet[field].iloc[2] in TIER1_FIELDS]]
+
+
+class Tier1Project:
+
+    def __init__(self, spreadsheet_path: str, use_cache: bool = True):
+        self.spreadsheet_path = spreadsheet_path
+        self.use_cache = use_cache
+        self.workbook = None
+        self.vague = False
+        # cleaned sheets, None for missing or empty ones
+        self.sheets = {}
+        # fields of the flat file of the whole project
+        self.columns = None
+        # edited (not yet renamed) rows of every converted group, by group field value, and the converted specimens
+        self.groups = {}
+        self.converted = set()
+        # values of the vocabulary columns without a tier 1 mapping, over all queries
+        self.unmapped = {}
+
+    @classmethod
+    def open(cls, spreadsheet_path: str, use_cache: bool = True) -> 'Tier1Project':
+        """Project of the spreadsheet, nothing is read before the first query"""
+        return cls(spreadsheet_path, use_cache)
+
+    def open_workbook(self):
+        if self.workbook is not None:
+            return self.workbook
+        cached = sheet_cache.load(sheet_cache.cache_key(self.spreadsheet_path)) if self.use_cache else None
+        if cached is not None:
+            self.workbook, self.vague = cached, False
+            return self.workbook
+        self.workbook = pd.ExcelFile(self.spreadsheet_path, engine_kwargs={'read_only': True})
+        # vague names are decided from the headers of all sheets, without parsing them
+        headers = {sheet: [field for field in next(self.workbook.book[sheet].iter_rows(max_row=1, values_only=True), ())
+                           if field is not None]
+                   for sheet in self.workbook.sheet_names}
+        self.vague = uses_vague_names(headers)
+        if self.vague:
+            print('Spreadsheet uses vague fiendly names. Will try to edit accordingly')
+        return self.workbook
+
+    def close(self):
+        """Close the workbook file. Parsed sheets and converted rows are kept, other sheets open it again"""
+        if isinstance(self.workbook, pd.ExcelFile):
+            self.workbook.close()
+        self.workbook = None
+
+    def sheet(self, sheet_name: str) -> pd.DataFrame:
+        """Cleaned sheet, with its field description lines, None if the spreadsheet has no such sheet or it is empty"""
+        if sheet_name not in self.sheets:
+            workbook = self.open_workbook()
+            sheet = None
+            if sheet_name in workbook.sheet_names:
+                sheet = workbook.parse(sheet_name)
+                if not isinstance(workbook, sheet_cache.CachedSpreadsheet):
+                    sheet = clean_sheet(sheet, sheet_name, self.vague)
+            self.sheets[sheet_name] = keep_tier1_fields(sheet, sheet_name)
+        return self.sheets[sheet_name]
+
+    def data(self, sheet_name: str) -> pd.DataFrame:
+        sheet = self.sheet(sheet_name)
+        return None if sheet is None else remove_field_desc_lines(sheet)
+
+    def sheet_fields(self, sheet_name: str):
+        sheet = self.sheet(sheet_name)
+        return None if sheet is None else sheet.columns
+
+    def parsed_sheets(self) -> sheet_cache.CachedSpreadsheet:
+        """The sheets parsed so far, in place of the workbook for the flatten functions"""
+        return sheet_cache.CachedSpreadsheet({name: sheet for name, sheet in self.sheets.items() if sheet is not None})
+
+    def ids(self, sheet_name: str, mask=None) -> list:
+        """IDs of the rows of a sheet, of the rows in mask if given"""
+        data = self.data(sheet_name)
+        if data is None or ID_FIELDS[sheet_name] not in data:
+            return []
+        values = data[ID_FIELDS[sheet_name]] if mask is None else data[ID_FIELDS[sheet_name]][mask]
+        return list(dict.fromkeys(MultiValue.parse(values, sep=SEP).notna().values))
+
+    def referring_rows(self, sheet_name: str, ids) -> dict:
+        """Data rows of every sheet that refer to ids of sheet_name, directly or through other entities, as masks"""
+        selected = {sheet_name: set(ids)}
+        masks = {}
+        changed = True
+        while changed:
+            changed = False
+            for link in links_all:
+                if link.target not in selected:
+                    continue
+                source = self.data(link.source)
+                if source is None or link.source_field not in source:
+                    continue
+                mask = MultiValue.parse(source[link.source_field], sep=SEP).isin(selected[link.target]).to_numpy()
+                if link.source in masks:
+                    mask = mask | masks[link.source]
+                    if (mask == masks[link.source]).all():
+                        continue
+                masks[link.source] = mask
+                changed = True
+                if link.source in ID_FIELDS:
+                    selected[link.source] = set(self.ids(link.source, mask))
+        return masks
+
+    def input_specimens(self, sheet_name: str, ids) -> set:
+        """Specimens that the ids of a sample sheet are derived from"""
+        if sheet_name == SPECIMEN_SHEET:
+            return set(ids) & set(self.ids(SPECIMEN_SHEET))
+        data = self.data(sheet_name)
+        if data is None or ID_FIELDS[sheet_name] not in data:
+            return set()
+        rows = data[MultiValue.parse(data[ID_FIELDS[sheet_name]], sep=SEP).isin(ids).to_numpy()]
+        specimens = set()
+        for link in links_all:
+            if link.source == sheet_name and link.target in SAMPLE_SHEETS and link.source_field in rows:
+                inputs = MultiValue.parse(rows[link.source_field], sep=SEP).notna().values
+                specimens |= self.input_specimens(link.target, list(dict.fromkeys(inputs)))
+        return specimens
+
+    def specimens(self, donor_id=None, sample_id=None) -> list:
+        """Specimens of the donors and samples, all of them if neither is given"""
+        donor_ids, sample_ids = id_list(donor_id), id_list(sample_id)
+        if donor_ids is None and sample_ids is None:
+            return sorted(self.ids(SPECIMEN_SHEET))
+        specimens = set()
+        if donor_ids is not None:
+            donor_specimens = self.referring_rows(DONOR_SHEET, donor_ids).get(SPECIMEN_SHEET)
+            specimens |= set(self.ids(SPECIMEN_SHEET, donor_specimens)) if donor_specimens is not None else set()
+        for sheet_name in SAMPLE_SHEETS if sample_ids is not None else []:
+            specimens |= self.input_specimens(sheet_name, sample_ids)
+        return sorted(specimens)
+
+    def flat_columns(self) -> list:
+        """
+        Fields of the flat file of the whole project, the fields of every sheet joined to a file entity,
+        so that rows converted in any query see the same fields, missing or not
+        """
+        if self.columns is None:
+            columns = []
+            for report_entity in REPORT_ENTITIES:
+                if self.sheet(report_entity) is None:
+                    continue
+                _, links = design_paths(report_entity, self.sheet_fields)
+                for sheet_name in dict.fromkeys([report_entity] + [link.target for link in links]):
+                    columns.extend(prefix_columns(self.sheet(sheet_name), prefix=sheet_name).columns)
+            for project_sheet in PROJECT_SHEETS:
+                self.sheet(project_sheet)
+            flattened = add_project_metadata(pd.DataFrame(columns=list(dict.fromkeys(columns))), self.parsed_sheets())
+            self.columns = list(use_ingest_names(flattened, self.parsed_sheets()).columns)
+        return self.columns
+
+    def flat_rows(self, specimens: list) -> pd.DataFrame:
+        """Grouped flat rows of the specimens, as dcp_to_tier1.py reads them back from the grouped flat file"""
+        masks = self.referring_rows(SPECIMEN_SHEET, specimens)
+        flattened_list = []
+        for report_entity in REPORT_ENTITIES:
+            if report_entity not in masks or not masks[report_entity].any():
+                continue
+            _, links = design_paths(report_entity, self.sheet_fields)
+            report_sheet = remove_field_desc_lines(prefix_columns(self.sheet(report_entity), prefix=report_entity))
+            flattened_list.append(flatten_spreadsheet_rows(report_sheet[masks[report_entity]], links, self.parsed_sheets()))
+        if not flattened_list:
+            return pd.DataFrame(columns=[GROUP_FIELD])
+        columns = self.flat_columns()
+        flattened = pd.concat(flattened_list, axis=0, ignore_index=True)
+        flattened = add_project_metadata(flattened, self.parsed_sheets())
+        flattened = use_ingest_names(flattened, self.parsed_sheets())
+        grouped = join_unique(flattened, GROUP_FIELD).dropna(axis=1, how='all')
+        # an analysis file of several specimens brings rows of specimens that were not requested, partly.
+        # Rows joined to several specimens are grouped by all of them, and all their rows refer to each of them
+        grouped = grouped[MultiValue.parse(grouped.index.to_series(), sep=SEP).isin(specimens).to_numpy()]
+        grouped = grouped.reindex(columns=[column for column in dict.fromkeys([*grouped.columns, *columns])
+                                           if column != GROUP_FIELD])
+        flat_csv = StringIO()
+        grouped.to_csv(flat_csv, index=True)
+        flat_csv.seek(0)
+        return pd.read_csv(flat_csv, dtype=str)
+
+    def convert(self, specimens: list):
+        """Edit the rows of the specimens not converted yet"""
+        missing = [specimen for specimen in specimens if specimen not in self.converted]
+        if not missing:
+            return
+        flat_rows = self.flat_rows(missing)
+        if len(flat_rows):
+            edited = edit_rows(flat_rows, self.unmapped, report=False)
+            self.groups.update(dict(tuple(edited.groupby(GROUP_FIELD, sort=False))))
+        self.converted.update(missing)
+
+    def rows(self, donor_id=None, sample_id=None) -> pd.DataFrame:
+        """Tier 1 rows, with all tier 1 fields, of the donors and samples"""
+        specimens = self.specimens(donor_id, sample_id)
+        self.convert(specimens)
+        # in the order of the grouped flat file
+        groups = sorted(group for group in self.groups if set(group.split(SEP)) & set(specimens))
+        if not groups:
+            return pd.DataFrame(columns=['donor_id', 'sample_id'])
+        rows = rename_cols(pd.concat([self.groups[group] for group in groups], ignore_index=True), map_dict=DCP_TIER1_MAP)
+        for field, ids in [('donor_id', id_list(donor_id)), ('sample_id', id_list(sample_id))]:
+            if ids is not None:
+                rows = rows[MultiValue.parse(rows[field], sep=SEP).isin(ids).to_numpy()].reset_index(drop=True)
+        return rows
+
+    def donors(self) -> list:
+        return self.ids(DONOR_SHEET)
+
+    def samples(self, donor_id=None) -> list:
+        """Tier 1 sample IDs, of the donors if given"""
+        return list(dict.fromkeys(self.obs(donor_id=donor_id)['sample_id'].dropna()))
+
+    def obs(self, donor_id=None, sample_id=None) -> pd.DataFrame:
+        """Distinct tier 1 obs rows of the donors and samples, of the whole project if neither is given"""
+        return select_cols(self.rows(donor_id, sample_id), cols=TIER1['obs']).reset_index(drop=True)
+
+    def tab(self, tab: str, donor_id=None, sample_id=None, template: str = 'golden') -> pd.DataFrame:
+        """Distinct rows of a tab of a tier 1 spreadsheet template, of the donors and samples"""
+        if tab not in TEMPLATES[template]:
+            raise ValueError(f'{template} template does not contain {tab} tab. Possible tabs {list(TEMPLATES[template])}')
+        return select_cols(self.rows(donor_id, sample_id), cols=TEMPLATES[template][tab]).reset_index(drop=True)
@@ -0,0 +1,179 @@
+"""
+Validation of the tier 1 obs table before it is written (`--validate`).
+Required columns must be present and filled, ontology term IDs must match the pattern of their
+ontology and controlled vocabulary columns must hold terms of their vocabulary. Multi-valued cells
+are checked value by value. Each column is reduced to its distinct values first, so the checks cost
+the size of the vocabulary rather than the number of rows. Donor, sample and library keys must each
+identify one donor, one sample and one sample row. Library, sequencing run and protocol fields may
+differ between rows of a sample, as in the denormalised view with one row per file and protocol.
+Violations are reported once, with their number of rows, and abort the run with validate='abort'.
+"""
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from src.dcp_to_tier1_mapping import COLLECTION_DICT, GOLDEN_SPREADSHEET
+from src.multi_value import SEP, MultiValue
+
+VALIDATE = ['off', 'warn', 'abort']
+MAX_EXAMPLES = 5
+
+REQUIRED = [
+    'sample_id',
+    'donor_id',
+    'library_id',
+    'organism_ontology_term_id',
+    'sex_ontology_term_id',
+    'tissue_ontology_term_id',
+    'assay_ontology_term_id',
+    'suspension_type',
+    'disease_ontology_term_id',
+    'development_stage_ontology_term_id',
+]
+ONTOLOGY_PATTERNS = {
+    'organism_ontology_term_id': r'NCBITaxon:\d+',
+    'sex_ontology_term_id': r'PATO:\d{7}|unknown',
+    'tissue_ontology_term_id': r'(UBERON|CL):\d{7}',
+    'assay_ontology_term_id': r'EFO:\d{7}',
+    'cell_type_ontology_term_id': r'CL:\d{7}|unknown',
+    'disease_ontology_term_id': r'MONDO:\d{7}|PATO:0000461',
+    'self_reported_ethnicity_ontology_term_id': r'HANCESTRO:\d{4}|multiethnic|unknown|na',
+    'development_stage_ontology_term_id': r'(HsapDv|MmusDv|UBERON):\d{7}|unknown',
+}
+VOCABULARIES = {
+    'sample_collection_method': set(COLLECTION_DICT.values()),
+    'suspension_type': {'cell', 'nucleus', 'na'},
+    'sequenced_fragment': {'3 prime tag', '5 prime tag', 'full length', 'probe-based'},
+    'sample_source': {'surgical donor', 'postmortem donor', 'organ donor'},
+    'tissue_type': {'tissue', 'organoid', 'cell culture'},
+    'sampled_site_condition': {'healthy', 'diseased', 'adjacent'},
+    'manner_of_death': {'0', '1', '2', '3', '4', 'unknown', 'not applicable'},
+}
+# fields of the libraries, sequencing runs and protocols of a sample, one value per library, run or protocol
+PER_ROW_FIELDS = ['library_id', 'library_id_repository', 'library_preparation_batch', 'library_sequencing_run',
+                  'suspension_type', 'cell_enrichment', 'cell_number_loaded', 'cell_viability_percentage',
+                  'institute', 'sample_collection_method']
+# a key is ambiguous when its value has more than one distinct row of its entity fields
+KEYS = {
+    'donor_id': [field for field in GOLDEN_SPREADSHEET['Tier 1 Donor Metadata'] if field != 'dataset_id'],
+    'sample_id': [field for field in GOLDEN_SPREADSHEET['Tier 1 Sample Metadata']
+                  if field not in PER_ROW_FIELDS + ['dataset_id']],
+    'library_id': ['library_id', 'sample_id'],
+}
+
+
+@dataclass
+class Violation:
+    column: str
+    check: str
+    rows: int
+    values: list = field(default_factory=list)
+
+    def __str__(self):
+        more = f' and {len(self.values) - MAX_EXAMPLES} more' if len(self.values) > MAX_EXAMPLES else ''
+        values = ': ' + ', '.join(map(repr, self.values[:MAX_EXAMPLES])) + more if self.values else ''
+        return f'{self.column} {self.check} in {self.rows} rows{values}'
+
+
+def invalid_values(series: pd.Series, check: str, valid) -> list:
+    """
+    Violation of the rows of series with a value for which valid, taking and returning an Index, is False.
+    Only the distinct cells are checked, the values of multi-valued cells one by one
+    """
+    counts = series.value_counts(dropna=True, sort=False)
+    values = MultiValue.parse(pd.Series(counts.index.astype(str), dtype=object), sep=SEP)
+    invalid_parts = ~np.asarray(valid(pd.Index(values.values, dtype=object)), dtype=bool)
+    invalid_cells = np.bincount(values.rows[invalid_parts], minlength=len(counts)) > 0
+    if not invalid_cells.any():
+        return []
+    return [Violation(column=series.name, check=check, rows=int(counts.to_numpy()[invalid_cells].sum()),
+                      values=list(dict.fromkeys(values.values[invalid_parts])))]
+
+
+def check_required(obs: pd.DataFrame) -> list:
+    violations = []
+    for column in REQUIRED:
+        if column not in obs:
+            violations.append(Violation(column=column, check='column missing', rows=len(obs)))
+        elif obs[column].isna().any():
+            violations.append(Violation(column=column, check='values missing', rows=int(obs[column].isna().sum())))
+    return violations
+
+
+def check_ontology_ids(obs: pd.DataFrame) -> list:
+    return [violation for column, pattern in ONTOLOGY_PATTERNS.items() if column in obs
+            for violation in invalid_values(obs[column], f'not matching {pattern}',
+                                            lambda values: values.str.fullmatch(pattern))]
+
+
+def check_vocabularies(obs: pd.DataFrame) -> list:
+    return [violation for column, vocabulary in VOCABULARIES.items() if column in obs
+            for violation in invalid_values(obs[column], 'not in vocabulary',
+                                            lambda values: values.isin(vocabulary))]
+
+
+def merge_exploded_samples(obs: pd.DataFrame) -> pd.DataFrame:
+    """
+    Rows differing only in sample_id merged back into one row with the joined sample IDs. They come from
+    one row of a multi-valued organoid or cell line group, exploded by sample, and share its libraries
+    """
+    if 'sample_id' not in obs or obs.shape[1] == 1:
+        return obs
+    source_rows = pd.util.hash_pandas_object(obs.drop(columns='sample_id'), index=False).to_numpy()
+    first = ~pd.Series(source_rows).duplicated().to_numpy()
+    if first.all():
+        return obs
+    sample_ids = obs['sample_id'].groupby(source_rows, sort=False).agg(lambda ids: SEP.join(ids.dropna().astype(str)))
+    merged = obs.loc[first].copy()
+    merged['sample_id'] = sample_ids.loc[source_rows[first]].to_numpy()
+    return merged
+
+
+def check_keys(obs: pd.DataFrame) -> list:
+    violations = []
+    for key, fields in KEYS.items():
+        if key not in obs:
+            continue
+        rows = merge_exploded_samples(obs) if key == 'library_id' else obs
+        entities = rows[[field for field in fields if field in rows]].drop_duplicates()
+        keys = entities[key].dropna().astype(str)
+        if keys.str.contains(SEP, regex=False).any():
+            # one row per value of the multi-valued keys, with the other entity fields of its row
+            values = MultiValue.parse(keys, sep=SEP)
+            # only values repeated in several rows can be ambiguous
+            repeated = pd.Series(values.values, dtype=object).duplicated(keep=False).to_numpy()
+            other = entities.loc[keys.index].drop(columns=key)
+            keys = pd.DataFrame({key: values.values[repeated],
+                                 **{column: other[column].to_numpy()[values.rows[repeated]] for column in other}}
+                                ).drop_duplicates()[key]
+        duplicated = keys[keys.duplicated()].unique()
+        if len(duplicated):
+            violations.append(Violation(column=key, check='not unique', rows=int(keys.isin(duplicated).sum()),
+                                        values=list(duplicated)))
+    return violations
+
+
+def validate_obs(obs: pd.DataFrame) -> list:
+    """All violations of the tier 1 obs table"""
+    return check_required(obs) + check_ontology_ids(obs) + check_vocabularies(obs) + check_keys(obs)
+
+
+def print_violations(violations: list):
+    if not violations:
+        print('Tier 1 validation passed')
+        return
+    print(f'Tier 1 validation found {len(violations)} problems:')
+    for violation in violations:
+        print(f'  {violation}')
+
+
+def validate_tier1(obs: pd.DataFrame, validate: str = 'warn') -> list:
+    """Validate obs, print the report and, with validate='abort', raise on any violation"""
+    if validate == 'off':
+        return []
+    violations = validate_obs(obs)
+    print_violations(violations)
+    if violations and validate == 'abort':
+        raise ValueError('invalid tier 1 metadata: ' + '; '.join(map(str, violations)))
+    return violations
@@ -0,0 +1,62 @@
+"""
+Value-level mapping of controlled vocabulary columns.
+DCP columns hold a few distinct terms repeated over every row, so a column is factorized once,
+the mapping is applied to its distinct values only and the column is rebuilt from the codes.
+Mapping cost depends on the size of the vocabulary, not on the number of rows.
+Values a dictionary mapping does not cover are kept as they are and, if an `unmapped` dict is
+given, counted per column so that they can be reported once at the end of the conversion.
+"""
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+
+def factorize(series: pd.Series) -> tuple:
+    """
+    Codes and distinct values of series. Missing values share the last code and keep their
+    original object, since the mapping functions test for np.nan by identity
+    """
+    values = series.to_numpy(dtype=object)
+    codes, uniques = pd.factorize(values)
+    missing = codes == -1
+    if missing.any():
+        uniques = np.append(uniques.astype(object), None)
+        uniques[-1] = values[missing.argmax()]
+        codes[missing] = len(uniques) - 1
+    return codes, uniques
+
+
+def map_distinct(series: pd.Series, function) -> pd.Series:
+    """Apply function, taking and returning a Series, to the distinct values of series only"""
+    codes, uniques = factorize(series)
+    mapped = function(pd.Series(uniques, dtype=object)).to_numpy(dtype=object)
+    return pd.Series(mapped[codes], index=series.index, name=series.name, dtype=object)
+
+
+def map_values(series: pd.Series, mapping, unmapped: dict = None) -> pd.Series:
+    """
+    Map the values of series with a dict, like Series.replace, or a function of one value.
+    Missing values are passed to a function mapping, a dict mapping keeps them.
+    """
+    if callable(mapping):
+        return map_distinct(series, lambda uniques: pd.Series([mapping(value) for value in uniques], dtype=object))
+    codes, uniques = factorize(series)
+    mapped = np.array([mapping.get(value, value) for value in uniques], dtype=object)
+    if unmapped is not None:
+        missing = [idx for idx, value in enumerate(uniques) if value not in mapping and pd.notna(value)]
+        if missing:
+            counts = np.bincount(codes, minlength=len(uniques))
+            column = unmapped.setdefault(series.name, Counter())
+            for idx in missing:
+                column[uniques[idx]] += int(counts[idx])
+    return pd.Series(mapped[codes], index=series.index, name=series.name, dtype=object)
+
+
+def print_unmapped(unmapped: dict):
+    """One summary of the values left as they are, with the number of rows of each"""
+    if not any(unmapped.values()):
+        return
+    print('Values without a tier 1 mapping, kept as they are:')
+    for column, values in unmapped.items():
+        print(f'  {column}: ' + ', '.join(f'{value!r} ({rows} rows)' for value, rows in values.most_common()))
@@ -0,0 +1,112 @@
+"""
+Deterministic zip archives of the tier 1 files.
+Members are sorted by name and get a fixed timestamp and permissions, so the same files always
+give a byte-identical archive, that can be cached and compared instead of uploaded again.
+Members are compressed from memory in a thread pool (zlib and bz2 release the GIL) and then
+written as raw zip entries.
+xlsx files are zip archives themselves, with the save time in their entries and document
+properties, so they are normalised the same way before being archived.
+"""
+import bz2
+import os
+import re
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from io import BytesIO
+from zipfile import ZIP_BZIP2, ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+
+CODECS = {'stored': ZIP_STORED, 'deflated': ZIP_DEFLATED, 'bzip2': ZIP_BZIP2}
+# 1980-01-01 00:00:00, the earliest zip date, in MS-DOS format
+FIXED_DOS_TIME, FIXED_DOS_DATE = 0, 1 << 5 | 1
+# regular file, rw-r--r--
+EXTERNAL_ATTR = (0o100644 << 16)
+UNIX_SYSTEM = 3
+MAX_ZIP32 = 0xFFFFFFFF
+
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+CENTRAL_HEADER = struct.Struct('<4s4B4HL2L5H2L')
+END_RECORD = struct.Struct('<4s4H2LH')
+XLSX_DATES = re.compile(rb'(<dcterms:(?:created|modified)[^>]*>)[^<]*(</dcterms:)')
+FIXED_XLSX_DATE = rb'1980-01-01T00:00:00Z'
+
+
+def extract_version(method: int) -> int:
+    return 46 if method == ZIP_BZIP2 else 20
+
+
+def compress(data: bytes, codec: str = 'stored', level: int = None) -> bytes:
+    if codec == 'stored':
+        return data
+    if codec == 'deflated':
+        # raw deflate stream, without the zlib header and checksum
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if level is None else level, zlib.DEFLATED, -15)
+        return compressor.compress(data) + compressor.flush()
+    if codec == 'bzip2':
+        return bz2.compress(data, 9 if level is None else level)
+    raise ValueError(f'Unsupported zip codec {codec}. Possible codecs {list(CODECS)}')
+
+
+def write_zip(members: dict, output_file, codec: str = 'stored', level: int = None, workers: int = None):
+    """Write members (archive name: bytes) to output_file (a path or binary file), compressing them in parallel"""
+    names = sorted(members)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        compressed = list(executor.map(lambda name: compress(members[name], codec, level), names))
+    method = CODECS[codec]
+    central_dir = []
+    offset = 0
+    with open(output_file, 'wb') if isinstance(output_file, str) else nullcontext(output_file) as zip_file:
+        for name, data in zip(names, compressed):
+            file_size, compress_size = len(members[name]), len(data)
+            if max(file_size, compress_size, offset) > MAX_ZIP32:
+                raise ValueError(f'{name} does not fit in a zip archive without zip64 extensions')
+            encoded_name, flags = (name.encode('ascii'), 0) if name.isascii() else (name.encode('utf-8'), 0x800)
+            crc = zlib.crc32(members[name])
+            zip_file.write(LOCAL_HEADER.pack(b'PK\x03\x04', extract_version(method), 0, flags, method,
+                                             FIXED_DOS_TIME, FIXED_DOS_DATE, crc, compress_size, file_size,
+                                             len(encoded_name), 0))
+            zip_file.write(encoded_name)
+            zip_file.write(data)
+            central_dir.append(CENTRAL_HEADER.pack(b'PK\x01\x02', 20, UNIX_SYSTEM, extract_version(method), 0,
+                                                   flags, method, FIXED_DOS_TIME, FIXED_DOS_DATE, crc,
+                                                   compress_size, file_size, len(encoded_name), 0, 0, 0, 0,
+                                                   EXTERNAL_ATTR, offset) + encoded_name)
+            offset += LOCAL_HEADER.size + len(encoded_name) + compress_size
+        central_dir = b''.join(central_dir)
+        zip_file.write(central_dir)
+        zip_file.write(END_RECORD.pack(b'PK\x05\x06', 0, 0, len(names), len(names), len(central_dir), offset, 0))
+
+
+def normalise_xlsx(data: bytes) -> bytes:
+    """Rewrite an xlsx file with fixed entry timestamps and creation/modification dates"""
+    with ZipFile(BytesIO(data)) as xlsx:
+        members = {info.filename: xlsx.read(info) for info in xlsx.infolist()}
+    if 'docProps/core.xml' in members:
+        members['docProps/core.xml'] = XLSX_DATES.sub(rb'\g<1>' + FIXED_XLSX_DATE + rb'\g<2>', members['docProps/core.xml'])
+    normalised = BytesIO()
+    write_zip(members, normalised, codec='deflated', workers=1)
+    return normalised.getvalue()
+
+
+def write_zip_if_changed(members: dict, output_filename: str, codec: str = 'stored', level: int = None,
+                         workers: int = None) -> bool:
+    """Write the archive, leaving an identical existing archive untouched. Returns whether it changed"""
+    tmp_filename = f'{output_filename}.tmp-{os.getpid()}'
+    write_zip(members, tmp_filename, codec, level, workers)
+    if os.path.exists(output_filename) and files_equal(tmp_filename, output_filename):
+        os.remove(tmp_filename)
+        return False
+    os.replace(tmp_filename, output_filename)
+    return True
+
+
+def files_equal(path_a: str, path_b: str) -> bool:
+    if os.path.getsize(path_a) != os.path.getsize(path_b):
+        return False
+    with open(path_a, 'rb') as file_a, open(path_b, 'rb') as file_b:
+        for chunk in iter(lambda: file_a.read(1024 * 1024), b''):
+            if chunk != file_b.read(len(chunk)):
+                return False
+    return True
@@ -0,0 +1,116 @@
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+import pandas as pd
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from benchmarks.ols_standin import OlsStandIn
+from benchmarks.ols_throughput import clear_ols_caches
+from src.convert_flat_dcp_to_tier1 import (TEMPLATES, DistinctRows, disease_choices, main, template_list,
+                                           tier1_tables)
+from src.flatten_dcp import main as flatten_dcp
+from src.multi_value import MultiValue
+from src.table_io import read_table
+from test_tier1_project import project_spreadsheet
+
+DONORS = pd.DataFrame({
+    'donor_id': ['donor_1', 'donor_1', 'donor_2', 'donor_1', 'donor_2', 'donor_3'],
+    'sex_ontology_term': ['female', 'female', np.nan, 'female', None, 'male'],
+    'sample_collection_year': [2020, 2020, pd.NA, 2020, pd.NA, 2021]
+})
+
+
+class TestChunkedConversion(unittest.TestCase):
+
+    def test_distinct_rows_over_chunks(self):
+        distinct = DistinctRows()
+        for start in range(0, len(DONORS), 4):
+            distinct.add(DONORS.iloc[start:start + 4])
+        pd.testing.assert_frame_equal(DONORS.drop_duplicates(), distinct.frame())
+
+    def test_nan_string_distinct(self):
+        donors = pd.DataFrame({'donor_id': ['donor_1', 'donor_1'], 'sex_ontology_term': ['nan', np.nan]})
+        distinct = DistinctRows()
+        distinct.add(donors.iloc[:1])
+        distinct.add(donors.iloc[1:])
+        pd.testing.assert_frame_equal(donors, distinct.frame())
+
+    def test_disease_choices(self):
+        labels = pd.Series(['normal', 'type 2 diabetes mellitus||obesity', np.nan, 'type 2 diabetes mellitus||obesity'])
+        self.assertEqual([['type 2 diabetes mellitus', 'obesity']], disease_choices(MultiValue.parse(labels)).values.tolist())
+
+
+class TestChunkedMain(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.TemporaryDirectory()
+        spreadsheet_path = os.path.join(cls.work_dir.name, 'project.xlsx')
+        project_spreadsheet(spreadsheet_path)
+        cls.server = OlsStandIn(('127.0.0.1', 0), missing='synthetic')
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        os.environ['OLS_BASE_URL'] = cls.server.base_url
+        clear_ols_caches()
+        # the specimen view and the denormalised one, in every flat format
+        cls.flat_paths = [path for table_format in ['csv', 'parquet', 'feather']
+                          for path in flatten_dcp(spreadsheet_path, cls.work_dir.name,
+                                                  ['specimen_from_organism.biomaterial_core.biomaterial_id', ''],
+                                                  table_format, use_sheet_cache=False,
+                                                  tmp_dir=cls.work_dir.name).values()]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        os.environ.pop('OLS_BASE_URL')
+        clear_ols_caches()
+        cls.work_dir.cleanup()
+
+    def convert(self, flat_path, chunk_rows=None):
+        output_dir = tempfile.mkdtemp(dir=self.work_dir.name)
+        table_format = os.path.splitext(flat_path)[1][1:]
+        main(flat_path, output_dir, table_format, chunk_rows=chunk_rows)
+        name = os.path.splitext(os.path.basename(flat_path))[0]
+        obs = read_table(os.path.join(output_dir, f'{name}_tier1.{table_format}'))
+        tabs = pd.read_excel(os.path.join(output_dir, f'{name}_tier1.xlsx'), sheet_name=None)
+        return obs, tabs
+
+    def test_chunks_match_whole_file(self):
+        self.assertEqual(6, len(self.flat_paths))
+        for flat_path in self.flat_paths:
+            obs, tabs = self.convert(flat_path)
+            for chunk_rows in [1, 2, 3]:
+                with self.subTest(flat_path=os.path.basename(flat_path), chunk_rows=chunk_rows):
+                    chunked_obs, chunked_tabs = self.convert(flat_path, chunk_rows)
+                    pd.testing.assert_frame_equal(obs, chunked_obs)
+                    self.assertEqual(list(tabs), list(chunked_tabs))
+                    for tab in tabs:
+                        pd.testing.assert_frame_equal(tabs[tab], chunked_tabs[tab])
+
+
+class TestTemplates(unittest.TestCase):
+
+    def test_shared_tabs_selected_once(self):
+        edited = pd.DataFrame({'donor_organism.biomaterial_core.biomaterial_id': ['donor_1', 'donor_1', 'donor_2'],
+                               'donor_organism.sex': ['female', 'female', 'male']})
+        tables = tier1_tables(edited, ['golden', 'immune'])
+        donor_fields = tuple(TEMPLATES['immune']['donor'])
+        self.assertEqual(donor_fields, tuple(TEMPLATES['golden']['Tier 1 Donor Metadata']))
+        self.assertEqual(len({tuple(fields) for template in TEMPLATES.values() for fields in template.values()}) + 1, len(tables))
+        self.assertEqual(['donor_1', 'donor_2'], tables[donor_fields]['donor_id'].tolist())
+
+    def test_template_list(self):
+        self.assertEqual(['golden', 'immune'], template_list('golden, immune,golden'))
+        with self.assertRaises(argparse.ArgumentTypeError):
+            template_list('golden,hca')
+
+
+if __name__ == "__main__":
+    unittest.main()
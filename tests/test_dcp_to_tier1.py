@@ -0,0 +1,47 @@
+import os
+import sys
+import tempfile
+import unittest
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from dcp_to_tier1 import convert_batch, profile_name
+from src.spreadsheet_paths import expand_spreadsheet_paths
+
+
+class TestSpreadsheetPaths(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        for filename in ['a.xlsx', 'b.xlsx', 'c.csv']:
+            open(os.path.join(self.tmp_dir.name, filename), 'w').close()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_glob_and_manifest(self):
+        manifest_path = os.path.join(self.tmp_dir.name, 'manifest.txt')
+        with open(manifest_path, 'w') as manifest:
+            manifest.write('# spreadsheets\nb.xlsx\n\nmissing.xlsx\n')
+        paths = expand_spreadsheet_paths([os.path.join(self.tmp_dir.name, '*.xlsx')], manifest_path)
+        expected = [os.path.join(self.tmp_dir.name, filename) for filename in ['a.xlsx', 'b.xlsx', 'missing.xlsx']]
+        self.assertEqual(expected, paths)
+
+    def test_profile_names(self):
+        names = {profile_name(os.path.join(directory, 'a.xlsx')) for directory in ['batch_1', 'batch_2']}
+        self.assertEqual(2, len(names))
+        self.assertTrue(all(name.startswith('a-') for name in names))
+        self.assertEqual(profile_name('batch_1/a.xlsx'), profile_name(os.path.abspath('batch_1/a.xlsx')))
+
+    def test_failed_spreadsheet_does_not_stop_batch(self):
+        spreadsheet_paths = [os.path.join(self.tmp_dir.name, filename) for filename in ['missing.xlsx', 'c.csv']]
+        statuses = convert_batch(spreadsheet_paths, os.path.join(self.tmp_dir.name, 'flat'),
+                                 os.path.join(self.tmp_dir.name, 'tier1'), group_field='', denormalised=True,
+                                 use_sheet_cache=False)
+        self.assertEqual(spreadsheet_paths, list(statuses))
+        self.assertTrue(all(statuses.values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+import os
+import sys
+import unittest
+from importlib.util import find_spec
+
+import pandas as pd
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.flatten_dcp import derive_exprimental_design, flatten_spreadsheet
+from src.multi_value import join_unique
+from test_flatten_dcp import SAMPLE_VALUES, dcp_spreadsheet, organoid_design
+
+
+@unittest.skipUnless(find_spec('duckdb'), 'duckdb is not installed')
+class TestDuckdbEngine(unittest.TestCase):
+
+    def assert_same_flattened(self, sample_values):
+        from src import duckdb_engine
+        spreadsheet_obj = dcp_spreadsheet(sample_values)
+        _, links = derive_exprimental_design('Sequence file', spreadsheet_obj)
+        pandas_flat = flatten_spreadsheet(spreadsheet_obj, 'Sequence file', links).reset_index(drop=True)
+        duckdb_flat = duckdb_engine.flatten_spreadsheet(spreadsheet_obj, 'Sequence file', links)
+        pd.testing.assert_frame_equal(pandas_flat.astype(str), duckdb_flat.astype(str))
+        return pandas_flat
+
+    def test_simple_design(self):
+        self.assert_same_flattened(SAMPLE_VALUES)
+
+    def test_complex_design(self):
+        self.assert_same_flattened(organoid_design(SAMPLE_VALUES))
+
+    def test_join_unique(self):
+        from src import duckdb_engine
+        flattened = self.assert_same_flattened(organoid_design(SAMPLE_VALUES))
+        group_field = 'Specimen from organism_SPECIMEN FROM ORGANISM ID (Required)'
+        pd.testing.assert_frame_equal(join_unique(flattened, group_field), duckdb_engine.join_unique(flattened, group_field))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,7 @@
 import os
+import shutil
 import sys
+import tempfile
 import unittest
 from io import BytesIO
 
@@ -12,7 +14,11 @@ sys.path.insert(0, project_root)
 from src.flatten_dcp import remove_empty_tabs_and_fields
 from src.flatten_dcp import rename_vague_friendly_names
 from src.flatten_dcp import derive_exprimental_design
+from src.flatten_dcp import remove_unused_fields, tier1_fields
+from src.flatten_dcp import write_views
+from src.flatten_dcp import flatten_spreadsheet
 from src.flatten_dcp import FIRST_DATA_LINE, links_all
+from src.flatten_dcp import Link, merge_multiple_input_entities
 
 SAMPLE_VALUES = {
     'Donor organism': {
@@ -103,7 +109,8 @@ def organoid_design(sample_values: dict):
                                                            'specimen_3', 'specimen_3']
         }
     }
-    organoid_dict.update(sample_values)
+    organoid_dict.update({sheet: {field: list(values) for field, values in columns.items()}
+                          for sheet, columns in sample_values.items()})
     organoid_dict['Cell suspension']['INPUT SPECIMEN FROM ORGANISM ID (Required)'][-2:] = ['', '']
     organoid_dict['Cell suspension']['INPUT ORGANOID ID (Required)'] = organoid_dict['Organoid']['ORGANOID ID (Required)'][:FIRST_DATA_LINE]
     organoid_dict['Cell suspension']['INPUT ORGANOID ID (Required)'].extend(['', '', '', '', '', 'organoid_1', 'organoid_2'])
@@ -164,6 +171,25 @@ class TestMetadataSpreadsheetEditing(unittest.TestCase):
         self.assertDictEqual(SAMPLE_VALUES['Donor organism'], donor_dict)
         self.assertEqual(len(SAMPLE_VALUES['Donor organism']), len(donor_dict))
 
+    # remove_unused_fields
+    def test_remove_unused_fields(self):
+        spreadsheet_obj = dcp_spreadsheet(SAMPLE_VALUES)
+        spreadsheet_obj = remove_unused_fields(spreadsheet_obj, tier1_fields())
+        specimen_df = spreadsheet_obj.parse('Specimen from organism')
+        self.assertListEqual(['SPECIMEN FROM ORGANISM ID (Required)', 'ORGAN (Required)',
+                              'COLLECTION PROTOCOL ID (Required)', 'INPUT DONOR ORGANISM ID (Required)'],
+                             specimen_df.columns.tolist())
+        protocol_df = spreadsheet_obj.parse('Collection protocol')
+        self.assertListEqual(['COLLECTION PROTOCOL ID (Required)'], protocol_df.columns.tolist())
+
+    def test_keep_tier1_fields(self):
+        spreadsheet_obj = dcp_spreadsheet(SAMPLE_VALUES)
+        spreadsheet_obj = remove_unused_fields(spreadsheet_obj, tier1_fields())
+        donor_df = spreadsheet_obj.parse('Donor organism').fillna('')
+        donor_dict = {col: value.tolist() for col, value in donor_df.items()}
+        self.assertListEqual(['DONOR ORGANISM ID (Required)', 'BIOLOGICAL SEX (Required)'], list(donor_dict))
+        self.assertListEqual(SAMPLE_VALUES['Donor organism']['BIOLOGICAL SEX (Required)'], donor_dict['BIOLOGICAL SEX (Required)'])
+
     # rename_vague_friendly_names
     # TODO Add test to catch inconsistent analysis file input colnames (NO input in links)
     def test_rename_capitalised_id(self):
@@ -202,6 +228,13 @@ class TestMetadataSpreadsheetEditing(unittest.TestCase):
         renamed_spreadsheet = rename_vague_friendly_names(spreadsheet_obj, first_data_line=FIRST_DATA_LINE)
         self.assertFalse(renamed_spreadsheet.book['Cell suspension']['B1'].value in SAMPLE_VALUES['Cell suspension'])
 
+    def test_rename_without_program_name(self):
+        spreadsheet_obj = dcp_spreadsheet(SAMPLE_VALUES)
+        spreadsheet_obj.book['Donor organism']['A1'] = 'biomaterial id'
+        spreadsheet_obj.book['Donor organism'].cell(row=FIRST_DATA_LINE, column=1).value = None
+        renamed_spreadsheet = rename_vague_friendly_names(spreadsheet_obj, first_data_line=FIRST_DATA_LINE)
+        self.assertEqual('BIOMATERIAL ID', renamed_spreadsheet.book['Donor organism']['A1'].value)
+
 class TestExperimentalDesign(unittest.TestCase):
 
     # TODO Add complexity (dissociate cell lines & specimens, multiple files, multiple input to files)
@@ -238,5 +271,78 @@ class TestExperimentalDesign(unittest.TestCase):
         self.assertEqual(expected_links, applied_links)
 
 
+class TestJoinWorksheet(unittest.TestCase):
+
+    def test_unreferenced_rows_ignored(self):
+        # a specimen and a donor no cell suspension refers to, with a multi-valued donor ID
+        sample_values = {sheet: {field: list(values) for field, values in columns.items()}
+                         for sheet, columns in SAMPLE_VALUES.items()}
+        specimens = sample_values['Specimen from organism']
+        for field, value in zip(specimens, ['specimen_4', 'heart', 'fresh', 'collection_protocol', 'donor_2||donor_3']):
+            specimens[field].append(value)
+        donors = sample_values['Donor organism']
+        for field, value in zip(donors, ['donor_3', 'female', 'human adult stage']):
+            donors[field].append(value)
+        flattened = {}
+        for name, values in [('all', sample_values), ('referenced', SAMPLE_VALUES)]:
+            spreadsheet_obj = dcp_spreadsheet(values)
+            _, links = derive_exprimental_design('Sequence file', spreadsheet_obj)
+            flattened[name] = flatten_spreadsheet(spreadsheet_obj, 'Sequence file', links)
+        pd.testing.assert_frame_equal(flattened['referenced'], flattened['all'])
+        self.assertNotIn('donor_3', flattened['all']['Donor organism_DONOR ORGANISM ID (Required)'].tolist())
+
+
+    def test_merge_conflicts_joined_per_row(self):
+        # conflicting values are joined within their row, other rows keep their own value
+        worksheet = pd.DataFrame({'specimen': ['specimen_1', 'specimen_2', 'specimen_3'],
+                                  'organ': ['heart', 'lung', None]})
+        target = pd.DataFrame({'specimen': ['specimen_1', 'specimen_2', 'specimen_3'],
+                               'organ': ['heart', 'kidney', 'liver']})
+        result = merge_multiple_input_entities(worksheet, target, 'specimen', 'specimen', Link('a', 'b', 'specimen'))
+        self.assertEqual(['heart', 'lung||kidney', 'liver'], result['organ'].tolist())
+
+
+class TestWriteViews(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.flattened = pd.DataFrame({
+            'donor_organism.biomaterial_core.biomaterial_id': ['d1', 'd1', 'd2'],
+            'donor_organism.sex': ['female', 'female', 'male'],
+            'specimen_from_organism.biomaterial_core.biomaterial_id': ['s1', 's2', 's3'],
+            'sequence_file.file_core.file_name': ['f1', 'f2', 'f3']
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_write_multiple_views(self):
+        paths = write_views(self.flattened, 'test.xlsx', self.output_dir,
+                            ['specimen_from_organism.biomaterial_core.biomaterial_id',
+                             'donor_organism.biomaterial_core.biomaterial_id', ''])
+        self.assertEqual({
+            'specimen_from_organism.biomaterial_core.biomaterial_id': f'{self.output_dir}/test.csv',
+            'donor_organism.biomaterial_core.biomaterial_id': f'{self.output_dir}/test_donor_organism.csv',
+            '': f'{self.output_dir}/test_denormalised.csv'
+        }, paths)
+        donor_view = pd.read_csv(paths['donor_organism.biomaterial_core.biomaterial_id'])
+        self.assertEqual(['s1||s2', 's3'], donor_view['specimen_from_organism.biomaterial_core.biomaterial_id'].tolist())
+        self.assertEqual(3, len(pd.read_csv(paths[''])))
+
+    def test_views_of_one_entity(self):
+        paths = write_views(self.flattened, 'test.xlsx', self.output_dir,
+                            ['specimen_from_organism.biomaterial_core.biomaterial_id',
+                             'donor_organism.biomaterial_core.biomaterial_id', 'donor_organism.sex'])
+        self.assertEqual(f'{self.output_dir}/test_donor_organism_sex.csv', paths['donor_organism.sex'])
+        self.assertEqual(3, len(set(paths.values())))
+        self.assertEqual(['d1', 'd2'], pd.read_csv(paths['donor_organism.biomaterial_core.biomaterial_id'])[
+            'donor_organism.biomaterial_core.biomaterial_id'].tolist())
+
+    def test_missing_group_field_denormalised(self):
+        paths = write_views(self.flattened, 'test.xlsx', self.output_dir, ['cell_line.biomaterial_core.biomaterial_id', ''])
+        self.assertEqual({f'{self.output_dir}/test_denormalised.csv'}, set(paths.values()))
+        self.assertEqual(['test_denormalised.csv'], os.listdir(self.output_dir))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,54 @@
+import os
+import sys
+import tempfile
+import unittest
+from importlib.util import find_spec
+
+import numpy as np
+import pandas as pd
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.convert_flat_dcp_to_tier1 import get_uns
+from src.h5ad_export import obs_frame, write_h5ad
+
+OBS = pd.DataFrame({
+    'sample_id': ['specimen_1', 'specimen_2', 'specimen_3'],
+    'sex_ontology_term': ['female', np.nan, 'female'],
+    'sample_collection_year': [2020, pd.NA, 2020]
+}, index=[4, 4, 7])
+FLAT = pd.DataFrame({
+    'project.project_core.project_title': ['A title', 'A title'],
+    'project.contributors.name': ['Bob,,Jones||Ann,,Lee', 'Bob,,Jones||Ann,,Lee'],
+    'project.publications.doi': [np.nan, np.nan]
+})
+
+
+class TestH5adExport(unittest.TestCase):
+
+    def test_obs_frame(self):
+        obs = obs_frame(OBS)
+        self.assertListEqual(['0', '1', '2'], obs.index.tolist())
+        self.assertTrue(all(isinstance(dtype, pd.CategoricalDtype) for dtype in obs.dtypes))
+        self.assertListEqual(['2020'], obs['sample_collection_year'].cat.categories.tolist())
+        self.assertTrue(pd.isna(obs.loc['1', 'sex_ontology_term']))
+
+    def test_get_uns(self):
+        self.assertDictEqual({'title': ['A title'], 'study_pi': ['Bob,,Jones', 'Ann,,Lee'], 'consortia': ['HCA']},
+                             get_uns(FLAT))
+
+    @unittest.skipUnless(find_spec('anndata'), 'anndata is not installed')
+    def test_write_h5ad(self):
+        import anndata
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'flat_tier1.h5ad')
+            write_h5ad(OBS, get_uns(FLAT), path)
+            adata = anndata.read_h5ad(path)
+        self.assertEqual((3, 0), adata.shape)
+        self.assertListEqual(['specimen_1', 'specimen_2', 'specimen_3'], adata.obs['sample_id'].tolist())
+        self.assertListEqual(['Bob,,Jones', 'Ann,,Lee'], adata.uns['study_pi'].tolist())
+
+
+if __name__ == "__main__":
+    unittest.main()
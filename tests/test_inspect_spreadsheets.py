@@ -0,0 +1,44 @@
+import os
+import sys
+import tempfile
+import unittest
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from inspect_spreadsheets import inspect_spreadsheets
+from src.flatten_dcp import derive_exprimental_design
+from test_flatten_dcp import SAMPLE_VALUES, dcp_spreadsheet, organoid_design
+
+
+class TestInspectSpreadsheets(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_same_design_as_flatten(self):
+        spreadsheet_obj = dcp_spreadsheet(organoid_design(SAMPLE_VALUES))
+        spreadsheet_path = os.path.join(self.tmp_dir.name, 'organoid.xlsx')
+        spreadsheet_obj.book.save(spreadsheet_path)
+        inspection, = inspect_spreadsheets([spreadsheet_path])
+        sheets = {sheet['name']: sheet for sheet in inspection['sheets']}
+        self.assertEqual(2, sheets['Organoid']['rows'])
+        self.assertEqual('organoid.biomaterial_core.biomaterial_id', sheets['Organoid']['programmatic_names'][0])
+        self.assertFalse(inspection['vague_names'])
+        paths, links = derive_exprimental_design('Sequence file', spreadsheet_obj)
+        entity = inspection['report_entities']['Sequence file']
+        self.assertEqual(6, entity['rows'])
+        self.assertEqual(paths, entity['paths'])
+        self.assertEqual([(link.source, link.target) for link in links],
+                         [(link['source'], link['target']) for link in entity['links']])
+
+    def test_error_reported(self):
+        missing_path = os.path.join(self.tmp_dir.name, 'missing.xlsx')
+        self.assertIn('error', inspect_spreadsheets([missing_path])[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
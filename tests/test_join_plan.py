@@ -0,0 +1,43 @@
+import os
+import sys
+import unittest
+
+import pandas as pd
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.flatten_dcp import derive_exprimental_design, flatten_spreadsheet
+from src.join_plan import JoinLimits, chunk_count, limit_violations, plan_entity
+from test_flatten_dcp import SAMPLE_VALUES, dcp_spreadsheet, organoid_design
+
+
+class TestJoinPlan(unittest.TestCase):
+
+    def plan_and_flatten(self, sample_values):
+        spreadsheet_obj = dcp_spreadsheet(sample_values)
+        _, links = derive_exprimental_design('Sequence file', spreadsheet_obj)
+        return spreadsheet_obj, links, plan_entity(spreadsheet_obj, 'Sequence file', links)
+
+    def test_exact_rows_and_columns(self):
+        for sample_values in [SAMPLE_VALUES, organoid_design(SAMPLE_VALUES)]:
+            spreadsheet_obj, links, plan = self.plan_and_flatten(sample_values)
+            flattened = flatten_spreadsheet(spreadsheet_obj, 'Sequence file', links)
+            self.assertEqual(len(flattened), plan.output_rows)
+            self.assertEqual(len(flattened.columns), plan.links[-1].output_columns)
+
+    def test_limits(self):
+        _, _, plan = self.plan_and_flatten(organoid_design(SAMPLE_VALUES))
+        self.assertEqual([], limit_violations(plan, JoinLimits(max_rows=plan.output_rows)))
+        limits = JoinLimits(max_rows=plan.output_rows - 1, on_limit='chunk')
+        self.assertTrue(limit_violations(plan, limits))
+        self.assertEqual(2, chunk_count(plan, limits))
+
+    def test_chunked_flatten(self):
+        spreadsheet_obj, links, _ = self.plan_and_flatten(organoid_design(SAMPLE_VALUES))
+        pd.testing.assert_frame_equal(flatten_spreadsheet(spreadsheet_obj, 'Sequence file', links),
+                                      flatten_spreadsheet(spreadsheet_obj, 'Sequence file', links, chunks=2))
+
+
+if __name__ == "__main__":
+    unittest.main()
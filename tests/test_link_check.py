@@ -0,0 +1,50 @@
+import copy
+import os
+import sys
+import unittest
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.link_check import check_links, preflight_links
+from test_flatten_dcp import SAMPLE_VALUES, dcp_spreadsheet
+
+
+def report_of(reports, source, target):
+    return next(report for report in reports if (report.link.source, report.link.target) == (source, target))
+
+
+class TestLinkCheck(unittest.TestCase):
+
+    def test_consistent_links(self):
+        reports = check_links(dcp_spreadsheet(SAMPLE_VALUES))
+        self.assertEqual(6, len(reports))
+        self.assertEqual([], [error for report in reports for error in report.errors])
+        self.assertEqual(3, report_of(reports, 'Specimen from organism', 'Collection protocol').references)
+
+    def test_broken_links(self):
+        sample_values = copy.deepcopy(SAMPLE_VALUES)
+        specimens = sample_values['Specimen from organism']
+        specimens['INPUT DONOR ORGANISM ID (Required)'][-1] = 'donor_2||donor_3'
+        donors = sample_values['Donor organism']
+        donors['DONOR ORGANISM ID (Required)'][-1] = 'donor_1'
+        reports = check_links(dcp_spreadsheet(sample_values))
+        donor_report = report_of(reports, 'Specimen from organism', 'Donor organism')
+        self.assertEqual(['donor_2', 'donor_3'], donor_report.orphans)
+        self.assertEqual(['donor_1'], donor_report.duplicates)
+        self.assertEqual([], donor_report.unused)
+        self.assertEqual(2, len(donor_report.errors))
+        with self.assertRaises(RuntimeError):
+            preflight_links(dcp_spreadsheet(sample_values), check='abort')
+
+    def test_unused_entities(self):
+        sample_values = copy.deepcopy(SAMPLE_VALUES)
+        for field, value in zip(sample_values['Donor organism'], ['donor_3', 'male', 'human adult stage']):
+            sample_values['Donor organism'][field].append(value)
+        donor_report = report_of(check_links(dcp_spreadsheet(sample_values)), 'Specimen from organism', 'Donor organism')
+        self.assertEqual(['donor_3'], donor_report.unused)
+        self.assertEqual([], donor_report.errors)
+
+
+if __name__ == "__main__":
+    unittest.main()
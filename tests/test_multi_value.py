@@ -0,0 +1,54 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.multi_value import MultiValue, join_columns, join_unique
+
+DISEASES = pd.Series(['normal', 'type 2 diabetes mellitus||obesity||obesity', np.nan, 'Not Applicable'], index=[3, 3, 4, 5])
+
+
+class TestMultiValue(unittest.TestCase):
+
+    def test_first_and_rest(self):
+        diseases = MultiValue.parse(DISEASES)
+        self.assertListEqual(['normal', 'type 2 diabetes mellitus', np.nan, 'Not Applicable'], diseases.first().tolist())
+        self.assertListEqual([np.nan, 'obesity||obesity', np.nan, np.nan], diseases.rest().tolist())
+
+    def test_unique_drop_join(self):
+        diseases = MultiValue.parse(DISEASES).unique().drop('Not Applicable')
+        self.assertListEqual(['normal', 'type 2 diabetes mellitus||obesity', np.nan, np.nan], diseases.join().tolist())
+
+    def test_contains(self):
+        self.assertListEqual([False, True, False, False], MultiValue.parse(DISEASES).contains('obesity').tolist())
+
+    def test_isin(self):
+        self.assertListEqual([True, True, True, False], MultiValue.parse(DISEASES).isin(['obesity', 'normal', np.nan]).tolist())
+
+    def test_explode_keeps_missing_rows(self):
+        df = pd.DataFrame({'disease': DISEASES, 'donor': ['donor_1', 'donor_2', 'donor_3', 'donor_4']})
+        exploded = MultiValue.parse(df['disease']).explode(df, 'disease')
+        self.assertListEqual([3, 3, 3, 3, 4, 5], exploded.index.tolist())
+        self.assertListEqual(['donor_1', 'donor_2', 'donor_2', 'donor_2', 'donor_3', 'donor_4'], exploded['donor'].tolist())
+
+    def test_join_columns(self):
+        df = pd.DataFrame({'a': ['x', 'y'], 'b': ['z', 1]})
+        self.assertListEqual(['x||z', 'y||1'], join_columns(df).tolist())
+
+    def test_join_unique(self):
+        df = pd.DataFrame({'specimen': ['specimen_2', 'specimen_1', 'specimen_1', np.nan],
+                           'library': ['lib_2', 'lib_1', 'lib_1', 'lib_3'],
+                           'donor': [np.nan, 'donor_1', 'donor_2', 'donor_3']})
+        grouped = join_unique(df, 'specimen')
+        self.assertListEqual(['specimen_1', 'specimen_2'], grouped.index.tolist())
+        self.assertListEqual(['lib_1', 'lib_2'], grouped['library'].tolist())
+        self.assertListEqual(['donor_1||donor_2', ''], grouped['donor'].tolist())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from benchmarks.ols_standin import OlsStandIn, fixture_key
+from benchmarks.ols_throughput import clear_ols_caches
+from src.convert_flat_dcp_to_tier1 import get_ols_id, get_ols_label
+
+FIXTURES = {
+    'search': {'pato/female': {'response': {'numFound': 1, 'docs': [{'obo_id': 'PATO:0000383', 'label': 'female'}]}}},
+    'terms': {'hsapdv/HsapDv_0000087': {'label': 'human adult stage', 'obo_id': 'HsapDv:0000087'}}
+}
+
+
+class TestFixtureKey(unittest.TestCase):
+
+    def test_fixture_key(self):
+        self.assertEqual(('search', 'pato/male'), fixture_key('/ols4/api/search?q=male&ontology=pato'))
+        self.assertEqual(('terms', 'efo/EFO_0009922'), fixture_key(
+            '/ols4/api/ontologies/efo/terms/http%253A%252F%252Fwww.ebi.ac.uk%252Fefo%252FEFO_0009922'))
+        self.assertEqual((None, None), fixture_key('/ols4/api/ontologies'))
+
+
+class TestOlsStandIn(unittest.TestCase):
+
+    def start(self, **settings):
+        self.server = OlsStandIn(('127.0.0.1', 0), FIXTURES, seed=1, **settings)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        os.environ['OLS_BASE_URL'] = self.server.base_url
+        clear_ols_caches()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.environ.pop('OLS_BASE_URL')
+        clear_ols_caches()
+
+    def test_recorded_responses(self):
+        self.start()
+        self.assertEqual('PATO:0000383', get_ols_id('female', 'pato'))
+        self.assertEqual('human adult stage', get_ols_label('HsapDv:0000087'))
+        # OLS finds nothing
+        self.assertEqual('male', get_ols_id('male', 'pato'))
+        self.assertEqual({'served': 2, 'missing': 1}, dict(self.server.counts))
+
+    def test_latency_and_failures(self):
+        self.start(latency=0.05, failure_rate=0.5)
+        start = time.perf_counter()
+        self.assertEqual('PATO:0000383', get_ols_id('female', 'pato'))
+        self.assertEqual('human adult stage', get_ols_label('HsapDv:0000087'))
+        self.assertGreaterEqual(time.perf_counter() - start, 0.1)
+        # failed requests are retried
+        self.assertEqual(2, self.server.counts['served'])
+        self.assertGreater(self.server.counts['failed'], 0)
+
+    def test_synthetic_responses(self):
+        self.start(missing='synthetic')
+        self.assertRegex(get_ols_id('male', 'pato'), r'^PATO:\d{7}$')
+        self.assertEqual('label of UBERON_0002190', get_ols_label('UBERON:0002190'))
+
+    def test_failures_not_cached(self):
+        self.start(failure_rate=1.0)
+        self.assertEqual('HsapDv:0000087', get_ols_label('HsapDv:0000087'))
+        # OLS finds nothing
+        self.server.failure_rate = 0.0
+        self.assertEqual('male', get_ols_id('male', 'pato'))
+        # after the outage, the terms are looked up again
+        self.server.missing = 'synthetic'
+        self.assertEqual('human adult stage', get_ols_label('HsapDv:0000087'))
+        self.assertRegex(get_ols_id('male', 'pato'), r'^PATO:\d{7}$')
+        term = get_ols_label('HsapDv:0000087', only_label=False)
+        term['label'] = 'changed'
+        self.assertEqual('human adult stage', get_ols_label('HsapDv:0000087', only_label=False)['label'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.ontology_closure import ClosureIndex, build_index, parse_obo
+from src.convert_flat_dcp_to_tier1 import organ_roll_ups, prenatal_week_stages
+from src.multi_value import MultiValue
+
+# a made up stage ontology, shaped like HsapDv
+OBO = """format-version: 1.2
+ontology: test
+
+[Term]
+id: DV:0000001
+name: life cycle
+
+[Term]
+id: DV:0000002
+name: prenatal stage
+relationship: part_of DV:0000001 ! life cycle
+
+[Term]
+id: DV:0000003
+name: embryonic stage
+is_a: DV:0000002 ! prenatal stage
+
+[Term]
+id: DV:0000004
+name: fetal stage
+relationship: part_of DV:0000002 ! prenatal stage
+
+[Term]
+id: DV:0000005
+name: 8th week post-fertilization stage
+relationship: part_of DV:0000003 ! embryonic stage
+
+[Term]
+id: DV:0000006
+name: 9th week post-fertilization stage
+relationship: part_of DV:0000004 ! fetal stage
+
+[Term]
+id: DV:0000007
+name: 10th week post-fertilization stage
+relationship: part_of DV:0000004 ! fetal stage
+
+[Term]
+id: DV:0000008
+name: adult stage
+relationship: part_of DV:0000001 ! life cycle
+relationship: preceded_by DV:0000004 ! fetal stage
+
+[Term]
+id: DV:0000009
+name: obsolete stage
+is_obsolete: true
+
+[Typedef]
+id: part_of
+name: part of
+"""
+
+# a made up tissue ontology, shaped like UBERON
+TISSUE_OBO = """format-version: 1.2
+ontology: test
+
+[Term]
+id: UB:0000001
+name: heart
+
+[Term]
+id: UB:0000002
+name: heart left ventricle
+relationship: part_of UB:0000001 ! heart
+
+[Term]
+id: UB:0000003
+name: heart right ventricle
+relationship: part_of UB:0000001 ! heart
+
+[Term]
+id: UB:0000004
+name: lung
+"""
+
+
+def closure_index(obo_text: str = OBO) -> ClosureIndex:
+    with tempfile.TemporaryDirectory() as obo_dir:
+        obo_path = os.path.join(obo_dir, 'test.obo')
+        with open(obo_path, 'w') as obo:
+            obo.write(obo_text)
+        return build_index(parse_obo(obo_path))
+
+
+def stage_index() -> ClosureIndex:
+    return closure_index(OBO)
+
+
+class TestClosureIndex(unittest.TestCase):
+
+    def test_ancestors(self):
+        index = stage_index()
+        self.assertEqual(8, len(index.ids))
+        self.assertEqual(['DV:0000001', 'DV:0000002', 'DV:0000004', 'DV:0000006'], sorted(index.ancestors('DV:0000006')))
+        # preceded_by is not closed over
+        self.assertEqual(['DV:0000001', 'DV:0000008'], sorted(index.ancestors('DV:0000008')))
+        terms = ['DV:0000005', 'DV:0000007', 'DV:0000008', 'DV:9999999', np.nan]
+        np.testing.assert_array_equal([True, True, False, False, False], index.is_a(terms, 'DV:0000002'))
+        np.testing.assert_array_equal([False, True, False, False, False],
+                                      index.descends_from(terms, ['DV:0000004', 'DV:9999999']))
+
+    def test_roll_up(self):
+        index = stage_index()
+        rolled = index.roll_up(['DV:0000005', 'DV:0000006', 'DV:0000008', 'DV:0000002', 'DV:9999999'],
+                               ['DV:0000001', 'DV:0000002', 'DV:0000004'])
+        self.assertEqual(['DV:0000002', 'DV:0000004', 'DV:0000001', 'DV:0000002', None], list(rolled))
+
+    def test_snapshot(self):
+        index = stage_index()
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            snapshot_path = os.path.join(snapshot_dir, 'stages.npz')
+            index.save(snapshot_path)
+            loaded = ClosureIndex.load(snapshot_path)
+        self.assertEqual(list(index.ids), list(loaded.ids))
+        self.assertEqual('fetal stage', loaded.label('DV:0000004'))
+        np.testing.assert_array_equal(index.is_a(index.ids, 'DV:0000004'), loaded.is_a(loaded.ids, 'DV:0000004'))
+
+    def test_prenatal_week_stages(self):
+        dcp_df = pd.DataFrame({
+            'donor_organism.organism_age': ['9', '63', '8.5', '9', '40', np.nan],
+            'donor_organism.organism_age_unit.ontology_label': ['week', 'day', 'week', 'week', 'year', 'week'],
+            'donor_organism.development_stage.ontology': ['DV:0000004', 'DV:0000003', 'DV:0000002', 'DV:0000008',
+                                                          'DV:0000008', 'DV:0000004']
+        })
+        week_stages = prenatal_week_stages(dcp_df, stage_index())
+        self.assertEqual(['DV:0000006', 'DV:0000006', 'DV:0000006', None, None, None],
+                         [None if pd.isna(stage) else stage for stage in week_stages])
+
+    def test_organ_roll_ups(self):
+        # several parts of the organ, a single part, parts of another organ, and a specimen without parts
+        organ_parts = pd.Series(['UB:0000002||UB:0000003', 'UB:0000002', 'UB:0000002||UB:0000004', np.nan], index=[4, 5, 6, 7])
+        organs = pd.Series(['UB:0000001', 'UB:0000001', 'UB:0000001', 'UB:0000004'], index=[4, 5, 6, 7])
+        rolled = organ_roll_ups(MultiValue.parse(organ_parts), organs, closure_index(TISSUE_OBO))
+        self.assertEqual(['UB:0000001', None, None, None], [None if pd.isna(organ) else organ for organ in rolled])
+        self.assertEqual([4, 5, 6, 7], rolled.index.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
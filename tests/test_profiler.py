@@ -0,0 +1,38 @@
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.profiler import SamplingProfiler, summarise, write_speedscope
+
+
+def busy_loop(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class TestSamplingProfiler(unittest.TestCase):
+
+    def test_speedscope_and_summary(self):
+        with tempfile.TemporaryDirectory() as profile_dir:
+            with SamplingProfiler(interval=0.001) as profiler:
+                busy_loop(0.2)
+            speedscope_path = write_speedscope(profiler, 'test', profile_dir)
+            with open(speedscope_path) as speedscope_file:
+                speedscope = json.load(speedscope_file)
+            self.assertIn('busy_loop', [frame['name'] for frame in speedscope['shared']['frames']])
+            self.assertAlmostEqual(0.2, speedscope['profiles'][0]['endValue'], delta=0.05)
+            self.assertTrue(os.path.exists(os.path.join(profile_dir, 'test.folded')))
+            summary = summarise([speedscope_path])
+            self.assertIn('Profiled 1 spreadsheets', summary)
+            self.assertIn('busy_loop (tests/test_profiler.py', summary)
+
+
+if __name__ == "__main__":
+    unittest.main()
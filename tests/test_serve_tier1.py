@@ -0,0 +1,114 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from io import StringIO
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pandas as pd
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from benchmarks.ols_standin import OlsStandIn
+from serve_tier1 import ConversionService, parse_options, response_body, GROUP_FIELD
+from test_tier1_project import project_spreadsheet
+
+OUTPUTS = {
+    'test_tier1.csv': b'sample_id\nspecimen_1\n',
+    'test_tier1.xlsx': b'',
+}
+
+
+class TestConversionOptions(unittest.TestCase):
+
+    def test_default_options(self):
+        options = parse_options('filename=dir/test.xlsx')
+        self.assertEqual('test.xlsx', options['filename'])
+        self.assertEqual([GROUP_FIELD], options['group_field'])
+        self.assertFalse(options['denormalised'])
+        self.assertEqual('zip', options['output'])
+
+    def test_invalid_options(self):
+        for query in ['filename=test.csv', 'engine=spark', 'output=h5ad']:
+            with self.assertRaises(ValueError):
+                parse_options(query)
+
+    def test_csv_response(self):
+        self.assertEqual((OUTPUTS['test_tier1.csv'], 'test_tier1.csv'), response_body(OUTPUTS, 'csv'))
+
+
+class TestConversionService(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ConversionService(('127.0.0.1', 0), workers=1, queue_size=0)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_health(self):
+        with urlopen(f'{self.url}/health') as response:
+            self.assertEqual({'workers': 1, 'in_flight': 0, 'capacity': 1}, json.load(response))
+
+    def test_full_queue(self):
+        # all slots taken by running conversions
+        self.server.slots.acquire()
+        with self.assertRaises(HTTPError) as context:
+            urlopen(Request(f'{self.url}/convert?filename=test.xlsx', data=b'xlsx'))
+        self.assertEqual(503, context.exception.code)
+        self.assertEqual('30', context.exception.headers['Retry-After'])
+        self.server.slots.release()
+
+    def test_bad_request(self):
+        with self.assertRaises(HTTPError) as context:
+            urlopen(Request(f'{self.url}/convert?filename=test.csv', data=b'csv'))
+        self.assertEqual(400, context.exception.code)
+
+
+class TestConvertUpload(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.spreadsheet_path = os.path.join(self.work_dir.name, 'project.xlsx')
+        project_spreadsheet(self.spreadsheet_path)
+        self.ols = OlsStandIn(('127.0.0.1', 0), missing='synthetic')
+        threading.Thread(target=self.ols.serve_forever, daemon=True).start()
+        os.environ['OLS_BASE_URL'] = self.ols.base_url
+        # the service runs outside the repository, its workers start in this directory
+        self.server_dir = os.path.join(self.work_dir.name, 'server')
+        os.mkdir(self.server_dir)
+        self.cwd = os.getcwd()
+        os.chdir(self.server_dir)
+        self.server = ConversionService(('127.0.0.1', 0), workers=1, queue_size=0)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.chdir(self.cwd)
+        self.ols.shutdown()
+        self.ols.server_close()
+        os.environ.pop('OLS_BASE_URL')
+        self.work_dir.cleanup()
+
+    def test_convert(self):
+        with open(self.spreadsheet_path, 'rb') as spreadsheet:
+            request = Request(f'{self.url}/convert?filename=project.xlsx&output=csv', data=spreadsheet.read())
+        with urlopen(request, timeout=300) as response:
+            self.assertEqual('attachment; filename="project_tier1.csv"', response.headers['Content-Disposition'])
+            obs = pd.read_csv(StringIO(response.read().decode()), dtype=str)
+        self.assertEqual(['specimen_1', 'specimen_2', 'specimen_3'], sorted(obs['sample_id']))
+        # nothing is left in the working directory, neither the upload nor cached sheets
+        self.assertEqual([], os.listdir(self.server_dir))
+
+
+if __name__ == "__main__":
+    unittest.main()
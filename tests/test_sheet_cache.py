@@ -0,0 +1,62 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from datetime import datetime
+
+import pandas as pd
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src import sheet_cache
+from test_flatten_dcp import SAMPLE_VALUES, dcp_spreadsheet
+
+
+class TestSheetCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.spreadsheet_obj = dcp_spreadsheet(SAMPLE_VALUES)
+        donor_sheet = self.spreadsheet_obj.book['Donor organism']
+        donor_sheet['D1'] = 'AGE'
+        donor_sheet['D4'] = 'donor_organism.organism_age'
+        donor_sheet['D6'] = 45
+        donor_sheet['D7'] = '30-35'
+        donor_sheet['E1'] = 'COLLECTION TIME'
+        donor_sheet['E6'] = datetime(2019, 5, 1)
+        donor_sheet['E7'] = 2.5
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def test_round_trip(self):
+        sheet_cache.store('key', self.spreadsheet_obj, cache_dir=self.cache_dir.name)
+        cached_obj = sheet_cache.load('key', cache_dir=self.cache_dir.name)
+        self.assertListEqual(self.spreadsheet_obj.sheet_names, cached_obj.sheet_names)
+        for sheet in self.spreadsheet_obj.sheet_names:
+            pd.testing.assert_frame_equal(self.spreadsheet_obj.parse(sheet), cached_obj.parse(sheet))
+        cached_values = cached_obj.parse('Donor organism')
+        self.assertEqual([45, '30-35'], cached_values['AGE'][4:].tolist())
+        self.assertEqual([datetime(2019, 5, 1), 2.5], cached_values['COLLECTION TIME'][4:].tolist())
+
+    def test_missing_entry(self):
+        self.assertIsNone(sheet_cache.load('key', cache_dir=self.cache_dir.name))
+
+    def test_evict_by_age_and_size(self):
+        for key in ['old', 'recent', 'latest']:
+            sheet_cache.store(key, self.spreadsheet_obj, cache_dir=self.cache_dir.name)
+        old_time = time.time() - 60 * 24 * 3600
+        os.utime(os.path.join(self.cache_dir.name, 'old', 'manifest.json'), (old_time, old_time))
+        recent_time = time.time() - 60
+        os.utime(os.path.join(self.cache_dir.name, 'recent', 'manifest.json'), (recent_time, recent_time))
+        sheet_cache.evict(cache_dir=self.cache_dir.name, max_age_days=30)
+        self.assertListEqual(['latest', 'recent'], sorted(os.listdir(self.cache_dir.name)))
+        latest_size = sheet_cache.entry_size(os.path.join(self.cache_dir.name, 'latest'))
+        sheet_cache.evict(cache_dir=self.cache_dir.name, max_bytes=latest_size)
+        self.assertListEqual(['latest'], os.listdir(self.cache_dir.name))
+
+
+if __name__ == "__main__":
+    unittest.main()
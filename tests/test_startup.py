@@ -0,0 +1,20 @@
+import os
+import sys
+import unittest
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from benchmarks.startup_time import ENTRY_POINTS, import_time
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_lazy_imports(self):
+        for module in ENTRY_POINTS:
+            _, loaded = import_time(module)
+            self.assertEqual([], loaded, f'{module} imports {loaded} at startup')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.table_io import read_table, read_table_chunks, write_table, table_path
+
+FLAT_VALUES = {
+    'specimen_from_organism.biomaterial_core.biomaterial_id': ['specimen_1', 'specimen_1', 'specimen_2'],
+    'cell_suspension.estimated_cell_count': [1000, 2000, np.nan],
+    'donor_organism.diseases.ontology_label': ['normal', 'normal||obesity', ''],
+    'donor_organism.death.hardy_scale': [np.nan, 2.0, 3.0]
+}
+
+
+class TestTableFormats(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.flat_df = pd.DataFrame(FLAT_VALUES)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_read(self, table_format, df, index=False):
+        path = table_path(os.path.join(self.tmp_dir.name, 'flat.csv'), table_format)
+        write_table(df, path, index=index)
+        return read_table(path)
+
+    def test_table_path(self):
+        self.assertEqual('dir/flat_denormalised.parquet', table_path('dir/flat_denormalised.csv', 'parquet'))
+        with self.assertRaises(ValueError):
+            table_path('dir/flat.csv', 'json')
+
+    def test_binary_formats_match_csv(self):
+        csv_df = self.write_read('csv', self.flat_df)
+        for table_format in ['parquet', 'feather']:
+            with self.subTest(table_format=table_format):
+                pd.testing.assert_frame_equal(csv_df, self.write_read(table_format, self.flat_df))
+
+    def test_grouped_index_is_kept(self):
+        grouped_df = self.flat_df.set_index('specimen_from_organism.biomaterial_core.biomaterial_id')
+        csv_df = self.write_read('csv', grouped_df, index=True)
+        for table_format in ['parquet', 'feather']:
+            with self.subTest(table_format=table_format):
+                pd.testing.assert_frame_equal(csv_df, self.write_read(table_format, grouped_df, index=True))
+
+    def test_missing_values_are_nan(self):
+        feather_df = self.write_read('feather', self.flat_df)
+        self.assertIs(feather_df['cell_suspension.estimated_cell_count'][2], np.nan)
+        self.assertIs(feather_df['donor_organism.diseases.ontology_label'][2], np.nan)
+
+    def test_chunks_match_table(self):
+        columns = ['donor_organism.diseases.ontology_label', 'cell_suspension.estimated_cell_count', 'donor_organism.sex']
+        for table_format in ['csv', 'parquet', 'feather']:
+            with self.subTest(table_format=table_format):
+                path = table_path(os.path.join(self.tmp_dir.name, 'flat.csv'), table_format)
+                write_table(self.flat_df, path)
+                chunks = list(read_table_chunks(path, chunk_rows=2))
+                self.assertEqual([2, 1], [len(chunk) for chunk in chunks])
+                pd.testing.assert_frame_equal(read_table(path), pd.concat(chunks).reset_index(drop=True))
+                selected = next(read_table_chunks(path, chunk_rows=2, columns=columns))
+                self.assertEqual(['cell_suspension.estimated_cell_count', 'donor_organism.diseases.ontology_label'],
+                                 selected.columns.tolist())
+
+
+if __name__ == "__main__":
+    unittest.main()
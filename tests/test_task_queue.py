@@ -0,0 +1,96 @@
+import os
+import sys
+import tempfile
+import unittest
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.task_queue import TaskQueue, run_worker, task_name
+
+
+class TestTaskQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.queues = [TaskQueue(self.work_dir.name, worker_id=f'node-{idx}', lease=60, max_attempts=2)
+                       for idx in range(2)]
+        for queue in self.queues:
+            # every worker seeds the same tasks, each is added once
+            for spreadsheet in ['a.xlsx', 'b b.xlsx']:
+                queue.add(task_name(spreadsheet), payload={'spreadsheet': spreadsheet})
+            queue.add('zip', stage=1)
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def expire(self, queue, task):
+        old = queue.now() - 120
+        os.utime(queue.path('running', task.token), (old, old))
+
+    def test_claims(self):
+        first, second = self.queues
+        self.assertEqual(['a.xlsx~1', 'b_b.xlsx~1', 'zip~1'], first.tokens('pending'))
+        task_a = first.claim()
+        task_b = second.claim()
+        self.assertEqual(('a.xlsx', 'b_b.xlsx'), (task_a.task_id, task_b.task_id))
+        self.assertEqual({'spreadsheet': 'b b.xlsx'}, task_b.payload)
+        # the zip task waits for the conversions
+        self.assertIsNone(first.claim())
+        first.complete(task_a)
+        second.fail(task_b, 'broken spreadsheet')
+        zip_task = first.claim()
+        self.assertEqual('zip', zip_task.task_id)
+        self.assertFalse(second.drained())
+        first.complete(zip_task, {'zips': 2})
+        self.assertTrue(second.drained())
+        self.assertEqual({'worker': 'node-0', 'attempt': 1, 'zips': 2}, second.results('done')['zip'])
+        self.assertEqual('broken spreadsheet', second.results('failed')['b_b.xlsx']['error'])
+
+    def test_expired_lease(self):
+        first, second = self.queues
+        task = first.claim()
+        second.claim()
+        self.expire(first, task)
+        # the task of the crashed worker is claimed again
+        retried = second.claim()
+        self.assertEqual((task.task_id, 2), (retried.task_id, retried.attempt))
+        self.expire(second, retried)
+        self.assertIsNone(first.claim())
+        self.assertIn('lease expired 2 times', first.results('failed')[task.task_id]['error'])
+        # a worker finishing after its lease expired is harmless, the task stays failed
+        first.complete(task)
+        self.assertNotIn(task.task_id, first.results('done'))
+        self.assertIn(task.task_id, first.results('failed'))
+        self.assertEqual(['b_b.xlsx~1~node-1'], first.tokens('running'))
+
+    def test_task_without_token(self):
+        first, second = self.queues
+        # a worker crashed after writing the definition of a conversion, before its token
+        self.assertTrue(first.add('c.xlsx'))
+        os.remove(first.path('pending', 'c.xlsx~1'))
+        for _ in range(2):
+            second.complete(second.claim())
+        # the zip task waits for the conversion without a token
+        self.assertIsNone(second.claim())
+        self.assertFalse(second.drained())
+        old = second.now() - 120
+        os.utime(second.path('tasks', 'c.xlsx.json'), (old, old))
+        self.assertEqual('c.xlsx', second.claim().task_id)
+        self.assertEqual([], first.tokenless())
+
+    def test_run_worker(self):
+        handled = []
+        def handle(task):
+            handled.append(task.task_id)
+            if task.task_id == 'b_b.xlsx':
+                raise RuntimeError('not converted')
+            return {}
+        self.assertEqual(3, run_worker(self.queues[0], handle, poll=0))
+        self.assertEqual(['a.xlsx', 'b_b.xlsx', 'zip'], handled)
+        self.assertEqual(['a.xlsx', 'zip'], sorted(self.queues[1].results('done')))
+        self.assertEqual(0, run_worker(self.queues[1], handle, poll=0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from io import StringIO
+
+import pandas as pd
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from benchmarks.ols_standin import OlsStandIn
+from benchmarks.ols_throughput import clear_ols_caches
+from dcp_to_tier1 import main as dcp_to_tier1
+from src.tier1_project import GROUP_FIELD, Tier1Project
+from test_flatten_dcp import SAMPLE_VALUES, dcp_spreadsheet
+
+PROJECT_VALUES = {
+    'Project': {
+        'PROJECT TITLE (Required)': ['The title of the project.', '', 'project.project_core.project_title', '',
+                                     'Adult heart and lung']
+    },
+    'Project - Contributors': {
+        'CONTACT NAME (Required)': ['Name of individual who has contributed to the project.', '', 'project.contributors.name', '',
+                                    'Jane,,Doe'],
+        'EMAIL ADDRESS': ['Email address for the individual.', '', 'project.contributors.email', '',
+                          'jane@example.org'],
+        'CORRESPONDING CONTRIBUTOR': ['Whether the individual is a primary point of contact for the project.', '',
+                                      'project.contributors.corresponding_contributor', '', 'yes']
+    }
+}
+
+
+def project_spreadsheet(spreadsheet_path: str):
+    """Save the sample workbook, with the project and the fields needed for the tier 1 conversion"""
+    donor_values = {**SAMPLE_VALUES['Donor organism'], 'DEVELOPMENT STAGE ONTOLOGY ID': [
+        'The ontology term ID of the development stage.', '', 'donor_organism.development_stage.ontology', '',
+        'HsapDv:0000087', 'HsapDv:0000087'],
+        'IS LIVING': ['Whether the organism is alive when the sample is collected.', '', 'donor_organism.is_living', '',
+                      'no', 'yes']}
+    library_values = {**SAMPLE_VALUES['Library preparation protocol'], 'NUCLEIC ACID SOURCE': [
+        'Source cells or tissues from which nucleic acid molecules were collected.', '',
+        'library_preparation_protocol.nucleic_acid_source', '', 'single cell'],
+        'END BIAS': ['The type of tags or end bias the library has.', '', 'library_preparation_protocol.end_bias', '',
+                     '3 prime tag']}
+    specimen_values = {**SAMPLE_VALUES['Specimen from organism'],
+                       'ORGAN ONTOLOGY ID': ['The ontology term ID of the organ.', '', 'specimen_from_organism.organ.ontology', '',
+                                             'UBERON:0000948', 'UBERON:0000948', 'UBERON:0002048'],
+                       'ORGAN ONTOLOGY LABEL': ['The ontology label of the organ.', '', 'specimen_from_organism.organ.ontology_label', '',
+                                                'heart', 'heart', 'lung']}
+    dcp_spreadsheet({**PROJECT_VALUES, **SAMPLE_VALUES, 'Donor organism': donor_values,
+                     'Specimen from organism': specimen_values,
+                     'Library preparation protocol': library_values}).book.save(spreadsheet_path)
+
+
+class TestTier1Project(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.TemporaryDirectory()
+        cls.spreadsheet_path = os.path.join(cls.work_dir.name, 'project.xlsx')
+        project_spreadsheet(cls.spreadsheet_path)
+        # sex and development stage terms are looked up in a local OLS
+        cls.server = OlsStandIn(('127.0.0.1', 0), missing='synthetic')
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        os.environ['OLS_BASE_URL'] = cls.server.base_url
+        clear_ols_caches()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        os.environ.pop('OLS_BASE_URL')
+        clear_ols_caches()
+        cls.work_dir.cleanup()
+
+    def open_project(self):
+        project = Tier1Project.open(self.spreadsheet_path, use_cache=False)
+        self.addCleanup(project.close)
+        return project
+
+    def test_donor_query(self):
+        project = self.open_project()
+        self.assertEqual(['donor_1', 'donor_2'], project.donors())
+        self.assertEqual(['specimen_1', 'specimen_2'], project.samples(donor_id='donor_1'))
+        # only the specimens of the donor are converted
+        self.assertEqual(['specimen_1', 'specimen_2'], sorted(project.groups))
+        donor_tab = project.tab('Tier 1 Donor Metadata', donor_id='donor_2')
+        self.assertEqual([['donor_2', 'male']], donor_tab[['donor_id', 'sex_ontology_term']].values.tolist())
+        with self.assertRaises(ValueError):
+            project.tab('Tier 1 Donors')
+
+    def test_sample_query(self):
+        obs = self.open_project().obs(sample_id=['specimen_2'])
+        self.assertEqual(['specimen_2'], obs['sample_id'].tolist())
+        self.assertEqual(['cell_suspension_3||cell_suspension_4'], obs['library_id'].tolist())
+
+    def test_queries_match_whole_project(self):
+        project = self.open_project()
+        by_donor = pd.concat([project.obs(donor_id=donor_id) for donor_id in project.donors()], ignore_index=True)
+        pd.testing.assert_frame_equal(self.open_project().obs(), by_donor)
+        # converted specimens are reused
+        pd.testing.assert_frame_equal(by_donor, project.obs())
+
+    def test_matches_conversion(self):
+        output_dir = os.path.join(self.work_dir.name, 'tier1')
+        dcp_to_tier1(self.spreadsheet_path, os.path.join(self.work_dir.name, 'flat'), output_dir, GROUP_FIELD, False,
+                     tier1_only=True, use_sheet_cache=False, tmp_dir=self.work_dir.name)
+        converted = pd.read_csv(os.path.join(output_dir, 'project_tier1.csv'), dtype=str)
+        # written and read back as the conversion writes its obs table
+        obs = pd.read_csv(StringIO(self.open_project().obs().to_csv(index=False)), dtype=str)
+        pd.testing.assert_frame_equal(converted, obs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.dcp_to_tier1_mapping import TIER1
+from src.tier1_validator import validate_obs, validate_tier1
+
+
+def tier1_obs(rows=3) -> pd.DataFrame:
+    obs = pd.DataFrame(np.nan, index=range(rows), columns=TIER1['obs'], dtype=object)
+    return obs.assign(
+        sample_id=[f'sample_{idx}' for idx in range(rows)],
+        donor_id=[f'donor_{idx % 2}' for idx in range(rows)],
+        library_id=[f'library_{idx}_0||library_{idx}_1' for idx in range(rows)],
+        organism_ontology_term_id='NCBITaxon:9606',
+        sex_ontology_term_id=['PATO:0000383' if idx % 2 else 'unknown' for idx in range(rows)],
+        tissue_ontology_term_id='UBERON:0002190',
+        assay_ontology_term_id='EFO:0009899||EFO:0009922',
+        suspension_type='cell',
+        sample_collection_method='biopsy||surgical resection',
+        sequenced_fragment='3 prime tag',
+        disease_ontology_term_id='PATO:0000461',
+        development_stage_ontology_term_id='HsapDv:0000237'
+    )
+
+
+class TestTier1Validator(unittest.TestCase):
+
+    def test_valid_obs(self):
+        self.assertEqual([], validate_obs(tier1_obs()))
+
+    def test_invalid_values(self):
+        obs = tier1_obs(4)
+        obs.loc[[0, 2], 'sex_ontology_term_id'] = 'male'
+        obs.loc[1, 'development_stage_ontology_term_id'] = 'HsapDv_0000237'
+        obs['suspension_type'] = 'single cell||cell'
+        obs.loc[3, 'tissue_ontology_term_id'] = np.nan
+        violations = {(violation.column, violation.rows, tuple(violation.values)) for violation in validate_obs(obs)}
+        self.assertEqual({
+            ('sex_ontology_term_id', 2, ('male',)),
+            ('development_stage_ontology_term_id', 1, ('HsapDv_0000237',)),
+            ('suspension_type', 4, ('single cell',)),
+            ('tissue_ontology_term_id', 1, ())
+        }, violations)
+
+    def test_ambiguous_keys(self):
+        obs = tier1_obs(4)
+        # donor_1 with two sexes, a sample with two tissues and a library in two samples
+        obs.loc[3, 'sex_ontology_term_id'] = 'PATO:0000384'
+        obs.loc[2, ['sample_id', 'tissue_ontology_term_id']] = ['sample_0', 'UBERON:0002048']
+        obs.loc[1, 'library_id'] = 'library_0_1'
+        violations = {violation.column: violation.values for violation in validate_obs(obs)}
+        self.assertEqual({'donor_id': ['donor_1'], 'sample_id': ['sample_0'], 'library_id': ['library_0_1']},
+                         violations)
+
+    def test_denormalised_obs(self):
+        # one row per file and protocol, the libraries, runs and protocols of a sample differ between its rows
+        obs = pd.concat([tier1_obs(), tier1_obs()], ignore_index=True)
+        obs['sample_collection_method'] = ['biopsy'] * 3 + ['surgical resection'] * 3
+        obs['library_id'] = [f'library_{idx}' for idx in range(len(obs))]
+        obs['library_sequencing_run'] = [f'run_{idx % 2}' for idx in range(len(obs))]
+        obs['cell_number_loaded'] = [str(1000 * idx) for idx in range(len(obs))]
+        # an organoid group exploded into one row per organoid, with the same library
+        organoids = pd.concat([tier1_obs(1)] * 2, ignore_index=True).assign(sample_id=['organoid_1', 'organoid_2'],
+                                                                              library_id='library_organoid')
+        obs = pd.concat([obs, organoids], ignore_index=True)
+        self.assertEqual([], validate_obs(obs))
+
+    def test_abort(self):
+        obs = tier1_obs()
+        obs['suspension_type'] = 'cells'
+        self.assertEqual([], validate_tier1(obs, 'off'))
+        self.assertEqual(1, len(validate_tier1(obs, 'warn')))
+        with self.assertRaises(ValueError):
+            validate_tier1(obs, 'abort')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.vocabulary import map_distinct, map_values
+
+END_BIAS = pd.Series(['3 prime end bias', 'full length', np.nan, 'probe-based', '3 prime end bias'],
+                     index=[2, 2, 5, 7, 9], name='library_preparation_protocol.end_bias')
+SEQ_FRAG = {'3 prime end bias': '3 prime tag', 'full length': 'full length'}
+
+
+class TestVocabulary(unittest.TestCase):
+
+    def test_dict_mapping_like_replace(self):
+        mapped = map_values(END_BIAS, SEQ_FRAG)
+        pd.testing.assert_series_equal(END_BIAS.replace(SEQ_FRAG), mapped, check_dtype=False)
+        self.assertIs(np.nan, mapped.iloc[2])
+
+    def test_unmapped_counted_per_column(self):
+        unmapped = {}
+        map_values(END_BIAS, SEQ_FRAG, unmapped)
+        map_values(END_BIAS.iloc[3:], SEQ_FRAG, unmapped)
+        self.assertDictEqual({'probe-based': 2}, dict(unmapped[END_BIAS.name]))
+
+    def test_function_called_once_per_value(self):
+        calls = []
+        def upper(value):
+            calls.append(value)
+            return value.upper() if isinstance(value, str) else value
+        self.assertListEqual(['3 PRIME END BIAS', 'FULL LENGTH', np.nan, 'PROBE-BASED', '3 PRIME END BIAS'],
+                             map_values(END_BIAS, upper).tolist())
+        self.assertEqual(4, len(calls))
+
+    def test_map_distinct(self):
+        mapped = map_distinct(END_BIAS, lambda values: values.str.len())
+        self.assertListEqual([16, 11, 11, 16], mapped.dropna().tolist())
+        self.assertListEqual(END_BIAS.index.tolist(), mapped.index.tolist())
+
+
+if __name__ == "__main__":
+    unittest.main()
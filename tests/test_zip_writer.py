@@ -0,0 +1,61 @@
+import os
+import sys
+import tempfile
+import unittest
+import zipfile
+from io import BytesIO
+
+import pandas as pd
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.zip_writer import CODECS, normalise_xlsx, write_zip, write_zip_if_changed
+
+MEMBERS = {
+    'Smith (2020) Nature.csv': b'sample_id,donor_id\nspecimen_1,donor_1\n' * 100,
+    'Doe (2021) Cell.csv': b'sample_id,donor_id\nspecimen_2,donor_2\n' * 100,
+    'Müller (2022) bioRxiv.csv': b'',
+}
+
+
+class TestZipWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.zip_path = os.path.join(self.tmp_dir.name, 'bionetwork_tier1.zip')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_readable_archive(self):
+        for codec in CODECS:
+            write_zip(MEMBERS, self.zip_path, codec=codec)
+            with zipfile.ZipFile(self.zip_path) as zip_file:
+                self.assertIsNone(zip_file.testzip())
+                self.assertEqual(sorted(MEMBERS), zip_file.namelist())
+                self.assertEqual(MEMBERS, {name: zip_file.read(name) for name in zip_file.namelist()})
+                self.assertEqual({CODECS[codec]}, {info.compress_type for info in zip_file.infolist()})
+
+    def test_deterministic_archive(self):
+        write_zip(MEMBERS, self.zip_path, codec='deflated')
+        reversed_members = dict(reversed(list(MEMBERS.items())))
+        self.assertTrue(write_zip_if_changed(MEMBERS, self.zip_path + '.copy', codec='deflated'))
+        self.assertFalse(write_zip_if_changed(reversed_members, self.zip_path, codec='deflated'))
+        with open(self.zip_path, 'rb') as first, open(self.zip_path + '.copy', 'rb') as second:
+            self.assertEqual(first.read(), second.read())
+        self.assertEqual(['bionetwork_tier1.zip', 'bionetwork_tier1.zip.copy'], sorted(os.listdir(self.tmp_dir.name)))
+
+    def test_normalise_xlsx(self):
+        def xlsx():
+            output = BytesIO()
+            with pd.ExcelWriter(output) as writer:
+                pd.DataFrame({'sample_id': ['specimen_1']}).to_excel(writer, sheet_name='Tier 1 Sample Metadata')
+            return output.getvalue()
+        first = normalise_xlsx(xlsx())
+        self.assertEqual(first, normalise_xlsx(xlsx()))
+        self.assertEqual(['specimen_1'], pd.read_excel(BytesIO(first), index_col=0)['sample_id'].tolist())
+
+
+if __name__ == "__main__":
+    unittest.main()